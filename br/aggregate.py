@@ -1,9 +1,22 @@
+from __future__ import annotations
+
 from dataclasses import dataclass
 from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
 
+from br.killmail_parser import CAPSULES
+from br.km_table import KillmailTable, load_km_table
+from br.names import get_name_table
+from br.parser2 import AllData
+from br.util import get_killmail_id
 from data.sde import STATION_FIGHTERS
+from models.battle_report_2 import Battle2, StructureTimer, TeamReport
 from models.eve import StructureType
 
+STATION_FIGHTER_NAMES = set(STATION_FIGHTERS.values())
+
 
 @dataclass
 class StructureKillTime:
@@ -12,115 +25,146 @@ class StructureKillTime:
     timer: datetime
 
 
-def aggregate_additional_data(battles: list):
-    for battle in battles:
-        attempt_trash_filter(battle)
-        add_station_timer_for_fighter(battle)
-
-
-def attempt_trash_filter(battle: Battle):
-    if len(battle.structures) == 0:
-        return {}
-
-    all_structure_kill_times = {}
-    for team, stations in battle.structures.items():
-        for idx, station in enumerate([s for s in stations if s.destroyed_on is not None]):
-            station_killmail = find_killmail(battle.raw_json.get("kms", []), url=station.zkill_link)
-            km_timestamp = station_killmail.get("time")
-            # ship_id = station_killmail.get("victim", {}).get("ship")
-
-            if len(station_killmail.keys()) > 0 and km_timestamp is not None:  # and ship_id in KNOWN_STATION_IDs
-                all_structure_kill_times.setdefault(team, []).append(
-                    StructureKillTime(
-                        qualifier=idx + 1, type=station.type, timer=datetime.fromtimestamp(km_timestamp / 1000)
-                    )
-                )
-
-    probable_trash = {}
-    for team, structure_timers in all_structure_kill_times.items():
-        for idx, timer in enumerate(structure_timers):
-            for participant in battle.raw_json["kms"]:
-                killmail_time = datetime.fromtimestamp(participant["time"] / 1000)
-                if len(structure_timers) > idx + 1 and killmail_time >= structure_timers[idx + 1].timer:
-                    break
-                if timer.timer < killmail_time:
-                    structures_that_died = probable_trash.setdefault(team, {})
-                    structures_that_died.setdefault(f"{timer.type.value}-{timer.qualifier}", []).append(
-                        participant["id"]
-                    )
+def aggregate_additional_data(all_data: AllData, table: KillmailTable = None) -> Dict[str, Dict[str, dict]]:
+    """
+    probable trash for every battle, {br id: {team letter: {"<structure type>-<n>": [km ids]}}}, also set on each
+    TeamReport.probable_trash. Battles with structure fighters but no structure get TeamReport.unknown_timers on
+    the side that flew them. table defaults to the killmail table of cache/
+    """
+    if table is None:
+        table = load_km_table()
 
     output = {}
-    for team, trash_data in probable_trash.items():
-        for struct, ids in trash_data.items():
-            output[struct] = [
-                p for p in battle.team_participants[team] if get_killmail_id(p.zkill_link) in ids and not p.podded
-            ]
+    for battle in all_data.battles.values():
+        trash = attempt_trash_filter(battle, table)
+        if len(trash) > 0:
+            output[battle.battle_identifier] = trash
+        add_station_timer_for_fighter(battle, all_data, table)
 
     return output
 
 
-def find_fighters(battle: Battle):
-    for team, participants in battle.team_participants.items():
-        for p in participants:
-            if p.ship in STATION_FIGHTERS.values():
-                return p, team, True
-
-    killmails = []
-    if "relateds" in battle.raw_json.keys():
-        relateds = battle.raw_json.get("relateds", [])
-        if len("relateds") > 0:
-            killmails = relateds[0].get("kms", [])
-    else:
-        killmails = battle.raw_json.get("kms", [])
-    for km in killmails:
-        victim = km.get("vict", km.get("victim", None))
-        if victim is None:
-            continue
-        if victim["ship"] in STATION_FIGHTERS.keys():
-            ally = victim["ally"]
-            return ally if ally != 0 else victim["corp"], "X", True
-
-    return None, None, False
+def structure_kill_times(battle: Battle2, team: TeamReport, table: KillmailTable) -> List[StructureKillTime]:
+    """
+    the structures this side lost, in the order they died
+    """
+    kill_times = []
+    destroyed = [s for s in team._structures if s.destroyed_here and not s.is_gunner_entry]
+    for idx, structure in enumerate(destroyed):
+        row = find_killmail(table, battle.battle_identifier, url=structure.km_link)
+        if row is not None:
+            kill_times.append(
+                StructureKillTime(
+                    qualifier=idx + 1, type=structure.type, timer=datetime.fromtimestamp(int(table.km_time[row]))
+                )
+            )
 
+    return sorted(kill_times, key=lambda t: t.timer)
 
-def add_station_timer_for_fighter(battle: Battle):
-    owner, team, has_fighters = find_fighters(battle)
-    if len(battle.structures) == 0 and has_fighters:
-        if isinstance(owner, int):
-            owner = EveAlliance(name="", image_link=str(owner), corps={})  # get_esi_id(owner)
-        else:
-            owner = EveAlliance(name=owner.name, image_link=owner.zkill_link, corps={owner.corp: "0"})
 
-        unknown_timer = StationKill(
-            type=StructureType.UNKNOWN,
-            value=0.0,
-            owner=owner,
-            unknown_timer_on=battle.time_data.started,
-            system=battle.system,
-            zkill_link=None,
-        )
+def attempt_trash_filter(battle: Battle2, table: KillmailTable) -> Dict[str, Dict[str, List[int]]]:
+    """
+    What a side lost after one of its structures died and before the next did is mostly what dropped out of it, so
+    those kms are probable trash. Losses of pilots who were also podded here are left out, they were flying.
 
-        unknown_timer.estimate_timer()
+    kms come off the table in time order, so each window between kills is one searchsorted
+    """
+    rows = table.rows(battle.battle_identifier)
+    if rows is None:
+        return {}
 
-        battle.structures.setdefault(team, []).append(unknown_timer)
+    # pilots who lost a pod here, and the pod kms themselves
+    capsules = np.isin(table.victim_ship[rows], list(CAPSULES))
+    podded = set(table.victim_char[rows][capsules].tolist()) - {0}
+    not_trash = set(table.km_id[rows][capsules].tolist())
+    not_trash.update(table.km_id[rows][np.isin(table.victim_char[rows], list(podded))].tolist())
 
+    output = {}
+    for team in battle.teams:
+        team.probable_trash = {}
+        kill_times = structure_kill_times(battle, team, table)
+        if len(kill_times) == 0:
+            continue
 
-def find_killmail(killmails: list, km_id: int = None, url: str = None) -> dict:
-    if url is not None:
-        km_id = get_killmail_id(url)
-    elif km_id is not None:
-        km_id = int(km_id)
-    else:
-        return {}
+        team_kms = {get_killmail_id(link) for link in team.km_links if link is not None}
+        for idx, kill_time in enumerate(kill_times):
+            before = kill_times[idx + 1].timer.timestamp() if len(kill_times) > idx + 1 else None
+            trash = [
+                km_id
+                for km_id in table.kms_between(battle.battle_identifier, kill_time.timer.timestamp(), before).tolist()
+                if km_id in team_kms and km_id not in not_trash
+            ]
+            if len(trash) > 0:
+                team.probable_trash[f"{kill_time.type.value}-{kill_time.qualifier}"] = trash
 
-    for km in killmails:
-        if km.get("id") == km_id:
-            return km
+        if len(team.probable_trash) > 0:
+            output[team.br_team_letter] = team.probable_trash
 
-    return {}
+    return output
 
 
-def get_killmail_id(url: str):
-    if url is None:
+def find_fighters(
+    battle: Battle2, all_data: AllData, table: KillmailTable
+) -> Tuple[Optional[TeamReport], Optional[Tuple[Optional[str], str]]]:
+    """
+    the side that flew structure fighters and the (alliance, corp) they belonged to, (None, None) if nobody did. A
+    fighter that died without showing on the br still has a km, its side is the one that lost it
+    """
+    for team in battle.teams:
+        for idx, ship in enumerate(team.ships):
+            if ship in STATION_FIGHTER_NAMES:
+                # ships and corps get an entry for every participant, so they line up
+                corp = all_data.corps.get(team.corps[idx])
+                return team, (corp.alliance if corp is not None else None, team.corps[idx])
+
+    rows = table.victims_in(battle.battle_identifier, STATION_FIGHTERS.keys())
+    if len(rows) == 0:
+        return None, None
+
+    names = get_name_table()
+    ally = int(table.victim_ally[rows[0]])
+    corp = int(table.victim_corp[rows[0]])
+    owner = (
+        (names.name("alliance", ally) or str(ally)) if ally != 0 else None,
+        names.name("corporation", corp) or str(corp),
+    )
+    km_id = int(table.km_id[rows[0]])
+    for team in battle.teams:
+        if km_id in {get_killmail_id(link) for link in team.km_links if link is not None}:
+            return team, owner
+
+    return None, owner
+
+
+def add_station_timer_for_fighter(battle: Battle2, all_data: AllData, table: KillmailTable):
+    """
+    Fighters launched with no structure on the br mean a structure of theirs was attacked out of sight. Its type
+    isn't known, so every timer it could have been on is estimated from when the battle started
+    """
+    if any(len(team._structures) > 0 for team in battle.teams):
+        return
+
+    team, owner = find_fighters(battle, all_data, table)
+    if team is None:
+        return
+
+    started = battle.time_data.started
+    team.fighters_owner = owner
+    team.unknown_timers = [
+        StructureTimer().estimate_timer(True, started, hp_type="shield"),
+        StructureTimer().estimate_timer(False, started, hp_type="hull"),
+        StructureTimer().estimate_timer(False, started, hp_type="armor"),
+        StructureTimer().estimate_timer(False, started, hp_type="shield"),
+    ]
+
+
+def find_killmail(table: KillmailTable, br_id: str, km_id: int = None, url: str = None) -> Optional[int]:
+    """
+    the table row of the killmail in br_id's kms, None if it isn't there
+    """
+    if url is not None:
+        km_id = get_killmail_id(url)
+    if km_id is None:
         return None
-    return int(url.split("/")[-2])
+
+    return table.find_killmail(km_id, br_id)
@@ -0,0 +1,127 @@
+import time
+from typing import List, Optional, Set, Tuple
+
+from br.cache_store import KINDS, PARSED, CacheStore, get_cache_store
+from br.parsed_cache import parser_hash
+from br.parser2 import load_br_links
+from br.util import cached_key
+
+# the store is trimmed back under this many MB of stored (compressed) payloads after each run, None for no cap
+CACHE_BUDGET_MB: Optional[float] = None
+# "lru": evict whatever was used least recently
+# "html": only ever evict rendered pages the parsed tier already covers, oldest first. The jsons are kept
+CACHE_POLICY = "html"
+POLICIES = ["lru", "html"]
+
+
+def protected(store: CacheStore, br_links: List[str]) -> Set[Tuple[str, str]]:
+    """
+    the (key, kind) entries that are the only source of some battle in br_links. Its json is the only copy of its
+    killmails, and its page is needed until this parser has read it into the parsed tier, which is then needed in
+    turn
+    """
+    parser = parser_hash()
+    keep = set()
+    for url in br_links:
+        key = cached_key(url)
+        keep.add((key, "json"))
+        if store.has_parsed(key, parser):
+            keep.add((key, PARSED))
+        else:
+            keep.add((key, "html"))
+    return keep
+
+
+def eviction_order(
+    store: CacheStore, br_links: List[str], policy: str = CACHE_POLICY
+) -> Tuple[List[Tuple[str, str, int]], List[Tuple[str, str, int]]]:
+    """
+    (key, kind, stored bytes) of the parsed rows an older parser wrote, which are never read again, and of what
+    policy can evict, first to go first
+    """
+    if policy not in POLICIES:
+        raise ValueError(f"policy of {policy} not valid. Should be one of {POLICIES}")
+
+    parser = parser_hash()
+    keep = protected(store, br_links)
+    stale, candidates = [], []
+    for key, kind, accessed, stored in store.items():
+        if (key, kind) in keep:
+            continue
+        if kind == PARSED and not store.has_parsed(key, parser):
+            stale.append((key, kind, stored))
+        elif policy == "lru" or (kind == "html" and store.has_parsed(key, parser)):
+            candidates.append((accessed, key, kind, stored))
+
+    return stale, [(key, kind, stored) for _, key, kind, stored in sorted(candidates)]
+
+
+def collect(
+    br_links: List[str] = None,
+    budget_mb: Optional[float] = CACHE_BUDGET_MB,
+    policy: str = CACHE_POLICY,
+    store: CacheStore = None,
+    dry_run: bool = False,
+) -> List[Tuple[str, str, int]]:
+    """
+    evicts the stale parsed rows, then in policy's order until the stored payloads fit in budget_mb, and returns what
+    went. With no budget "html" evicts every page the parsed tier covers and "lru" nothing past the stale rows
+    """
+    if store is None:
+        store = get_cache_store()
+    if br_links is None:
+        br_links = load_br_links()
+
+    stored = sum(size for _, size in store.tier_sizes().values())
+    budget = None if budget_mb is None else budget_mb * 1e6
+    stale, candidates = eviction_order(store, br_links, policy)
+    evicted = list(stale)
+    stored -= sum(size for _, _, size in stale)
+    for key, kind, size in candidates:
+        if (budget is None and policy == "lru") or (budget is not None and stored <= budget):
+            break
+        evicted.append((key, kind, size))
+        stored -= size
+
+    if budget is not None and stored > budget:
+        print(f"Cache is {stored / 1e6:.1f}MB after evicting, everything left is needed by battle_reports.txt")
+    if not dry_run and len(evicted) > 0:
+        store.evict([(key, kind) for key, kind, _ in evicted])
+    return evicted
+
+
+def report(store: CacheStore = None) -> str:
+    if store is None:
+        store = get_cache_store()
+    sizes = store.tier_sizes()
+    counters = store.counters()
+
+    lines = [f"{store.path}: {store.stats()['file_bytes'] / 1e6:.1f}MB on disk"]
+    for kind in [*KINDS, PARSED]:
+        count, stored = sizes[kind]
+        hits, misses = counters.get(f"{kind}_hits", 0), counters.get(f"{kind}_misses", 0)
+        hit_rate = f"{hits / (hits + misses):.1%}" if hits + misses > 0 else "-"
+        lines.append(
+            f"{kind:>6}: {count} entries, {stored / 1e6:.1f}MB stored, {hits} hits / {misses} misses ({hit_rate}), "
+            f"{counters.get(f'{kind}_evictions', 0)} evicted"
+        )
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Report on or trim the cache store")
+    parser.add_argument("command", choices=["stats", "gc"])
+    parser.add_argument("--budget", type=float, default=CACHE_BUDGET_MB, help="MB of stored payloads to trim to")
+    parser.add_argument("--policy", choices=POLICIES, default=CACHE_POLICY)
+    parser.add_argument("--dry-run", action="store_true", help="only list what gc would evict")
+    args = parser.parse_args()
+
+    if args.command == "gc":
+        started = time.perf_counter()
+        evicted = collect(budget_mb=args.budget, policy=args.policy, dry_run=args.dry_run)
+        freed = sum(size for _, _, size in evicted)
+        verb = "would evict" if args.dry_run else "evicted"
+        print(f"{verb} {len(evicted)} entries ({freed / 1e6:.1f}MB) in {time.perf_counter() - started:.2f}s")
+    print(report())
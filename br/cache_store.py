@@ -0,0 +1,460 @@
+import atexit
+import hashlib
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import zlib
+from collections import Counter
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+from br.instrument import count
+
+CACHE_DIR = "cache"
+CACHE_STORE_PATH = "cache/cache.sqlite"
+COMPRESSION_LEVEL = 6
+# seconds before a key lock nobody released (a killed fetcher) can be taken by someone else
+LOCK_TIMEOUT = 300
+LOCK_POLL = 0.2
+
+# kind -> the file it was in under the old cache/<key>/ layout
+KINDS = {"json": "esi_data.json", "html": "br.html"}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS blobs (hash TEXT PRIMARY KEY, size INTEGER NOT NULL, data BLOB NOT NULL);
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT NOT NULL, kind TEXT NOT NULL, hash TEXT NOT NULL REFERENCES blobs (hash), accessed REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (key, kind)
+);
+CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS parsed (
+    key TEXT PRIMARY KEY, parser TEXT NOT NULL, data BLOB NOT NULL, accessed REAL NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS locks (key TEXT PRIMARY KEY, owner TEXT NOT NULL, expires REAL NOT NULL);
+CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL);
+"""
+# the parsed tier's rows count as this kind in accessed times, counters and evictions
+PARSED = "parsed"
+
+
+class CacheStore:
+    """
+    Every cached esi json and rendered br page in one sqlite file, zlib compressed.
+
+    Payloads are stored once per sha256 of their content and entries point a cached_key and kind ("json" or "html")
+    at one. Which entries exist is held in memory from open, so has() never touches the disk. The old cache/<key>/
+    directories are imported the first time a store is opened next to them, see migrate()
+
+    An entry is written in the same transaction as its payload, so it only exists once the payload is complete, and
+    the hash it points at doubles as the checksum get() verifies. Processes sharing the store take a per key lock
+    (acquire/release) around a fetch so only one of them pulls each key
+    """
+
+    def __init__(self, path: str = CACHE_STORE_PATH, cache_dir: str = CACHE_DIR, migrate: bool = True):
+        self.path = path
+        self.cache_dir = cache_dir
+        self._lock = threading.Lock()
+        # the fetch engine reads and writes from its worker threads
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(SCHEMA)
+        for table in ["entries", "parsed"]:
+            # stores made before last access was tracked
+            if "accessed" not in [row[1] for row in self._db.execute(f"PRAGMA table_info({table})")]:
+                self._db.execute(f"ALTER TABLE {table} ADD COLUMN accessed REAL NOT NULL DEFAULT 0")
+        self.index: Dict[Tuple[str, str], str] = {
+            (key, kind): digest for key, kind, digest in self._db.execute("SELECT key, kind, hash FROM entries")
+        }
+        # key -> hash of the parser that filled its parsed row, see br/parsed_cache.py
+        self.parsed_index: Dict[str, str] = dict(self._db.execute("SELECT key, parser FROM parsed"))
+        # hits, misses and last access times since the last flush(). A hit is a payload read back, a miss one that
+        # had to be fetched, rendered or parsed and was then put
+        self._accessed: Dict[Tuple[str, str], float] = {}
+        self._counts: Counter = Counter()
+
+        # cache/<key>/ is imported the first time a store is opened next to it. Directories that turn up later (a git
+        # pull) are imported by running this module
+        if migrate and os.path.isdir(cache_dir) and self.meta("migrated") is None:
+            self.migrate()
+
+    def has(self, key: str, kind: str) -> bool:
+        return (key, kind) in self.index
+
+    def refresh(self, key: str, kind: str) -> bool:
+        """
+        has() for an entry another process may have written since this store was opened
+        """
+        with self._lock:
+            row = self._db.execute("SELECT hash FROM entries WHERE key = ? AND kind = ?", (key, kind)).fetchone()
+        if row is not None:
+            self.index[(key, kind)] = row[0]
+        return row is not None
+
+    def get(self, key: str, kind: str) -> Optional[bytes]:
+        """
+        the payload, None if there isn't one or it no longer matches its checksum. A bad entry is dropped so it gets
+        fetched again rather than failing every run after
+        """
+        digest = self.index.get((key, kind))
+        if digest is None:
+            return None
+        with self._lock:
+            row = self._db.execute("SELECT data FROM blobs WHERE hash = ?", (digest,)).fetchone()
+
+        payload = None
+        if row is not None:
+            try:
+                payload = zlib.decompress(row[0])
+            except zlib.error:
+                payload = None
+        if payload is None or hashlib.sha256(payload).hexdigest() != digest:
+            print(f"Cached {kind} for {key} is damaged, dropping it")
+            self.drop(key, kind)
+            return None
+        self._accessed[(key, kind)] = time.time()
+        self._counts[f"{kind}_hits"] += 1
+        count(f"cache_{kind}_hits")
+        count("bytes_read", len(payload))
+        return payload
+
+    def put(self, key: str, kind: str, payload: bytes, commit: bool = True):
+        """
+        The blob and the entry pointing at it go in one transaction, so an entry only ever exists for a complete
+        payload and its sha256 is the checksum get() verifies
+        """
+        if kind not in KINDS:
+            raise ValueError(f"kind of {kind} not valid. Should be one of {list(KINDS.keys())}")
+        self._insert(key, kind, payload)
+        with self._lock:
+            if commit:
+                self._db.commit()
+        self._accessed[(key, kind)] = time.time()
+        self._counts[f"{kind}_misses"] += 1
+        count(f"cache_{kind}_misses")
+        count("bytes_written", len(payload))
+
+    def _insert(self, key: str, kind: str, payload: bytes):
+        digest = hashlib.sha256(payload).hexdigest()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR IGNORE INTO blobs (hash, size, data) VALUES (?, ?, ?)",
+                (digest, len(payload), zlib.compress(payload, COMPRESSION_LEVEL)),
+            )
+            self._db.execute("INSERT OR REPLACE INTO entries (key, kind, hash) VALUES (?, ?, ?)", (key, kind, digest))
+            self.index[(key, kind)] = digest
+
+    def drop(self, key: str, kind: str):
+        with self._lock:
+            self._db.execute("DELETE FROM entries WHERE key = ? AND kind = ?", (key, kind))
+            self._db.commit()
+            self.index.pop((key, kind), None)
+
+    def try_acquire(self, key: str, timeout: float = LOCK_TIMEOUT) -> Optional[str]:
+        """
+        takes the lock on key, shared by every process using this store, and returns the token to release it with.
+        None if someone else holds it. A lock older than timeout is taken over, its holder is assumed dead
+        """
+        token = f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}:{time.monotonic_ns()}"
+        now = time.time()
+        with self._lock:
+            self._db.execute("DELETE FROM locks WHERE key = ? AND expires < ?", (key, now))
+            taken = self._db.execute(
+                "INSERT OR IGNORE INTO locks (key, owner, expires) VALUES (?, ?, ?)", (key, token, now + timeout)
+            ).rowcount
+            self._db.commit()
+        return token if taken == 1 else None
+
+    def acquire(self, key: str, timeout: float = LOCK_TIMEOUT) -> str:
+        """
+        waits for try_acquire
+        """
+        while True:
+            token = self.try_acquire(key, timeout)
+            if token is not None:
+                return token
+            time.sleep(LOCK_POLL)
+
+    def release(self, key: str, token: str):
+        with self._lock:
+            self._db.execute("DELETE FROM locks WHERE key = ? AND owner = ?", (key, token))
+            self._db.commit()
+
+    @contextmanager
+    def locked(self, key: str):
+        token = self.acquire(key)
+        try:
+            yield
+        finally:
+            self.release(key, token)
+
+    def get_parsed(self, key: str, parser: str) -> Optional[bytes]:
+        """
+        the second tier - what a page parser got off key's page, None unless it was stored by that same parser. None
+        as well if the row has gone since the store was opened (another process's cache_gc evicted it)
+        """
+        if self.parsed_index.get(key) != parser:
+            return None
+        with self._lock:
+            row = self._db.execute("SELECT data FROM parsed WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.parsed_index.pop(key, None)
+            return None
+        self._accessed[(key, PARSED)] = time.time()
+        self._counts[f"{PARSED}_hits"] += 1
+        payload = zlib.decompress(row[0])
+        count(f"cache_{PARSED}_hits")
+        count("bytes_read", len(payload))
+        return payload
+
+    def has_parsed(self, key: str, parser: str) -> bool:
+        return self.parsed_index.get(key) == parser
+
+    def put_parsed(self, key: str, parser: str, payload: bytes):
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO parsed (key, parser, data) VALUES (?, ?, ?)",
+                (key, parser, zlib.compress(payload, COMPRESSION_LEVEL)),
+            )
+            self._db.commit()
+            self.parsed_index[key] = parser
+        self._accessed[(key, PARSED)] = time.time()
+        self._counts[f"{PARSED}_misses"] += 1
+        count(f"cache_{PARSED}_misses")
+        count("bytes_written", len(payload))
+
+    def keys(self, kind: str) -> List[str]:
+        return sorted(key for key, entry_kind in self.index if entry_kind == kind)
+
+    def digest(self, key: str, kind: str) -> Optional[str]:
+        """
+        sha256 of the payload, changes whenever the payload does
+        """
+        return self.index.get((key, kind))
+
+    def meta(self, name: str) -> Optional[str]:
+        with self._lock:
+            row = self._db.execute("SELECT value FROM meta WHERE name = ?", (name,)).fetchone()
+        return None if row is None else row[0]
+
+    def set_meta(self, name: str, value: str):
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO meta (name, value) VALUES (?, ?)", (name, value))
+            self._db.commit()
+
+    def migrate(self, cache_dir: str = None, prune: bool = False) -> int:
+        """
+        imports every cache/<key>/ file not in the store yet and returns how many. Jsons are re-dumped without the
+        indent. prune deletes the files (and emptied directories) once they are in the store
+        """
+        cache_dir = cache_dir if cache_dir is not None else self.cache_dir
+        imported = 0
+        moved = []
+        if os.path.isdir(cache_dir):
+            for key in sorted(os.listdir(cache_dir)):
+                for kind, file_name in KINDS.items():
+                    path = os.path.join(cache_dir, key, file_name)
+                    if not os.path.isfile(path):
+                        continue
+                    if not self.has(key, kind):
+                        with open(path, "rb") as f:
+                            payload = f.read()
+                        try:
+                            if kind == "json":
+                                payload = json.dumps(json.loads(payload)).encode("utf-8")
+                            else:
+                                payload.decode("utf-8")
+                        except ValueError:
+                            # half written by the old save_cache, it gets fetched again instead
+                            print(f"Skipping damaged {path}")
+                            continue
+                        self._insert(key, kind, payload)
+                        imported += 1
+                    moved.append(path)
+
+        with self._lock:
+            self._db.commit()
+            # a big import leaves the write ahead log as large as the store until something checkpoints it
+            self._db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+        # only once the import is committed, so an interrupted prune never loses anything
+        if prune:
+            for path in moved:
+                os.remove(path)
+                if len(os.listdir(os.path.dirname(path))) == 0:
+                    os.rmdir(os.path.dirname(path))
+        self.set_meta("migrated", "1")
+        if imported > 0:
+            print(f"Moved {imported} cache files from {cache_dir}/ into {self.path}")
+        return imported
+
+    def flush(self):
+        """
+        writes the access times and hit/miss counts gathered since the last flush. Once per run rather than on every
+        read, get_cache_store() flushes the shared store on exit
+        """
+        if len(self._accessed) == 0 and len(self._counts) == 0:
+            return
+        accessed, self._accessed = self._accessed, {}
+        counts, self._counts = self._counts, Counter()
+        with self._lock:
+            self._db.executemany(
+                "UPDATE parsed SET accessed = ? WHERE key = ?",
+                [(at, key) for (key, kind), at in accessed.items() if kind == PARSED],
+            )
+            self._db.executemany(
+                "UPDATE entries SET accessed = ? WHERE key = ? AND kind = ?",
+                [(at, key, kind) for (key, kind), at in accessed.items() if kind != PARSED],
+            )
+            self._db.executemany(
+                "INSERT INTO counters (name, value) VALUES (?, ?) "
+                "ON CONFLICT (name) DO UPDATE SET value = value + excluded.value",
+                list(counts.items()),
+            )
+            self._db.commit()
+
+    def counters(self) -> Dict[str, int]:
+        """
+        hits, misses and evictions per kind over the life of the store
+        """
+        self.flush()
+        with self._lock:
+            return dict(self._db.execute("SELECT name, value FROM counters"))
+
+    def items(self) -> List[Tuple[str, str, float, int]]:
+        """
+        (key, kind, last accessed, stored bytes) for every entry and parsed row
+        """
+        self.flush()
+        with self._lock:
+            items = self._db.execute(
+                "SELECT key, kind, accessed, LENGTH(data) FROM entries JOIN blobs USING (hash)"
+            ).fetchall()
+            items += self._db.execute(f"SELECT key, '{PARSED}', accessed, LENGTH(data) FROM parsed").fetchall()
+        return items
+
+    def tier_sizes(self) -> Dict[str, Tuple[int, int]]:
+        """
+        kind -> (entries, stored bytes)
+        """
+        sizes = {kind: [0, 0] for kind in [*KINDS, PARSED]}
+        for _, kind, _, stored in self.items():
+            sizes[kind][0] += 1
+            sizes[kind][1] += stored
+        return {kind: (count, stored) for kind, (count, stored) in sizes.items()}
+
+    def evict(self, items: List[Tuple[str, str]]) -> int:
+        """
+        drops every (key, kind) in items, kind being one of KINDS or PARSED, along with payloads nothing points at
+        anymore, and shrinks the file. Returns the bytes the file shrank by
+        """
+        before = os.path.getsize(self.path)
+        with self._lock:
+            for key, kind in items:
+                if kind == PARSED:
+                    self._db.execute("DELETE FROM parsed WHERE key = ?", (key,))
+                    self.parsed_index.pop(key, None)
+                else:
+                    self._db.execute("DELETE FROM entries WHERE key = ? AND kind = ?", (key, kind))
+                    self.index.pop((key, kind), None)
+                self._accessed.pop((key, kind), None)
+                self._counts[f"{kind}_evictions"] += 1
+            self._db.execute("DELETE FROM blobs WHERE hash NOT IN (SELECT hash FROM entries)")
+            self._db.commit()
+            # sqlite only gives deleted pages back to the filesystem on a vacuum
+            self._db.execute("VACUUM")
+            self._db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        self.flush()
+        return before - os.path.getsize(self.path)
+
+    def stats(self) -> dict:
+        with self._lock:
+            blobs, raw, stored = self._db.execute(
+                "SELECT COUNT(*), SUM(size), SUM(LENGTH(data)) FROM blobs"
+            ).fetchone()
+        return {
+            "entries": len(self.index),
+            "blobs": blobs,
+            "raw_bytes": raw or 0,
+            "stored_bytes": stored or 0,
+            "file_bytes": os.path.getsize(self.path),
+        }
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            self._db.close()
+
+
+_STORE: Optional[CacheStore] = None
+_STORE_PID: Optional[int] = None
+
+
+def get_cache_store() -> CacheStore:
+    """
+    the shared store. Opened again in a new process, a sqlite connection can't be shared with a forked child
+    """
+    global _STORE, _STORE_PID
+    if _STORE is None or _STORE_PID != os.getpid():
+        os.makedirs(os.path.dirname(CACHE_STORE_PATH) or ".", exist_ok=True)
+        _STORE = CacheStore()
+        _STORE_PID = os.getpid()
+        atexit.register(_STORE.flush)
+    return _STORE
+
+
+def use_cache_store(store: Optional[CacheStore]):
+    """
+    swaps the shared store for another, such as an empty one to benchmark filling. The one it replaces is closed,
+    None goes back to opening the default on next use
+    """
+    global _STORE, _STORE_PID
+    if _STORE is not None and _STORE is not store and _STORE_PID == os.getpid():
+        _STORE.close()
+    _STORE = store
+    _STORE_PID = None if store is None else os.getpid()
+    if store is not None:
+        atexit.register(store.flush)
+
+
+def directory_bytes(cache_dir: str = CACHE_DIR) -> int:
+    total = 0
+    for key in os.listdir(cache_dir):
+        for file_name in KINDS.values():
+            path = os.path.join(cache_dir, key, file_name)
+            if os.path.isfile(path):
+                total += os.path.getsize(path)
+    return total
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Move cache/<key>/ into the single file cache store")
+    parser.add_argument("--prune", action="store_true", help="delete the cache/<key>/ files once they are moved")
+    parser.add_argument("--path", default=CACHE_STORE_PATH)
+    args = parser.parse_args()
+
+    before = directory_bytes()
+    store = CacheStore(args.path, migrate=False)
+    store.migrate(prune=args.prune)
+
+    stats = store.stats()
+    print(f"{stats['entries']} entries in {stats['blobs']} blobs")
+    print(f"cache/<key>/ files: {before / 1e6:.1f}MB, store: {stats['file_bytes'] / 1e6:.1f}MB")
+
+    started = time.perf_counter()
+    for key in store.keys("json"):
+        json.loads(store.get(key, "json"))
+    store_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for key in store.keys("json"):
+        path = os.path.join(CACHE_DIR, key, "esi_data.json")
+        if os.path.isfile(path):
+            with open(path, "r") as f:
+                json.load(f)
+    file_seconds = time.perf_counter() - started
+    print(f"reading every json: store {store_seconds:.2f}s, files {file_seconds:.2f}s")
@@ -0,0 +1,93 @@
+import time
+from collections import Counter
+from datetime import datetime
+from typing import Optional, Tuple
+
+from br.parser2 import WHOSE_WHO, AllData
+from data.teams import Team, WhoseWho
+from models.battle_report_2 import Battle2, StructureHistory, TeamReport
+
+
+def hawks_or_not(alliance: Optional[str], corp: str, date: datetime, whose_who: WhoseWho) -> Tuple[Team, bool]:
+    name = corp if alliance is None else alliance
+
+    if (alliance is not None and whose_who.is_switcher(alliance)) or whose_who.is_switcher(corp):
+        return whose_who.which_team_for_switchers(name, date), False
+
+    team = whose_who.known_team(name)
+    return team, team == Team.UNKNOWN
+
+
+def team_label(team: TeamReport, date: datetime, whose_who: WhoseWho) -> Team:
+    """
+    a side owning a structure is that structure's team. Otherwise whichever team most of its known participants are
+    on, or failing that most of its suspected ones, ties going to the one seen first
+    """
+    if team.structure_owner is not None:
+        alliance, corp = team.structure_owner
+        structure_team = whose_who.known_team(corp if alliance is None else alliance)
+        if structure_team is not Team.UNKNOWN:
+            return structure_team
+
+    known_teams = Counter()
+    suspected_teams = Counter()
+    for (alliance, corp), count in team.affiliations.items():
+        faction, suspected = hawks_or_not(alliance, corp, date, whose_who)
+        if suspected:
+            suspected_teams[faction] += count
+        else:
+            known_teams[faction] += count
+
+    if len(known_teams) > 0:
+        return max(known_teams, key=known_teams.get)
+
+    if len(suspected_teams) == 0:
+        print("No team")
+        return Team.UNKNOWN
+    return max(suspected_teams, key=suspected_teams.get)
+
+
+def structure_team(structure: StructureHistory, whose_who: WhoseWho) -> Team:
+    return whose_who.known_team(structure.corp if structure.alliance is None else structure.alliance)
+
+
+def classify_battle(battle: Battle2, whose_who: WhoseWho = WHOSE_WHO) -> Battle2:
+    for team in battle.teams:
+        team.team = team_label(team, battle.time_data.started, whose_who)
+    return battle
+
+
+def classify(all_data: AllData, whose_who: WhoseWho = WHOSE_WHO) -> AllData:
+    """
+    Sets every team label, structure team and all_data.structure_owners from the affiliations the parse stored and
+    the current whosewho.json. Nothing here depends on an earlier run, so after editing whosewho.json reload
+    whose_who and run this again instead of re-parsing
+    """
+    for battle in all_data.battles.values():
+        classify_battle(battle, whose_who)
+
+    for structure in all_data.structures.values():
+        structure.team = structure_team(structure, whose_who)
+
+    all_data.get_station_owners(whose_who)
+    return all_data
+
+
+if __name__ == "__main__":
+    from br.snapshot import load_snapshot
+
+    snapshot = load_snapshot()
+    if snapshot is None:
+        print("No usable snapshot, run main.py first")
+    else:
+        all_data = snapshot["all_data"]
+        WHOSE_WHO.reload()
+        started = time.perf_counter()
+        classify(all_data)
+        seconds = time.perf_counter() - started
+
+        labels = Counter(team.team.value for battle in all_data.battles.values() for team in battle.teams)
+        print(
+            f"classified {len(all_data.battles)} battles and {len(all_data.structures)} structures in {seconds:.3f}s"
+        )
+        print(dict(labels))
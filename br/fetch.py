@@ -0,0 +1,417 @@
+import asyncio
+import inspect
+import queue
+import random
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from br.cache_store import LOCK_POLL, get_cache_store
+from br.instrument import count
+from br.parser2 import get_json_url, load_br_links
+from br.util import cached_key, get_cache, is_cached, is_saved_br, rebase, save_cache
+
+# the old serial loop slept this long before every uncached br
+SERIAL_DELAY = 3
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+# longest an ordered hand over waits on one link before reporting it failed and moving on to the next
+SLOT_TIMEOUT = 120
+
+
+class TokenBucket:
+    """
+    Async token bucket. Refills at `rate` tokens per second up to `capacity`, each request takes one token.
+
+    penalize() empties the bucket and holds it closed for a delay, used when the server says to back off so every
+    worker slows down rather than just the one that got the 429
+    """
+
+    def __init__(self, rate: float, capacity: float = None):
+        if rate <= 0:
+            raise ValueError(f"rate must be positive, got {rate}")
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now > self._updated:
+                    self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                    self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = max(self._updated - now, 0) + (1 - self._tokens) / self.rate
+                await asyncio.sleep(wait)
+
+    def penalize(self, delay: float):
+        self._tokens = 0
+        self._updated = max(self._updated, time.monotonic() + delay)
+
+
+@dataclass
+class FetchStats:
+    links: int = 0
+    fetched: int = 0
+    cached: int = 0
+    deduped: int = 0
+    retries: int = 0
+    failed: Dict[str, str] = field(default_factory=dict)
+    request_seconds: List[float] = field(default_factory=list)
+    started: float = None
+    ended: float = None
+
+    @property
+    def elapsed(self) -> float:
+        if self.started is None:
+            return 0.0
+        return (self.ended if self.ended is not None else time.monotonic()) - self.started
+
+    @property
+    def throughput(self) -> float:
+        """
+        BRs pulled from the network per second
+        """
+        if self.elapsed == 0:
+            return 0.0
+        return self.fetched / self.elapsed
+
+    @property
+    def mean_request_seconds(self) -> float:
+        if len(self.request_seconds) == 0:
+            return 0.0
+        return sum(self.request_seconds) / len(self.request_seconds)
+
+    def serial_estimate(self, delay: float = SERIAL_DELAY) -> float:
+        """
+        seconds the old one-at-a-time loop would have needed for the same fetches - a flat sleep plus the request
+        """
+        return self.fetched * (delay + self.mean_request_seconds)
+
+    def report(self, serial_seconds: float = None) -> str:
+        if serial_seconds is None:
+            serial_seconds = self.serial_estimate()
+            serial_label = "estimated"
+        else:
+            serial_label = "measured"
+
+        lines = [
+            f"{self.links} links: {self.fetched} fetched, {self.cached} cached, {self.deduped} deduped, "
+            f"{len(self.failed)} failed, {self.retries} retries",
+            f"concurrent: {self.elapsed:.2f}s ({self.throughput:.2f} BRs/s)",
+        ]
+        if self.fetched > 0 and serial_seconds > 0:
+            lines.append(
+                f"serial ({serial_label}): {serial_seconds:.2f}s ({self.fetched / serial_seconds:.2f} BRs/s) "
+                f"- {serial_seconds / max(self.elapsed, 1e-9):.1f}x speedup"
+            )
+        for url, reason in self.failed.items():
+            lines.append(f"failed {url}: {reason}")
+        return "\n".join(lines)
+
+
+class FetchEngine:
+    """
+    Pulls the evetools json for many br links at once.
+
+    requests_per_second/burst: token bucket budget shared by every request, retries included
+    max_in_flight: how many requests can be waiting on the network at one time
+    max_retries: retries on 429/5xx/connection errors, backing off exponentially (or by Retry-After if sent)
+    base_url: swap br.evetools.org for another host, such as the replay server in br/replay.py. None uses
+        get_base_url()
+    use_cache: read from and write to cache/ - turn off to benchmark against a stand-in server
+    """
+
+    def __init__(
+        self,
+        requests_per_second: float = 2.0,
+        burst: float = None,
+        max_in_flight: int = 8,
+        max_retries: int = 5,
+        backoff: float = 1.0,
+        timeout: float = 30.0,
+        base_url: str = None,
+        use_cache: bool = True,
+    ):
+        self.requests_per_second = requests_per_second
+        self.burst = burst
+        self.max_in_flight = max_in_flight
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.base_url = base_url.rstrip("/") if base_url is not None else None
+        self.use_cache = use_cache
+        self.stats = FetchStats()
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max_in_flight, pool_maxsize=max_in_flight)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self._bucket = None
+        self._semaphore = None
+        self._in_flight: Dict[str, asyncio.Task] = {}
+
+    def api_url(self, url: str) -> str:
+        return rebase(get_json_url(url, is_saved_br(url)), self.base_url)
+
+    async def fetch(self, url: str) -> dict:
+        """
+        returns the json for a single br link. A link that is already being fetched shares the in flight request
+        """
+        key = cached_key(url)
+        task = self._in_flight.get(key)
+        if task is not None:
+            self.stats.deduped += 1
+            return await asyncio.shield(task)
+
+        task = asyncio.ensure_future(self._fetch(url))
+        self._in_flight[key] = task
+        try:
+            return await asyncio.shield(task)
+        finally:
+            self._in_flight.pop(key, None)
+
+    async def _fetch(self, url: str) -> dict:
+        if not self.use_cache:
+            return await self._download(url)
+
+        payload = await self._cached(url)
+        if payload is not None:
+            return payload
+
+        # other processes sharing the cache take the same lock, whoever gets it first fetches and the rest read
+        # what it saved
+        store = get_cache_store()
+        key = cached_key(url)
+        token = await asyncio.to_thread(store.try_acquire, key)
+        while token is None:
+            await asyncio.sleep(LOCK_POLL)
+            token = await asyncio.to_thread(store.try_acquire, key)
+        try:
+            if await asyncio.to_thread(store.refresh, key, "json"):
+                payload = await self._cached(url)
+                if payload is not None:
+                    return payload
+            payload = await self._download(url)
+            await asyncio.to_thread(save_cache, url, payload, True)
+            return payload
+        finally:
+            await asyncio.to_thread(store.release, key, token)
+
+    async def _cached(self, url: str) -> Optional[dict]:
+        """
+        the cached json, None if there isn't one or it was damaged (the store drops it, so it is fetched again)
+        """
+        if not is_cached(url, get_json=True):
+            return None
+        try:
+            payload = await asyncio.to_thread(get_cache, url, True)
+        except FileNotFoundError:
+            return None
+        self.stats.cached += 1
+        return payload
+
+    async def _download(self, url: str) -> dict:
+        api_url = self.api_url(url)
+        attempt = 0
+        async with self._semaphore:
+            while True:
+                await self._bucket.acquire()
+                started = time.monotonic()
+                try:
+                    response = await asyncio.to_thread(self.session.get, api_url, timeout=self.timeout)
+                    status = response.status_code
+                except (requests.ConnectionError, requests.Timeout) as e:
+                    response = None
+                    status = type(e).__name__
+                self.stats.request_seconds.append(time.monotonic() - started)
+
+                if response is not None and status not in RETRY_STATUS:
+                    response.raise_for_status()
+                    payload = response.json()
+                    count("bytes_downloaded", len(response.content))
+                    break
+
+                if attempt >= self.max_retries:
+                    raise RuntimeError(f"gave up after {attempt + 1} attempts, last status {status}")
+
+                delay = self._retry_delay(response, attempt)
+                if status == 429:
+                    self._bucket.penalize(delay)
+                self.stats.retries += 1
+                attempt += 1
+                await asyncio.sleep(delay)
+
+        self.stats.fetched += 1
+        return payload
+
+    def _retry_delay(self, response: Optional[requests.Response], attempt: int) -> float:
+        retry_after = None if response is None else response.headers.get("Retry-After")
+        if retry_after is not None:
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+        return self.backoff * (2**attempt) + random.uniform(0, self.backoff)
+
+    async def fetch_all(
+        self,
+        links: Iterable[str],
+        on_payload: Callable[[str, dict], None] = None,
+        ordered: bool = False,
+        window: int = None,
+        slot_timeout: float = SLOT_TIMEOUT,
+    ) -> FetchStats:
+        """
+        fetches every link, calling on_payload(url, json) as each one finishes. With ordered=True a payload is
+        handed over as soon as it and every link before it are done, so the consumer sees battle_reports.txt order.
+        on_payload can be a coroutine function, anything that blocks should be, so the fetches keep going meanwhile.
+
+        window caps how many links are started but not handed over yet, so a slow consumer (an on_payload that
+        blocks) holds back the fetching instead of payloads piling up in memory. None starts every link at once.
+
+        slot_timeout caps how long an ordered hand over waits on any one link (one stuck retrying on 429s, say).
+        After that the link goes in stats.failed and the links behind it are handed over. None waits for good
+        """
+        self._bucket = TokenBucket(self.requests_per_second, self.burst)
+        self._semaphore = asyncio.Semaphore(self.max_in_flight)
+        started = None if window is None else asyncio.Semaphore(window)
+        holding = set()
+
+        links = list(dict.fromkeys(links))
+        self.stats.links += len(links)
+        if self.stats.started is None:
+            self.stats.started = time.monotonic()
+
+        async def run(url):
+            if started is not None:
+                await started.acquire()
+                holding.add(url)
+            try:
+                return url, await self.fetch(url)
+            except Exception as e:
+                self.stats.failed[url] = str(e)
+                return url, None
+
+        async def next_in_order(url, task):
+            if slot_timeout is None:
+                return await task
+            try:
+                return await asyncio.wait_for(task, slot_timeout)
+            except asyncio.TimeoutError:
+                # the download carries on in the background and is cached if it does come through
+                self.stats.failed[url] = f"not done after {slot_timeout}s, skipped so the links behind it go on"
+                return url, None
+
+        async def hand_over(url, payload):
+            if payload is not None and on_payload is not None:
+                handled = on_payload(url, payload)
+                if inspect.isawaitable(handled):
+                    await handled
+            if url in holding:
+                holding.discard(url)
+                started.release()
+
+        tasks = [asyncio.ensure_future(run(url)) for url in links]
+
+        if ordered:
+            for url, task in zip(links, tasks):
+                await hand_over(*await next_in_order(url, task))
+        else:
+            for finished in asyncio.as_completed(tasks):
+                await hand_over(*await finished)
+
+        self.stats.ended = time.monotonic()
+        return self.stats
+
+    def prefetch(self, links: Iterable[str]) -> FetchStats:
+        """
+        blocking call that fills the cache for every link
+        """
+        return asyncio.run(self.fetch_all(links))
+
+    def stream(self, links: Iterable[str], ordered: bool = True, window: int = None) -> Iterator[Tuple[str, dict]]:
+        """
+        runs the fetches on a background thread and yields (url, json) on this one as they finish, so parsing starts
+        with the first payload instead of waiting for the whole list. With a window at most that many payloads are
+        fetched ahead of the consumer. A full queue is waited on off the event loop, so a slow consumer doesn't stall
+        the fetches already in flight
+        """
+        done = object()
+        results = queue.Queue(maxsize=0 if window is None else window)
+
+        def worker():
+            try:
+                asyncio.run(
+                    self.fetch_all(
+                        links,
+                        lambda url, payload: asyncio.to_thread(results.put, (url, payload)),
+                        ordered=ordered,
+                        window=window,
+                    )
+                )
+            finally:
+                results.put(done)
+
+        thread = threading.Thread(target=worker, name="br-fetch", daemon=True)
+        thread.start()
+        while True:
+            item = results.get()
+            if item is done:
+                break
+            yield item
+        thread.join()
+
+
+def serial_fetch(engine: FetchEngine, links: List[str], delay: float = SERIAL_DELAY) -> float:
+    """
+    the old loop, one request at a time with a flat sleep in front. Returns how long it took
+    """
+    started = time.monotonic()
+    for url in links:
+        time.sleep(delay)
+        engine.session.get(engine.api_url(url), timeout=engine.timeout)
+    return time.monotonic() - started
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Concurrent fetch of the evetools json for battle_reports.txt")
+    parser.add_argument("--base-url", default=None, help="fetch from this host instead of br.evetools.org")
+    parser.add_argument("--rps", type=float, default=2.0, help="requests per second budget")
+    parser.add_argument("--burst", type=float, default=None, help="token bucket size, defaults to --rps")
+    parser.add_argument("--in-flight", type=int, default=8, help="max concurrent requests")
+    parser.add_argument("--limit", type=int, default=None, help="only the first N links")
+    parser.add_argument("--no-cache", action="store_true", help="don't read or write cache/ (for benchmarking)")
+    parser.add_argument(
+        "--compare-serial", type=float, default=None, metavar="DELAY", help="also time the serial loop with DELAY"
+    )
+    args = parser.parse_args()
+
+    br_links = load_br_links()[: args.limit]
+    engine = FetchEngine(
+        requests_per_second=args.rps,
+        burst=args.burst,
+        max_in_flight=args.in_flight,
+        base_url=args.base_url,
+        use_cache=not args.no_cache,
+    )
+    stats = engine.prefetch(br_links)
+
+    serial_seconds = None
+    if args.compare_serial is not None:
+        serial_seconds = serial_fetch(engine, br_links, delay=args.compare_serial)
+
+    print(stats.report(serial_seconds))
@@ -0,0 +1,460 @@
+import time
+from typing import Dict, Iterator, List
+
+from bs4 import BeautifulSoup, SoupStrainer, Tag
+
+from br.mapping import *
+from br.records import ParticipantRecord
+from br.util import convert_isk, convert_to_zkill, get_regex_groups
+from models.battle_report_2 import BattleReportResults
+
+try:
+    import lxml
+    from lxml import etree
+except ImportError:
+    lxml = None
+
+# the only parts of a br page the parser reads - the page header (for the related br duration), the saved br
+# duration and the team columns, which hold the team totals and every participant
+PAGE_SUBTREES = {BR_HEADER, SAVED_BR_DURATION, TEAM_SIDE, TEAM_TOTALS}
+
+# (tag, class) of the nodes read_participant reads, the first one in the participant is used. Every
+# PARTICIPANT_GROUP div is kept, in page order
+PARTICIPANT_NODES = {
+    ("div", PARTICIPANT_SHIP_ICON): "ship_icon",
+    ("div", PARTICIPANT_SHIP_NAME): "ship_name",
+    ("a", PARTICIPANT_NAME): "character",
+    ("span", ISK_VALUE): "isk_value",
+    ("span", MULTIPLE_LOST): "multiple_lost",
+}
+
+
+class SoupBackend:
+    """
+    BeautifulSoup over one of its tree builders ("html.parser" or "lxml"). With strain=True only the subtrees in
+    PAGE_SUBTREES are built into the tree, everything else on the page is dropped as it is read
+    """
+
+    def __init__(self, features: str = "html.parser", strain: bool = True):
+        self.features = features
+        self.strain = strain
+        self.name = f"soup-{features}" + ("" if strain else "-full")
+        self._strainer = SoupStrainer("div", attrs={"class": lambda c: c in PAGE_SUBTREES}) if strain else None
+
+    def parse(self, markup: str) -> BeautifulSoup:
+        return BeautifulSoup(markup, features=self.features, parse_only=self._strainer)
+
+    def duration_text(self, page: BeautifulSoup, use_br: bool) -> str:
+        if use_br:
+            duration = page.find("div", attrs={"class": SAVED_BR_DURATION}).findChildren("div")
+            if len(duration) == 0:
+                return page.find("div", attrs={"class": SAVED_BR_DURATION}).text
+            return " ".join([c.text for c in duration])
+
+        ended = page.find("div", attrs={"class": RELATED_BR_DURATION})
+        return ended.findNext("div").text
+
+    def raw_teams(self, page: BeautifulSoup) -> Dict[str, dict]:
+        teams = {}
+        result_fields = page.find_all("div", attrs={"class": TEAM_TOTALS})
+        side_column = page.find_all("div", attrs={"class": TEAM_SIDE})
+        offset = int(len(side_column) / 2)
+        for idx, team in enumerate(result_fields):
+            team_header = get_regex_groups(side_column[idx].findChildren("h4")[0].text, TEAM_SIDE_AND_NUMBERS_REGEX)
+            teams[team_header["side"]] = {
+                "header": team_header,
+                "totals": self.team_totals(team, team_header),
+                "participants": side_column[idx + offset].findChildren("div", attrs={"class": INDIVIDUAL_PARTICIPANT}),
+            }
+
+        return teams
+
+    def team_totals(self, team: BeautifulSoup, team_header: dict) -> BattleReportResults:
+        results = BattleReportResults(isk_lost=0, ships_lost=0, total_pilots=team_header.get("count", 0))
+        for div in team.findChildren("div"):
+            spans = div.findChildren("span")
+            key = spans[0].text
+            value = spans[1].text
+            if key == "ISK Lost:":
+                results.isk_lost = convert_isk(value)
+            elif key == "Ships Lost:":
+                results.ships_lost = int(value.replace("ships", "").strip())
+        return results
+
+    def participant_nodes(self, participant: BeautifulSoup) -> Dict[str, Tag]:
+        """
+        one walk over the participant picking out every node in PARTICIPANT_NODES
+        """
+        nodes = {"groups": []}
+        for node in participant.descendants:
+            if not isinstance(node, Tag):
+                continue
+            for class_name in node.attrs.get("class", []):
+                _collect(nodes, node, node.name, class_name, "href" in node.attrs)
+
+        return nodes
+
+    def read_participant(self, participant: BeautifulSoup) -> ParticipantRecord:
+        nodes = self.participant_nodes(participant)
+
+        ship_image = nodes["ship_icon"].img["src"]
+        ship_name = nodes["ship_name"].next_element
+        if not isinstance(ship_name, str):
+            ship_name = ship_name.next_element
+
+        killmail_link = nodes["ship_icon"].parent.attrs.get("href")
+        km_link = convert_to_zkill(killmail_link) if killmail_link is not None and "/kill/" in killmail_link else None
+
+        character_link = nodes["character"].attrs["href"]
+        character_name = nodes["character"].next_element
+        while not isinstance(character_name, str):
+            character_name = character_name.next_element
+
+        pod = None
+        if "\xa0" in character_name:
+            # structures have no pilot
+            character_name = None
+            character_link = None
+        elif character_name.next_element is not None and character_name.next_element.text == "[pod]":
+            pod = character_name.next_element.attrs["href"]
+
+        loss_value = convert_isk(nodes["isk_value"].text) if "isk_value" in nodes else 0
+        multiple_killed = nodes["multiple_lost"].text if "multiple_lost" in nodes and loss_value > 0 else 1
+
+        for v in nodes["groups"]:
+            img = v.img
+            if img is None:
+                ally_link = None
+                ally_name = None
+            else:
+                if "corp" in img.attrs["alt"]:
+                    corp_link = img.attrs["src"].strip()
+                    corp_name = v.attrs["title"].replace("corporation:", "").strip()
+
+                if "ally" in img.attrs["alt"]:
+                    ally_link = img.attrs["src"].strip()
+                    ally_name = v.attrs["title"].strip()
+
+        return _record(
+            ship_name,
+            ship_image,
+            km_link,
+            character_name,
+            character_link,
+            pod,
+            corp_name,
+            corp_link,
+            ally_name,
+            ally_link,
+            loss_value,
+            multiple_killed,
+        )
+
+
+class LxmlBackend:
+    """
+    lxml's HTMLParser without BeautifulSoup. The whole page is parsed in C, but python objects are only made for the nodes
+    in the team columns the parser actually reads
+    """
+
+    name = "lxml"
+
+    def __init__(self):
+        # plain etree elements, lxml.html's element classes cost a python lookup for every node touched
+        self._parser = etree.HTMLParser()
+
+    def parse(self, markup: str):
+        return etree.fromstring(markup, self._parser)
+
+    def duration_text(self, page, use_br: bool) -> str:
+        if use_br:
+            duration_div = _find_all(page, "div", SAVED_BR_DURATION)[0]
+            duration = list(duration_div.iterdescendants("div"))
+            if len(duration) == 0:
+                return _text(duration_div)
+            return " ".join([_text(c) for c in duration])
+
+        ended = _find_all(page, "div", RELATED_BR_DURATION)[0]
+        # findNext - the first div after the opening tag, its own children included
+        following = next(ended.iterdescendants("div"), None)
+        if following is None:
+            following = ended.xpath("following::div[1]")[0]
+        return _text(following)
+
+    def raw_teams(self, page) -> Dict[str, dict]:
+        teams = {}
+        result_fields = _find_all(page, "div", TEAM_TOTALS)
+        side_column = _find_all(page, "div", TEAM_SIDE)
+        offset = int(len(side_column) / 2)
+        for idx, team in enumerate(result_fields):
+            header = _text(next(side_column[idx].iterdescendants("h4")))
+            team_header = get_regex_groups(header, TEAM_SIDE_AND_NUMBERS_REGEX)
+            teams[team_header["side"]] = {
+                "header": team_header,
+                "totals": self.team_totals(team, team_header),
+                "participants": _find_all(side_column[idx + offset], "div", INDIVIDUAL_PARTICIPANT),
+            }
+
+        return teams
+
+    def team_totals(self, team, team_header: dict) -> BattleReportResults:
+        results = BattleReportResults(isk_lost=0, ships_lost=0, total_pilots=team_header.get("count", 0))
+        for div in team.iterdescendants("div"):
+            spans = list(div.iterdescendants("span"))
+            key = _text(spans[0])
+            value = _text(spans[1])
+            if key == "ISK Lost:":
+                results.isk_lost = convert_isk(value)
+            elif key == "Ships Lost:":
+                results.ships_lost = int(value.replace("ships", "").strip())
+        return results
+
+    def participant_nodes(self, participant) -> dict:
+        """
+        one walk over the participant picking out every node in PARTICIPANT_NODES
+        """
+        nodes = {"groups": []}
+        for node in participant.iterdescendants():
+            classes = node.get("class")
+            if classes is None:
+                continue
+            for class_name in classes.split():
+                _collect(nodes, node, node.tag, class_name, node.get("href") is not None)
+
+        return nodes
+
+    def read_participant(self, participant) -> ParticipantRecord:
+        nodes = self.participant_nodes(participant)
+
+        ship_image = next(nodes["ship_icon"].iterdescendants("img")).get("src")
+        ship_nodes = _next_elements(nodes["ship_name"])
+        next(ship_nodes)
+        ship_name = next(ship_nodes)
+        if not isinstance(ship_name, str):
+            ship_name = next(ship_nodes)
+
+        killmail_link = nodes["ship_icon"].getparent().get("href")
+        km_link = convert_to_zkill(killmail_link) if killmail_link is not None and "/kill/" in killmail_link else None
+
+        character_link = nodes["character"].get("href")
+        # structures have an empty name link, so like the soup path this runs on to the next string on the page
+        character_nodes = _next_elements(nodes["character"])
+        character_name = next(n for n in character_nodes if isinstance(n, str))
+
+        pod = None
+        if "\xa0" in character_name:
+            # structures have no pilot
+            character_name = None
+            character_link = None
+        else:
+            after = next(character_nodes, None)
+            if after is not None and not isinstance(after, str) and _text(after) == "[pod]":
+                pod = after.get("href")
+
+        loss_value = convert_isk(_text(nodes["isk_value"])) if "isk_value" in nodes else 0
+        multiple_killed = _text(nodes["multiple_lost"]) if "multiple_lost" in nodes and loss_value > 0 else 1
+
+        for v in nodes["groups"]:
+            img = next(v.iterdescendants("img"), None)
+            if img is None:
+                ally_link = None
+                ally_name = None
+            else:
+                if "corp" in img.get("alt"):
+                    corp_link = img.get("src").strip()
+                    corp_name = v.get("title").replace("corporation:", "").strip()
+
+                if "ally" in img.get("alt"):
+                    ally_link = img.get("src").strip()
+                    ally_name = v.get("title").strip()
+
+        return _record(
+            ship_name,
+            ship_image,
+            km_link,
+            character_name,
+            character_link,
+            pod,
+            corp_name,
+            corp_link,
+            ally_name,
+            ally_link,
+            loss_value,
+            multiple_killed,
+        )
+
+
+def _text(node) -> str:
+    return "".join(node.itertext())
+
+
+def _collect(nodes: dict, node, tag: str, class_name: str, has_href: bool):
+    if tag == "div" and class_name == PARTICIPANT_GROUP:
+        nodes["groups"].append(node)
+        return
+    field = PARTICIPANT_NODES.get((tag, class_name))
+    # the pilot name is the PARTICIPANT_NAME <a> with a link, a div with the same class wraps it
+    if field is not None and field not in nodes and (tag != "a" or has_href):
+        nodes[field] = node
+
+
+def _find_all(node, tag: str, class_name: str) -> List:
+    """
+    find_all(tag, class_=class_name) for lxml, matching class_name as one of the node's classes
+    """
+    return [el for el in node.iterdescendants(tag) if class_name in el.get("class", "").split()]
+
+
+def _next_elements(node) -> Iterator:
+    """
+    BeautifulSoup's next_elements for lxml - node, then every element and string after its opening tag in document
+    order, children first
+    """
+    yield from _descend(node)
+    while node is not None:
+        for sibling in node.itersiblings():
+            yield from _descend(sibling)
+        node = node.getparent()
+        if node is not None and node.tail:
+            yield node.tail
+
+
+def _descend(node) -> Iterator:
+    yield node
+    if node.text:
+        yield node.text
+    for child in node:
+        yield from _descend(child)
+    if node.tail:
+        yield node.tail
+
+
+def _record(
+    ship_name,
+    ship_image,
+    km_link,
+    pilot_name,
+    pilot_link,
+    pod_link,
+    corp_name,
+    corp_image,
+    ally_name,
+    ally_image,
+    loss_value,
+    multiple_killed,
+) -> ParticipantRecord:
+    if multiple_killed != 1:
+        multiple_killed = int(multiple_killed.replace("lost", "").replace("x", "").strip())
+
+    return ParticipantRecord(
+        ship_name=str(ship_name),
+        ship_image=ship_image,
+        km_link=km_link,
+        pilot_name=None if pilot_name is None else str(pilot_name),
+        pilot_link=pilot_link,
+        pod_link=pod_link,
+        corp_name=corp_name,
+        corp_image=corp_image,
+        ally_name=ally_name,
+        ally_image=ally_image,
+        loss_value=loss_value,
+        multiple_killed=multiple_killed,
+    )
+
+
+BACKENDS = {b.name: b for b in [SoupBackend("html.parser", strain=False), SoupBackend("html.parser")]}
+if lxml is not None:
+    BACKENDS.update({b.name: b for b in [SoupBackend("lxml"), LxmlBackend()]})
+DEFAULT_BACKEND = "lxml" if lxml is not None else "soup-html.parser"
+
+
+def get_backend(name: str = None):
+    """
+    name is one of BACKENDS, None for the fastest installed
+    """
+    name = DEFAULT_BACKEND if name is None else name
+    if name not in BACKENDS:
+        raise ValueError(f"html backend {name} not available. Should be one of {list(BACKENDS.keys())}")
+    return BACKENDS[name]
+
+
+def read_page(backend, markup: str, use_br: bool) -> tuple:
+    """
+    everything the parser takes from a page, as plain values
+    """
+    page = backend.parse(markup)
+    teams = {
+        side: (raw["header"], raw["totals"], [backend.read_participant(p) for p in raw["participants"]])
+        for side, raw in backend.raw_teams(page).items()
+    }
+    return backend.duration_text(page, use_br), teams
+
+
+def benchmark(pages: List[tuple], backends: List[str]) -> Dict[str, dict]:
+    """
+    times parsing and reading every (markup, use_br) page with each backend, and checks every backend reads
+    exactly what the first one does
+    """
+    results = {}
+    reference = None
+    for name in backends:
+        backend = get_backend(name)
+        started = time.perf_counter()
+        for markup, _ in pages:
+            backend.parse(markup)
+        parse_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        read = [read_page(backend, markup, use_br) for markup, use_br in pages]
+        read_seconds = time.perf_counter() - started
+
+        # read_participant alone, over every participant of every page already parsed
+        participants = [
+            p
+            for markup, _ in pages
+            for raw in backend.raw_teams(backend.parse(markup)).values()
+            for p in raw["participants"]
+        ]
+        started = time.perf_counter()
+        for participant in participants:
+            backend.read_participant(participant)
+        participant_seconds = time.perf_counter() - started
+
+        if reference is None:
+            reference = read
+        results[name] = {
+            "parse_seconds": parse_seconds,
+            "parse_and_read_seconds": read_seconds,
+            "participants": len(participants),
+            "participant_microseconds": participant_seconds / max(len(participants), 1) * 1e6,
+            "identical": read == reference,
+        }
+
+    return results
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from br.cache_store import get_cache_store
+
+    parser = argparse.ArgumentParser(description="Time each html backend over the cached br pages")
+    parser.add_argument("--limit", type=int, default=None, help="only the first N pages")
+    parser.add_argument(
+        "--backends", nargs="+", default=list(BACKENDS.keys()), help="the first one is the reference for identical"
+    )
+    args = parser.parse_args()
+
+    store = get_cache_store()
+    # related br cache keys are <system>_<datetime>, saved br keys are the br id
+    pages = [(store.get(key, "html").decode("utf-8"), "_" not in key) for key in store.keys("html")[: args.limit]]
+
+    results = benchmark(pages, args.backends)
+    baseline = results[args.backends[0]]["parse_and_read_seconds"]
+    print(f"{len(pages)} cached pages, {results[args.backends[0]]['participants']} participants")
+    for name, result in results.items():
+        print(
+            f"{name:>24}: parse {result['parse_seconds']:6.2f}s, parse + read {result['parse_and_read_seconds']:6.2f}s "
+            f"({baseline / result['parse_and_read_seconds']:.1f}x), {result['participant_microseconds']:5.1f}us per "
+            f"participant, identical={result['identical']}"
+        )
@@ -0,0 +1,227 @@
+import cProfile
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional
+
+RUN_REPORT_PATH = "output/run_report.json"
+PROFILE_DIR = "output/profiles"
+# span names to profile, e.g. ["merge_br", "build_scatter"]. Each gets a cProfile .prof and a .folded file of
+# sampled stacks (for flamegraph.pl or speedscope) in PROFILE_DIR
+PROFILE_SPANS: List[str] = []
+SAMPLE_INTERVAL = 0.005
+
+
+@dataclass
+class SpanTotals:
+    calls: int = 0
+    wall: float = 0.0
+    cpu: float = 0.0
+    items: int = 0
+    counters: Counter = field(default_factory=Counter)
+
+    def as_dict(self) -> dict:
+        return {
+            "calls": self.calls,
+            "wall_seconds": round(self.wall, 6),
+            "cpu_seconds": round(self.cpu, 6),
+            "items": self.items,
+            **dict(self.counters),
+        }
+
+
+class Span:
+    """
+    one open span. items is whatever the stage processed (brs, participants, battles), set or added to inside the
+    with block
+    """
+
+    def __init__(self, path: str, items: int = 0):
+        self.path = path
+        self.items = items
+        self.counters = Counter()
+
+
+class Instruments:
+    """
+    Wall and cpu time, items and counters per named stage, for a run report.
+
+    Spans nest per thread and are reported by their path ("parse_battles2/merge_br"), summed over every call. cpu
+    is the thread's own cpu time, so a stage waiting on the network or on another thread shows wall without cpu.
+    count() adds to the innermost open span on the calling thread and to the run totals, cache hits and bytes read
+    and written are counted this way by the cache store and the output writers.
+
+    profile: span names to cProfile and stack-sample while they are open, see dump_profiles()
+    """
+
+    def __init__(self, profile: Iterable[str] = None, sample_interval: float = SAMPLE_INTERVAL):
+        self.totals: Dict[str, SpanTotals] = {}
+        self.counters = Counter()
+        self.profile = set(PROFILE_SPANS if profile is None else profile)
+        self.sample_interval = sample_interval
+        self.started = time.perf_counter()
+        self.cpu_started = time.process_time()
+
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._profiles: Dict[str, List[cProfile.Profile]] = {}
+        self._stacks: Dict[str, Counter] = {}
+        # thread id -> the profiled span name open on it, read by the sampler
+        self._sampling: Dict[int, str] = {}
+        self._sampler = None
+
+    def _stack(self) -> List[Span]:
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    @contextmanager
+    def span(self, name: str, items: int = 0):
+        stack = self._stack()
+        span = Span(f"{stack[-1].path}/{name}" if len(stack) > 0 else name, items)
+        stack.append(span)
+        profiler = self._start_profile(name)
+        wall, cpu = time.perf_counter(), time.thread_time()
+        try:
+            yield span
+        finally:
+            wall, cpu = time.perf_counter() - wall, time.thread_time() - cpu
+            if profiler is not None:
+                self._stop_profile(profiler)
+            stack.pop()
+            with self._lock:
+                totals = self.totals.setdefault(span.path, SpanTotals())
+                totals.calls += 1
+                totals.wall += wall
+                totals.cpu += cpu
+                totals.items += span.items
+                totals.counters.update(span.counters)
+
+    def count(self, name: str, value: int = 1):
+        stack = self._stack()
+        if len(stack) > 0:
+            stack[-1].counters[name] += value
+        with self._lock:
+            self.counters[name] += value
+
+    def _start_profile(self, name: str) -> Optional[cProfile.Profile]:
+        # one profiler per thread at a time, a profiled span inside another is covered by the outer one
+        if name not in self.profile or getattr(self._local, "profiling", False):
+            return None
+        self._local.profiling = True
+        # one profiler per span name and thread, enabled again for every call so they add up
+        profilers = getattr(self._local, "profilers", None)
+        if profilers is None:
+            profilers = self._local.profilers = {}
+        profiler = profilers.get(name)
+        with self._lock:
+            if profiler is None:
+                profiler = profilers[name] = cProfile.Profile()
+                self._profiles.setdefault(name, []).append(profiler)
+            self._sampling[threading.get_ident()] = name
+            if self._sampler is None:
+                self._sampler = threading.Thread(target=self._sample, name="instrument-sampler", daemon=True)
+                self._sampler.start()
+        profiler.enable()
+        return profiler
+
+    def _stop_profile(self, profiler: cProfile.Profile):
+        profiler.disable()
+        self._local.profiling = False
+        with self._lock:
+            self._sampling.pop(threading.get_ident(), None)
+
+    def _sample(self):
+        while True:
+            time.sleep(self.sample_interval)
+            with self._lock:
+                sampling = dict(self._sampling)
+            if len(sampling) == 0:
+                continue
+            frames = sys._current_frames()
+            for thread_id, name in sampling.items():
+                frame = frames.get(thread_id)
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                with self._lock:
+                    self._stacks.setdefault(name, Counter())[";".join(reversed(stack))] += 1
+
+    def report(self) -> dict:
+        with self._lock:
+            return {
+                "wall_seconds": round(time.perf_counter() - self.started, 6),
+                "cpu_seconds": round(time.process_time() - self.cpu_started, 6),
+                "counters": dict(self.counters),
+                "spans": {path: totals.as_dict() for path, totals in self.totals.items()},
+            }
+
+    def save(self, path: str = RUN_REPORT_PATH) -> dict:
+        report = self.report()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(report, f, indent=4)
+        self.dump_profiles()
+        return report
+
+    def dump_profiles(self, directory: str = PROFILE_DIR):
+        """
+        <span>.prof for pstats/snakeviz and <span>.folded, one "frame;frame;frame count" line per sampled stack
+        """
+        if len(self._profiles) == 0:
+            return
+        os.makedirs(directory, exist_ok=True)
+        for name, profilers in self._profiles.items():
+            stats = pstats.Stats(profilers[0])
+            for profiler in profilers[1:]:
+                stats.add(profiler)
+            stats.dump_stats(os.path.join(directory, f"{name}.prof"))
+            with open(os.path.join(directory, f"{name}.folded"), "w") as f:
+                for stack, samples in self._stacks.get(name, Counter()).most_common():
+                    f.write(f"{stack} {samples}\n")
+
+    def summary(self) -> str:
+        report = self.report()
+        lines = [f"run: {report['wall_seconds']:.2f}s wall, {report['cpu_seconds']:.2f}s cpu"]
+        for path, totals in sorted(report["spans"].items()):
+            depth = path.count("/")
+            lines.append(
+                f"{'  ' * depth}{path.split('/')[-1]}: {totals['wall_seconds']:.3f}s wall, "
+                f"{totals['cpu_seconds']:.3f}s cpu, {totals['calls']} calls, {totals['items']} items"
+            )
+        return "\n".join(lines)
+
+
+INSTRUMENTS = Instruments()
+
+
+def get_instruments() -> Instruments:
+    return INSTRUMENTS
+
+
+def span(name: str, items: int = 0):
+    """
+    with span("merge_br") as s: ... - see Instruments.span
+    """
+    return INSTRUMENTS.span(name, items)
+
+
+def count(name: str, value: int = 1):
+    INSTRUMENTS.count(name, value)
+
+
+def written(path: str):
+    """
+    counts a file an output stage just wrote
+    """
+    count("files_written")
+    count("bytes_written", os.path.getsize(path))
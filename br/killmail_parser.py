@@ -0,0 +1,253 @@
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, List
+
+from dateutil import tz
+
+from br.names import NameTable, get_name_table
+from br.records import ParticipantRecord
+from br.util import convert_isk
+from models.battle_report_2 import BattleReportResults, BattleTime
+
+CAPSULES = {670, 33328}  # Capsule, Capsule - Genolution 'Auroral' 197-variant
+
+ZKILL_KILLMAIL = "https://zkillboard.com/kill/{}/"
+EVETOOLS_KILLMAIL = "https://kb.evetools.org/kill/{}/"
+CHARACTER_LINK = "https://kb.evetools.org/character/{}/"
+TYPE_ICON = "https://img.evetools.org/sdeimages/types/{}/icon?size=64"
+CORP_LOGO = "https://img.evetools.org/sdeimages/corporations/{}/logo?size=64"
+ALLY_LOGO = "https://img.evetools.org/sdeimages/alliances/{}/logo?size=64"
+UNKNOWN_ICON = "/icons/eve-question.png"
+
+# how much flying on the same killmail pulls two groups onto the same side, relative to one shooting the other
+FRIEND_WEIGHT = 0.3
+
+
+def normalize_killmails(raw_data: dict, use_br: bool) -> List[dict]:
+    """
+    saved brs nest their kms under relateds with short keys and timestamps in seconds, related brs keep them at the
+    top level with long keys and milliseconds. Returns both as
+
+    {"id", "time" (seconds), "value" (isk), "system", "victim": {char, corp, ally, ship}, "attackers": [{char, corp,
+    ally, ship, weap}]}
+    """
+    output = []
+    if use_br:
+        for related in raw_data.get("relateds", []):
+            for km in related.get("kms", []):
+                output.append(
+                    {
+                        "id": km["id"],
+                        "time": int(km["time"]),
+                        "value": km.get("sumV", 0),
+                        "system": related.get("systemID"),
+                        "victim": km["vict"],
+                        "attackers": km.get("atts", []),
+                    }
+                )
+    else:
+        for km in raw_data.get("kms", []):
+            output.append(
+                {
+                    "id": km["id"],
+                    "time": int(km["time"] / 1000),
+                    "value": km["victim"].get("lossValue", km.get("totalValue", 0)),
+                    "system": raw_data.get("systemID"),
+                    "victim": km["victim"],
+                    "attackers": km.get("attackers", []),
+                }
+            )
+
+    return sorted(output, key=lambda km: (km["time"], km["id"]))
+
+
+def group_key(participant: dict) -> str:
+    """
+    same format evetools uses for saved br teams - the alliance id, or corp:<id> for corps without one
+    """
+    ally = participant.get("ally", 0)
+    if ally:
+        return str(ally)
+    return f"corp:{participant.get('corp', 0)}"
+
+
+def split_teams(kms: List[dict], seed: List[List[str]] = None) -> List[set]:
+    """
+    Splits every group (alliance or alliance-less corp) into sides. Saved brs seed this with the teams the br was
+    saved with, related brs start from nothing.
+
+    Groups are placed heaviest first onto the side they shot at least and flew alongside most, ties going to the
+    smaller side.
+    """
+    enemy = defaultdict(Counter)
+    friend = defaultdict(Counter)
+    weight = Counter()
+    for km in kms:
+        victim = group_key(km["victim"])
+        weight[victim] += 1
+        attackers = {group_key(a) for a in km["attackers"]}
+        for attacker in attackers:
+            weight[attacker] += 1
+            if attacker != victim:
+                enemy[victim][attacker] += 1
+                enemy[attacker][victim] += 1
+            for other in attackers:
+                if other != attacker:
+                    friend[attacker][other] += 1
+
+    sides = [set(team) for team in seed] if seed else []
+    while len(sides) < 2:
+        sides.append(set())
+
+    for group, _ in weight.most_common():
+        if any(group in side for side in sides):
+            continue
+        scores = [
+            FRIEND_WEIGHT * sum(friend[group][g] for g in side) - sum(enemy[group][g] for g in side) for side in sides
+        ]
+        best = max(scores)
+        idx = min([i for i, score in enumerate(scores) if score == best], key=lambda i: len(sides[i]))
+        sides[idx].add(group)
+
+    return [side for side in sides if len(side) > 0]
+
+
+def build_participant_rows(kms: List[dict]) -> Dict[tuple, dict]:
+    """
+    Collapses killmails into br participant rows. Like the br page, every character gets one row showing the first
+    ship they were seen in, with the isk of every ship they lost and their pod. Characterless participants
+    (structures, npcs) get a row per corp and ship instead.
+    """
+    appearances = defaultdict(list)
+    for km in kms:
+        victim = km["victim"]
+        key = (
+            ("char", victim["char"])
+            if victim.get("char")
+            else ("npc", victim["corp"], victim.get("ally", 0), victim["ship"])
+        )
+        appearances[key].append((km["time"], km["id"], victim["ship"], True, km["value"], victim))
+
+        for attacker in km["attackers"]:
+            # attackers with no ship are known only by what they shot with
+            ship = attacker.get("ship") or 0
+            shown = ship if ship else -(attacker.get("weap") or 0)
+            if attacker.get("char"):
+                key = ("char", attacker["char"])
+            else:
+                key = ("npc", attacker["corp"], attacker.get("ally", 0), abs(shown))
+            appearances[key].append((km["time"], km["id"], shown, False, 0, attacker))
+
+    rows = {}
+    for key, seen in appearances.items():
+        ships = [a for a in seen if a[2] > 0 and a[2] not in CAPSULES]
+        capsules = [a for a in seen if a[2] in CAPSULES]
+        shown = (ships or capsules or seen)[0]
+
+        if shown[2] in CAPSULES:
+            losses = [a for a in capsules if a[3]]
+            pods = []
+        else:
+            losses = [a for a in ships if a[3]]
+            pods = [a for a in capsules if a[3]]
+        lost_shown = [a for a in losses if a[2] == shown[2]]
+
+        rows[key] = {
+            "char": key[1] if key[0] == "char" else 0,
+            "ship": abs(shown[2]),
+            "km": lost_shown[-1][1] if len(lost_shown) > 0 else None,
+            "pod": pods[-1][1] if len(pods) > 0 else None,
+            "value": sum(a[4] for a in losses),
+            "multiple": max(len(lost_shown), 1),
+            "corp": seen[-1][5]["corp"],
+            "ally": seen[-1][5].get("ally", 0),
+        }
+
+    return rows
+
+
+def to_record(row: dict, names: NameTable) -> ParticipantRecord:
+    def name(kind, id_num):
+        found = names.name(kind, id_num)
+        return found if found is not None else str(id_num)
+
+    char = row["char"]
+    return ParticipantRecord(
+        ship_name=name("type", row["ship"]),
+        ship_image=TYPE_ICON.format(row["ship"]) if row["ship"] else UNKNOWN_ICON,
+        km_link=ZKILL_KILLMAIL.format(row["km"]) if row["km"] is not None else None,
+        pilot_name=name("character", char) if char else None,
+        pilot_link=CHARACTER_LINK.format(char) if char else None,
+        pod_link=EVETOOLS_KILLMAIL.format(row["pod"]) if char and row["pod"] is not None else None,
+        corp_name=name("corporation", row["corp"]),
+        corp_image=CORP_LOGO.format(row["corp"]),
+        ally_name=name("alliance", row["ally"]) if row["ally"] else None,
+        ally_image=ALLY_LOGO.format(row["ally"]) if row["ally"] else None,
+        loss_value=convert_isk(row["value"]),
+        multiple_killed=row["multiple"],
+    )
+
+
+def resolve_names(rows: Dict[tuple, dict], names: NameTable):
+    ids = {
+        "character": {r["char"] for r in rows.values() if r["char"]},
+        "corporation": {r["corp"] for r in rows.values()},
+        "alliance": {r["ally"] for r in rows.values() if r["ally"]},
+        "type": {r["ship"] for r in rows.values() if r["ship"]},
+    }
+    names.resolve(ids)
+
+
+def killmail_teams(raw_data: dict, use_br: bool, names: NameTable = None) -> Dict[str, dict]:
+    """
+    The json equivalent of get_raw_teams + get_team_totals: {side letter: {"header", "totals", "participants"}}
+    where participants are ParticipantRecords
+    """
+    if names is None:
+        names = get_name_table()
+
+    kms = normalize_killmails(raw_data, use_br)
+    rows = build_participant_rows(kms)
+    resolve_names(rows, names)
+
+    seed = raw_data.get("teams") if use_br else None
+    sides = split_teams(kms, seed)
+
+    teams = {}
+    for idx, side in enumerate(sides):
+        letter = chr(ord("A") + idx)
+        participants = [to_record(row, names) for row in rows.values() if group_key(row) in side]
+        losses = [km for km in kms if group_key(km["victim"]) in side]
+        teams[letter] = {
+            "header": {"side": letter, "count": str(len(participants))},
+            "totals": BattleReportResults(
+                isk_lost=convert_isk(sum(km["value"] for km in losses)),
+                ships_lost=len(losses),
+                total_pilots=len(participants),
+            ),
+            "participants": participants,
+        }
+
+    return teams
+
+
+def killmail_battle_time(raw_data: dict, use_br: bool) -> BattleTime:
+    """
+    The json equivalent of parse_battle_time_values. The br page shows the first and last killmail to the minute,
+    laid over the same base date the html path uses
+    """
+    if use_br:
+        date = datetime.fromtimestamp(raw_data["timings"][0]["start"], tz=tz.UTC)
+    else:
+        date = datetime.strptime(raw_data["datetime"], "%Y%m%d%H%M").replace(tzinfo=tz.UTC)
+
+    kms = normalize_killmails(raw_data, use_br)
+    first = datetime.fromtimestamp(kms[0]["time"], tz=tz.UTC)
+    last = datetime.fromtimestamp(kms[-1]["time"], tz=tz.UTC)
+    minutes = int((kms[-1]["time"] - kms[0]["time"]) / 60)
+
+    return BattleTime(
+        started=date.replace(hour=first.hour, minute=first.minute),
+        ended=date.replace(hour=last.hour, minute=last.minute),
+        duration=timedelta(hours=minutes // 60, minutes=minutes % 60),
+    )
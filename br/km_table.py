@@ -0,0 +1,218 @@
+import json
+import os
+import time
+from typing import Dict, Iterable, Optional
+
+import numpy as np
+
+from br.cache_store import CacheStore, get_cache_store
+from br.killmail_parser import normalize_killmails
+
+KM_TABLE_PATH = "output/km_table"
+# bump when the columns change so old tables are rebuilt
+KM_TABLE_VERSION = 2
+
+KM_COLUMNS = {
+    "km_id": np.int64,
+    "km_battle": np.int32,
+    "km_time": np.int64,  # seconds
+    "km_system": np.int32,
+    "victim_char": np.int64,
+    "victim_corp": np.int64,
+    "victim_ally": np.int64,
+    "victim_ship": np.int32,
+    "km_value": np.float64,  # isk
+}
+ATTACKER_COLUMNS = {
+    "att_char": np.int64,
+    "att_corp": np.int64,
+    "att_ally": np.int64,
+    "att_ship": np.int32,
+    "att_weap": np.int32,
+    "att_dmg": np.int64,
+}
+
+
+class KillmailTable:
+    """
+    Every cached killmail of the war as columns, one row per killmail, grouped by battle and in time order within
+    each. Battle b owns km rows battle_offsets[b]:battle_offsets[b + 1], km row k owns attacker rows
+    att_offsets[k]:att_offsets[k + 1].
+
+    Battles are looked up by br id, the same id Battle2.battle_identifier uses. Saved to KM_TABLE_PATH as one .npy
+    per column so a later run memory maps it instead of reading every cached json again
+    """
+
+    def __init__(self, columns: Dict[str, np.ndarray], sources: Dict[str, list] = None):
+        self.columns = columns
+        self.sources = sources if sources is not None else {}
+        for name, column in columns.items():
+            setattr(self, name, column)
+        self.index = {str(br_id): idx for idx, br_id in enumerate(self.battle_ids)}
+        self._rows = None
+
+    def __len__(self):
+        return len(self.km_id)
+
+    @classmethod
+    def build(cls, store: CacheStore = None) -> "KillmailTable":
+        battle_ids, battle_keys, battle_offsets = [], [], [0]
+        km = {name: [] for name in KM_COLUMNS}
+        att = {name: [] for name in ATTACKER_COLUMNS}
+        att_offsets = [0]
+
+        if store is None:
+            store = get_cache_store()
+        sources = cache_sources(store)
+        for key in sources:
+            raw_data = json.loads(store.get(key, "json"))
+
+            battle = len(battle_ids)
+            battle_ids.append(str(raw_data.get("id", raw_data.get("_id"))))
+            battle_keys.append(key)
+            for killmail in normalize_killmails(raw_data, "relateds" in raw_data):
+                victim = killmail["victim"]
+                km["km_id"].append(killmail["id"])
+                km["km_battle"].append(battle)
+                km["km_time"].append(killmail["time"])
+                km["km_system"].append(killmail["system"] or 0)
+                km["victim_char"].append(victim.get("char", 0))
+                km["victim_corp"].append(victim.get("corp", 0))
+                km["victim_ally"].append(victim.get("ally", 0))
+                km["victim_ship"].append(victim.get("ship", 0))
+                km["km_value"].append(killmail["value"] or 0)
+
+                for attacker in killmail["attackers"]:
+                    att["att_char"].append(attacker.get("char", 0))
+                    att["att_corp"].append(attacker.get("corp", 0))
+                    att["att_ally"].append(attacker.get("ally", 0))
+                    att["att_ship"].append(attacker.get("ship") or 0)
+                    att["att_weap"].append(attacker.get("weap") or 0)
+                    att["att_dmg"].append(attacker.get("dmg") or 0)
+                att_offsets.append(len(att["att_char"]))
+            battle_offsets.append(len(km["km_id"]))
+
+        columns = {name: np.array(values, dtype=KM_COLUMNS[name]) for name, values in km.items()}
+        columns.update({name: np.array(values, dtype=ATTACKER_COLUMNS[name]) for name, values in att.items()})
+        columns["att_offsets"] = np.array(att_offsets, dtype=np.int64)
+        columns["battle_offsets"] = np.array(battle_offsets, dtype=np.int64)
+        columns["battle_ids"] = np.array(battle_ids, dtype=str)
+        columns["battle_keys"] = np.array(battle_keys, dtype=str)
+        return cls(columns, sources)
+
+    def save(self, path: str = KM_TABLE_PATH):
+        os.makedirs(path, exist_ok=True)
+        manifest = os.path.join(path, "manifest.json")
+        # the manifest goes last, a table without one is never loaded
+        if os.path.isfile(manifest):
+            os.remove(manifest)
+        for name, column in self.columns.items():
+            np.save(os.path.join(path, f"{name}.npy"), column)
+        with open(f"{manifest}.tmp", "w") as f:
+            json.dump({"version": KM_TABLE_VERSION, "columns": list(self.columns), "sources": self.sources}, f)
+        os.replace(f"{manifest}.tmp", manifest)
+
+    @classmethod
+    def load(cls, path: str = KM_TABLE_PATH, mmap: bool = True) -> Optional["KillmailTable"]:
+        """
+        None if there is no complete table at path or it was saved by a different KM_TABLE_VERSION
+        """
+        manifest = os.path.join(path, "manifest.json")
+        if not os.path.isfile(manifest):
+            return None
+        with open(manifest, "r") as f:
+            manifest = json.load(f)
+        if manifest.get("version") != KM_TABLE_VERSION:
+            return None
+
+        mmap_mode = "r" if mmap else None
+        columns = {
+            name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mmap_mode) for name in manifest["columns"]
+        }
+        return cls(columns, manifest["sources"])
+
+    def rows(self, br_id: str) -> Optional[slice]:
+        """
+        the km rows of one battle, None if it isn't in the table
+        """
+        battle = self.index.get(str(br_id))
+        if battle is None:
+            return None
+        return slice(int(self.battle_offsets[battle]), int(self.battle_offsets[battle + 1]))
+
+    def find_killmail(self, km_id: int, br_id: str = None) -> Optional[int]:
+        """
+        row of killmail km_id in br_id's killmails, or its first row anywhere when br_id is None
+        """
+        if self._rows is None:
+            # (battle, km id) -> row, and None in place of the battle for the first row of each km
+            self._rows = {}
+            for row, (battle, km) in enumerate(zip(self.km_battle.tolist(), self.km_id.tolist())):
+                self._rows[(battle, km)] = row
+                self._rows.setdefault((None, km), row)
+
+        battle = None if br_id is None else self.index.get(str(br_id))
+        if br_id is not None and battle is None:
+            return None
+        return self._rows.get((battle, int(km_id)))
+
+    def kms_between(self, br_id: str, after: int, before: int = None) -> np.ndarray:
+        """
+        ids of the battle's killmails after `after` and before `before` (seconds, both exclusive)
+        """
+        rows = self.rows(br_id)
+        if rows is None:
+            return np.array([], dtype=np.int64)
+        times = self.km_time[rows]
+        start = np.searchsorted(times, after, side="right")
+        end = len(times) if before is None else np.searchsorted(times, before, side="left")
+        return np.asarray(self.km_id[rows][start:end])
+
+    def victims_in(self, br_id: str, ship_ids: Iterable[int]) -> np.ndarray:
+        """
+        rows of the battle's killmails whose victim flew one of ship_ids
+        """
+        rows = self.rows(br_id)
+        if rows is None:
+            return np.array([], dtype=np.int64)
+        return rows.start + np.flatnonzero(np.isin(self.victim_ship[rows], list(ship_ids)))
+
+
+def cache_sources(store: CacheStore = None) -> Dict[str, str]:
+    """
+    cache key -> content hash of its esi json, for every cached json
+    """
+    if store is None:
+        store = get_cache_store()
+    return {key: store.digest(key, "json") for key in store.keys("json")}
+
+
+def load_km_table(path: str = KM_TABLE_PATH, store: CacheStore = None) -> KillmailTable:
+    """
+    the saved table if it still matches the cache, otherwise rebuilt from the cache and saved
+    """
+    table = KillmailTable.load(path)
+    if table is None or table.sources != cache_sources(store):
+        table = KillmailTable.build(store)
+        table.save(path)
+    return table
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Build the killmail table from the cache and time loading it back")
+    parser.add_argument("--path", default=KM_TABLE_PATH)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    table = KillmailTable.build()
+    built = time.perf_counter() - started
+    table.save(args.path)
+
+    started = time.perf_counter()
+    table = KillmailTable.load(args.path)
+    loaded = time.perf_counter() - started
+
+    print(f"{len(table.battle_ids)} battles, {len(table)} killmails, {len(table.att_char)} attackers")
+    print(f"built in {built:.2f}s, memory mapped back in {loaded * 1000:.1f}ms")
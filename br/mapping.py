@@ -5,6 +5,7 @@ SINGLE_KM_DURATION_AND_TIME_REGEX = r"^Single killmail at (?P<start_hour>\d{2}):
 TEAM_SIDE_AND_NUMBERS_REGEX = r"^Team (?P<side>[A-Z]) \((?P<count>\d{1,4})\)$"
 
 # Mapping for the node class id's
+BR_HEADER = "_22xNZp1v"  # holds the related br duration and the div after it
 RELATED_BR_DURATION = "_2d-LhPrD"
 SAVED_BR_DURATION = "_1anghS2Q"
 SINGLE_KM_DURATION = "_1anghS2Q"
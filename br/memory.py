@@ -0,0 +1,242 @@
+import dataclasses
+import enum
+import json
+import os
+import sys
+import tracemalloc
+import types
+from collections import Counter
+from typing import List, Tuple
+
+from pydantic import BaseModel
+
+from br.parser2 import AllData
+
+MEMORY_REPORT_PATH = "output/memory_report.json"
+# walked in this order, anything shared between them (a pilot name in a team's list and in the pilots dict) counts
+# towards the first one it is found under
+COLLECTIONS = [
+    # first, every BattleSet points at it
+    "battle_index",
+    "strings",
+    "battles",
+    "structures",
+    "alliances",
+    "corps",
+    "pilots",
+    "ships",
+    "systems",
+    "structure_owners",
+    "killmails",
+    "overlaps",
+]
+# singletons and code, never owned by the data that points at them
+SHARED = (type, enum.Enum, types.ModuleType, types.FunctionType, types.BuiltinFunctionType)
+
+
+class MemoryTracker:
+    """
+    tracemalloc snapshots at stage boundaries. mark(stage) records what is traced at the end of the stage, its peak
+    and the lines that allocated the most since the last mark
+    """
+
+    def __init__(self, frames: int = 1, top: int = 10):
+        self.top = top
+        self.stages: List[dict] = []
+        tracemalloc.start(frames)
+        self._last = tracemalloc.take_snapshot()
+
+    def mark(self, stage: str) -> dict:
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        grew = [
+            {"where": str(stat.traceback[0]), "bytes": stat.size_diff, "blocks": stat.count_diff}
+            for stat in snapshot.compare_to(self._last, "lineno")[: self.top]
+        ]
+        record = {"stage": stage, "traced_bytes": current, "peak_bytes": peak, "top_growth": grew}
+        self.stages.append(record)
+        self._last = snapshot
+        tracemalloc.reset_peak()
+        return record
+
+    def stop(self):
+        tracemalloc.stop()
+
+
+def _walk(obj, seen: set, fields: Counter) -> Tuple[int, int]:
+    """
+    (bytes of obj and everything it reaches that isn't in seen yet, how many of those are inside models). Model
+    fields are added to fields as "Class.field", each only the bytes not already under a model nested in it, so the
+    fields of a collection sum to its size less its own containers
+    """
+    if isinstance(obj, SHARED) or id(obj) in seen:
+        return 0, 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+
+    if isinstance(obj, BaseModel) or (dataclasses.is_dataclass(obj) and not isinstance(obj, type)):
+        name = type(obj).__name__
+        values = dict(vars(obj)) if hasattr(obj, "__dict__") else {}
+        if hasattr(obj, "__slots__"):
+            values.update({slot: getattr(obj, slot) for slot in obj.__slots__ if hasattr(obj, slot)})
+        # the per instance bookkeeping pydantic keeps next to the values
+        shell = size
+        for extra in [getattr(obj, "__dict__", None), getattr(obj, "__pydantic_fields_set__", None)]:
+            if extra is not None and id(extra) not in seen:
+                seen.add(id(extra))
+                shell += sys.getsizeof(extra)
+        private = getattr(obj, "__pydantic_private__", None)
+        if private:
+            values.update(private)
+        fields[f"{name}.<object>"] += shell
+
+        total = shell
+        for field, value in values.items():
+            field_total, nested = _walk(value, seen, fields)
+            fields[f"{name}.{field}"] += field_total - nested
+            total += field_total
+        return total, total
+
+    if isinstance(obj, dict):
+        children = [item for pair in obj.items() for item in pair]
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        children = obj
+    elif hasattr(type(obj), "__slots__") and not hasattr(obj, "__dict__"):
+        children = [getattr(obj, slot) for slot in type(obj).__slots__ if hasattr(obj, slot)]
+    elif hasattr(obj, "__dict__"):
+        # plain objects, the registries and the battle index
+        size += sys.getsizeof(vars(obj))
+        children = list(vars(obj).values())
+    else:
+        return size, 0
+
+    total, nested = size, 0
+    for child in children:
+        child_total, child_nested = _walk(child, seen, fields)
+        total += child_total
+        nested += child_nested
+    return total, nested
+
+
+def deep_size(obj) -> int:
+    return _walk(obj, set(), Counter())[0]
+
+
+def participant_count(all_data: AllData) -> int:
+    return sum(len(team.pilots) for battle in all_data.battles.values() for team in battle.teams)
+
+
+def breakdown(all_data: AllData) -> dict:
+    """
+    bytes held by each AllData collection, split by model field, with bytes per battle and per participant (a pilot
+    on a side of a battle)
+    """
+    seen = set()
+    collections = {}
+    total = 0
+    for name in COLLECTIONS:
+        collection = getattr(all_data, name, None)
+        if collection is None:
+            continue
+        fields = Counter()
+        size, _ = _walk(collection, seen, fields)
+        if size - sum(fields.values()) > 0:
+            fields["<container>"] = size - sum(fields.values())
+        collections[name] = {"count": len(collection), "bytes": size, "fields": dict(fields.most_common())}
+        total += size
+    # whatever else AllData holds (dates and such)
+    total += _walk(all_data, seen, Counter())[0]
+
+    battles = max(len(all_data.battles), 1)
+    participants = max(participant_count(all_data), 1)
+    return {
+        "bytes": total,
+        "battles": len(all_data.battles),
+        "participants": participant_count(all_data),
+        "bytes_per_battle": total / battles,
+        "bytes_per_participant": total / participants,
+        "collections": collections,
+    }
+
+
+def format_breakdown(report: dict, top: int = 15) -> str:
+    battles = max(report["battles"], 1)
+    lines = [
+        f"AllData: {report['bytes'] / 1e6:.1f}MB for {report['battles']} battles and {report['participants']} "
+        f"participants - {report['bytes_per_battle'] / 1e3:.1f}KB per battle, "
+        f"{report['bytes_per_participant']:.0f}B per participant"
+    ]
+    for name, collection in report["collections"].items():
+        lines.append(
+            f"  {name}: {collection['count']} entries, {collection['bytes'] / 1e6:.2f}MB "
+            f"({collection['bytes'] / max(report['bytes'], 1):.0%})"
+        )
+
+    everything = Counter()
+    for name, collection in report["collections"].items():
+        for field, size in collection["fields"].items():
+            everything[f"{name}: {field}"] += size
+    lines.append("largest fields:")
+    for field, size in everything.most_common(top):
+        lines.append(f"  {field}: {size / 1e6:.2f}MB, {size / battles / 1e3:.1f}KB per battle")
+    return "\n".join(lines)
+
+
+def format_stages(stages: List[dict]) -> str:
+    lines = []
+    for stage in stages:
+        lines.append(
+            f"{stage['stage']}: {stage['traced_bytes'] / 1e6:.1f}MB traced, peak {stage['peak_bytes'] / 1e6:.1f}MB"
+        )
+        for grew in stage["top_growth"][:3]:
+            lines.append(f"    {grew['bytes'] / 1e6:+.2f}MB {grew['where']}")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from br.aggregate import aggregate_additional_data
+    from br.classify import classify
+    from br.parsed_cache import has_page
+    from br.parser2 import load_br_links
+    from br.pipeline import Pipeline
+    from br.snapshot import load_snapshot
+    from br.util import is_cached
+
+    parser = argparse.ArgumentParser(description="Where the memory of a run goes, by stage and by AllData field")
+    parser.add_argument("--limit", type=int, default=None, help="only the first N cached links")
+    parser.add_argument("--source", default="html", choices=["html", "json"])
+    parser.add_argument("--snapshot", action="store_true", help="load output/all_data.pickle instead of parsing")
+    parser.add_argument("--top", type=int, default=15, help="fields to list")
+    parser.add_argument("--output", default=MEMORY_REPORT_PATH)
+    args = parser.parse_args()
+    sys.setrecursionlimit(10000)
+
+    tracker = MemoryTracker()
+    if args.snapshot:
+        snapshot = load_snapshot(args.source)
+        if snapshot is None:
+            sys.exit("No usable snapshot, run main.py first")
+        all_data = snapshot["all_data"]
+        tracker.mark("load_snapshot")
+    else:
+        br_links = [url for url in load_br_links() if is_cached(url, get_json=True)]
+        if args.source == "html":
+            br_links = [url for url in br_links if has_page(url)]
+        all_data = Pipeline(source=args.source).run(br_links[: args.limit])
+        tracker.mark("parse")
+    classify(all_data)
+    tracker.mark("classify")
+    aggregate_additional_data(all_data)
+    tracker.mark("aggregate_additional_data")
+    tracker.stop()
+
+    report = breakdown(all_data)
+    report["stages"] = tracker.stages
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=4)
+
+    print(format_stages(tracker.stages))
+    print(format_breakdown(report, args.top))
@@ -0,0 +1,144 @@
+import sys
+import time
+from collections import Counter
+from typing import Dict, List, Set
+
+from pydantic import BaseModel
+
+from br.memory import _walk
+from br.parser2 import AllData
+
+
+def instances(all_data: AllData) -> Dict[type, List[BaseModel]]:
+    """
+    every model a parse built, by class
+    """
+    found: Dict[type, List[BaseModel]] = {}
+
+    def add(obj):
+        found.setdefault(type(obj), []).append(obj)
+
+    for collection in [all_data.alliances, all_data.corps, all_data.pilots, all_data.ships, all_data.systems]:
+        for entity in collection.values():
+            add(entity)
+    for structure in all_data.structures.values():
+        add(structure)
+    for battle in all_data.battles.values():
+        add(battle)
+        add(battle.time_data)
+        add(battle.br_totals)
+        for team in battle.teams:
+            add(team)
+            add(team.totals)
+            for structure in team._structures:
+                add(structure)
+    return found
+
+
+def field_values(obj: BaseModel, set_only: bool = False) -> dict:
+    """
+    set_only: just the fields given or assigned rather than left at their defaults, near enough what it was built with.
+    For models sharing a fields set, the fields any of them were given
+    """
+    names = obj.model_fields_set if set_only else type(obj).model_fields
+    return {name: getattr(obj, name) for name in names}
+
+
+def shared_ids(all_data: AllData, found: Dict[type, List[BaseModel]]) -> Set[int]:
+    """
+    ids of the war wide tables every model points into (the battle index behind each BattleSet, the string table
+    behind each CodedStrings and interned name) and everything they hold, and of the fields sets models share (see
+    models.eve.share_fields_set)
+    """
+    seen = set()
+    for table in [all_data.battle_index, all_data.strings]:
+        _walk(table, seen, Counter())
+    fields_sets = Counter(id(obj.__pydantic_fields_set__) for objects in found.values() for obj in objects)
+    seen.update(fields_set for fields_set, users in fields_sets.items() if users > 1)
+    return seen
+
+
+def owned_bytes(obj: BaseModel, shared: Set[int] = frozenset()) -> int:
+    """
+    the model and the values it holds, leaving out other models it points at (a battle's system and teams) and the
+    shared tables (see shared_ids), which would otherwise be charged in full to whichever object reaches them first
+    """
+    seen = set(shared)
+    for value in field_values(obj).values():
+        nested = value if isinstance(value, list) else [value]
+        seen.update(id(item) for item in nested if isinstance(item, BaseModel))
+    return _walk(obj, seen, Counter())[0]
+
+
+def bench(found: Dict[type, List[BaseModel]], repeat: int = 3, shared: Set[int] = frozenset()) -> List[dict]:
+    """
+    per class: objects a second built validated (Class(**values)) and trusted (Class.model_construct(**values)) from
+    the values the parse set, the rest left to their defaults, and the mean bytes each one holds outside of shared
+    """
+    rows = []
+    for cls, objects in sorted(found.items(), key=lambda item: -len(item[1])):
+        values = [field_values(obj, set_only=True) for obj in objects]
+        timings = {}
+        for name, build in [("validated", cls), ("trusted", cls.model_construct)]:
+            best = None
+            for _ in range(repeat):
+                started = time.perf_counter()
+                for kwargs in values:
+                    build(**kwargs)
+                elapsed = time.perf_counter() - started
+                best = elapsed if best is None else min(best, elapsed)
+            timings[name] = len(values) / best if best > 0 else float("inf")
+        rows.append(
+            {
+                "model": cls.__name__,
+                "count": len(objects),
+                "validated_per_second": timings["validated"],
+                "trusted_per_second": timings["trusted"],
+                "bytes_per_object": sum(owned_bytes(obj, shared) for obj in objects) / len(objects),
+            }
+        )
+    return rows
+
+
+def format_rows(rows: List[dict]) -> str:
+    lines = [f"{'model':<20} {'count':>7} {'validated/s':>12} {'trusted/s':>12} {'bytes/object':>13}"]
+    for row in rows:
+        lines.append(
+            f"{row['model']:<20} {row['count']:>7} {row['validated_per_second']:>12,.0f} "
+            f"{row['trusted_per_second']:>12,.0f} {row['bytes_per_object']:>13,.0f}"
+        )
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from br.parsed_cache import has_page
+    from br.parser2 import load_br_links
+    from br.pipeline import Pipeline
+    from br.snapshot import load_snapshot
+    from br.util import is_cached
+
+    parser = argparse.ArgumentParser(description="Model construction throughput and size for the whole war")
+    parser.add_argument("--limit", type=int, default=None, help="only the first N cached links")
+    parser.add_argument("--source", default="html", choices=["html", "json"])
+    parser.add_argument("--snapshot", action="store_true", help="load output/all_data.pickle instead of parsing")
+    parser.add_argument("--repeat", type=int, default=3, help="best of this many passes")
+    args = parser.parse_args()
+    sys.setrecursionlimit(10000)
+
+    if args.snapshot:
+        snapshot = load_snapshot(args.source)
+        if snapshot is None:
+            sys.exit("No usable snapshot, run main.py first")
+        all_data = snapshot["all_data"]
+    else:
+        br_links = [url for url in load_br_links() if is_cached(url, get_json=True)]
+        if args.source == "html":
+            br_links = [url for url in br_links if has_page(url)]
+        started = time.perf_counter()
+        all_data = Pipeline(source=args.source).run(br_links[: args.limit])
+        print(f"parsed {len(all_data.battles)} battles in {time.perf_counter() - started:.2f}s")
+
+    found = instances(all_data)
+    print(format_rows(bench(found, args.repeat, shared_ids(all_data, found))))
@@ -0,0 +1,173 @@
+import json
+import os
+import re
+from typing import Dict, Iterable, Optional, Tuple
+
+import requests
+
+from br.util import get_id_from_link
+
+NAMES_PATH = "cache/names.json"
+ESI_NAMES_URL = "https://esi.evetech.net/latest/universe/names/?datasource=tranquility"
+ESI_BATCH = 1000
+
+# esi category -> our kind
+ESI_CATEGORIES = {
+    "character": "character",
+    "corporation": "corporation",
+    "alliance": "alliance",
+    "inventory_type": "type",
+}
+KINDS = ["character", "corporation", "alliance", "type"]
+
+# what the br page shows in the pilot column of a structure lost more than once, not a name
+MULTIPLE_LOST = re.compile(r"^x\d+ lost$")
+
+
+def link_kind(link: str) -> Tuple[Optional[str], int]:
+    """
+    (kind, id) a pilot's character link names. Structures, their weapons and fighters get a
+    character/structure-<corp>-<type> link whose id is an inventory type, not a character. None for links without an
+    id, such as the question mark icon
+    """
+    if link is None:
+        return None, 0
+    id_num = int(get_id_from_link(link))
+    if id_num == 0:
+        return None, 0
+    return ("type" if "character/structure-" in link else "character"), id_num
+
+
+class NameTable:
+    """
+    id -> name lookups for characters, corporations, alliances and types (ships, structures, weapons).
+
+    The killmail json only carries ids, so the json parse path gets its names from here. Names are learned from
+    entities the html path already parsed, and anything still missing is asked of ESI's /universe/names.
+    """
+
+    def __init__(self, path: str = NAMES_PATH):
+        self.path = path
+        self.names: Dict[str, Dict[int, str]] = {k: {} for k in KINDS}
+        # added since the last take_new(), what a worker process hands back to the parent
+        self._new: Dict[str, Dict[int, str]] = {k: {} for k in KINDS}
+        self._dirty = False
+        # set after esi can't be reached so a bulk run doesn't wait on it for every br
+        self.offline = False
+        if os.path.isfile(path):
+            with open(path, "r") as f:
+                for kind, names in json.load(f).items():
+                    self.names.setdefault(kind, {}).update({int(k): v for k, v in names.items()})
+
+    def name(self, kind: str, id_num: int) -> Optional[str]:
+        return self.names[kind].get(int(id_num))
+
+    def add(self, kind: str, id_num, name: str):
+        id_num = int(id_num)
+        if id_num == 0 or name is None:
+            return
+        if self.names[kind].get(id_num) != name:
+            self.names[kind][id_num] = name
+            self._new[kind][id_num] = name
+            self._dirty = True
+
+    def take_new(self) -> Dict[str, Dict[int, str]]:
+        """
+        {kind: {id: name}} of everything added since the last call
+        """
+        new, self._new = self._new, {k: {} for k in KINDS}
+        return new
+
+    def merge(self, names: Dict[str, Dict[int, str]]):
+        for kind, found in names.items():
+            for id_num, name in found.items():
+                self.add(kind, id_num, name)
+
+    def add_pilot(self, link: str, name: str):
+        kind, id_num = link_kind(link)
+        if kind is None or (kind == "type" and MULTIPLE_LOST.match(name)):
+            return
+        self.add(kind, id_num, name)
+
+    def add_type(self, image_link: str, name: str):
+        # ships first seen with the question mark icon have no usable id
+        if image_link is not None and "/types/" in image_link:
+            self.add("type", get_id_from_link(image_link), name)
+
+    def learn(self, all_data):
+        """
+        picks up every named entity the html parse path created
+        """
+        for pilot in all_data.pilots.values():
+            self.add_pilot(pilot.image_link, pilot.name)
+        for corp in all_data.corps.values():
+            self.add("corporation", corp.id_num, corp.name)
+        for alliance in all_data.alliances.values():
+            self.add("alliance", alliance.id_num, alliance.name)
+        for ship in all_data.ships.values():
+            self.add_type(ship.image_link, ship.name)
+
+    def learn_records(self, records: Iterable):
+        """
+        learn for the ParticipantRecords of one br page, so every html parse fills in names for later json ones
+        """
+        for record in records:
+            self.add_type(record.ship_image, record.ship_name)
+            if record.pilot_link is not None:
+                self.add_pilot(record.pilot_link, record.pilot_name)
+            self.add("corporation", get_id_from_link(record.corp_image), record.corp_name)
+            if record.ally_image is not None:
+                self.add("alliance", get_id_from_link(record.ally_image), record.ally_name)
+
+    def missing(self, ids: Dict[str, Iterable[int]]) -> Dict[str, set]:
+        return {kind: {i for i in id_nums if i and int(i) not in self.names[kind]} for kind, id_nums in ids.items()}
+
+    def resolve(self, ids: Dict[str, Iterable[int]]):
+        """
+        looks up every id not already known with ESI, ids is {kind: [id, ...]}. Ids ESI can't name stay unknown
+        """
+        if self.offline:
+            return
+        unknown = sorted({i for id_nums in self.missing(ids).values() for i in id_nums})
+        try:
+            for idx in range(0, len(unknown), ESI_BATCH):
+                self._resolve_batch(unknown[idx : idx + ESI_BATCH])
+        except requests.RequestException as e:
+            print(f"Could not resolve names with ESI, falling back to ids: {e}")
+            self.offline = True
+
+    def _resolve_batch(self, ids: list):
+        response = requests.post(ESI_NAMES_URL, json=ids, timeout=30)
+        if response.status_code == 404 and len(ids) > 1:
+            # esi rejects the whole batch if any single id is invalid, so split until the bad one is alone
+            middle = len(ids) // 2
+            self._resolve_batch(ids[:middle])
+            self._resolve_batch(ids[middle:])
+            return
+        if response.status_code == 404:
+            print(f"ESI has no name for {ids[0]}")
+            return
+        response.raise_for_status()
+        for entry in response.json():
+            kind = ESI_CATEGORIES.get(entry["category"])
+            if kind is not None:
+                self.add(kind, entry["id"], entry["name"])
+
+    def save(self):
+        if not self._dirty:
+            return
+        # written aside and swapped in, so a run killed mid save leaves the old table rather than half of one
+        with open(f"{self.path}.tmp", "w") as f:
+            json.dump({kind: {str(k): v for k, v in names.items()} for kind, names in self.names.items()}, f)
+        os.replace(f"{self.path}.tmp", self.path)
+        self._dirty = False
+
+
+NAMES: NameTable = None
+
+
+def get_name_table() -> NameTable:
+    global NAMES
+    if NAMES is None:
+        NAMES = NameTable()
+    return NAMES
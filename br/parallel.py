@@ -0,0 +1,146 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Tuple
+
+from br.fetch import FetchEngine
+from br.names import get_name_table
+from br.parser2 import AllData, BrPartial, load_br_links, merge_br, read_br
+from br.parsed_cache import has_page
+from br.util import is_cached
+
+SCALING_CHART_PATH = "output/parallel_scaling.html"
+
+
+def read_cached_br(url: str, source: str = "html", backend: str = None) -> Tuple[BrPartial, Dict[str, Dict[int, str]]]:
+    """
+    worker side - reads one br from cache/ without touching AllData. Also returns the names the worker's name table
+    picked up doing it (from the page or from esi), which only the parent saves
+    """
+    partial = read_br(url, source=source, backend=backend)
+    return partial, get_name_table().take_new()
+
+
+def parse_parallel(
+    br_links: List[str],
+    workers: int = None,
+    database: AllData = None,
+    source: str = "html",
+    backend: str = None,
+    chunksize: int = 4,
+    engine: FetchEngine = None,
+) -> AllData:
+    """
+    Reads every cached br in `workers` processes and merges them into database in br_links order, so the result is
+    the same as parse_br2 over the links one at a time. Links not in the cache yet are read here in the parent, in
+    their place in the order, since they need the render pool.
+
+    Jsons not in the cache are fetched through engine first. Links whose json couldn't be fetched are left out, see
+    engine.stats, as Pipeline does
+
+    workers: processes to read with, None for every core. 1 skips the pool entirely
+    """
+    if database is None:
+        database = AllData()
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if engine is None:
+        engine = FetchEngine()
+
+    links = list(dict.fromkeys(br_links))
+    uncached = [url for url in links if not is_cached(url, get_json=True)]
+    if len(uncached) > 0:
+        engine.prefetch(uncached)
+        links = [url for url in links if url not in engine.stats.failed]
+
+    if source == "json":
+        cached = links
+    else:
+        cached = [url for url in links if has_page(url)]
+
+    if workers == 1:
+        for url in links:
+            merge_br(read_br(url, source=source, backend=backend), database)
+        return database
+
+    names = get_name_table()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # map hands the results back in submission order however the workers finish
+        results = pool.map(
+            read_cached_br, cached, [source] * len(cached), [backend] * len(cached), chunksize=chunksize
+        )
+        cached_set = set(cached)
+        for url in links:
+            if url in cached_set:
+                partial, learned = next(results)
+                names.merge(learned)
+            else:
+                partial = read_br(url, source=source, backend=backend)
+            merge_br(partial, database)
+
+    return database
+
+
+def scaling_run(br_links: List[str], max_workers: int, source: str = "html", backend: str = None) -> Dict[int, float]:
+    """
+    seconds to parse br_links with 1 to max_workers processes. Every run is checked against the serial one
+    """
+    seconds = {}
+    reference = None
+    for workers in range(1, max_workers + 1):
+        started = time.perf_counter()
+        database = parse_parallel(br_links, workers=workers, source=source, backend=backend)
+        seconds[workers] = time.perf_counter() - started
+
+        # every entity, battle and structure - set reprs follow insertion order, so merge order is checked too
+        snapshot = repr(database.convert())
+        if reference is None:
+            reference = snapshot
+        elif snapshot != reference:
+            raise RuntimeError(f"{workers} workers did not match the serial parse")
+
+        print(f"{workers} workers: {seconds[workers]:.2f}s ({seconds[1] / seconds[workers]:.2f}x)")
+
+    return seconds
+
+
+def build_scaling_chart(seconds: Dict[int, float], links: int, file_path: str = SCALING_CHART_PATH):
+    import plotly.graph_objects as go
+
+    workers = list(seconds.keys())
+    speedup = [seconds[1] / s for s in seconds.values()]
+    fig = go.Figure()
+    fig.add_trace(
+        go.Scatter(
+            x=workers,
+            y=speedup,
+            mode="lines+markers",
+            name="measured",
+            customdata=list(seconds.values()),
+            hovertemplate="%{x} workers: %{y:.2f}x (%{customdata:.2f}s)",
+        )
+    )
+    fig.add_trace(go.Scatter(x=workers, y=workers, mode="lines", name="linear", line={"dash": "dash"}))
+    fig.update_layout(
+        title=f"Parsing {links} cached BRs ({os.cpu_count()} cores)",
+        xaxis_title="worker processes",
+        yaxis_title="speedup over 1 worker",
+    )
+    fig.write_html(file_path)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Time the parallel parse of the cached brs for 1 to N workers")
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--limit", type=int, default=None, help="only the first N links")
+    parser.add_argument("--source", default="html", choices=["html", "json"])
+    parser.add_argument("--backend", default=None, help="html backend, see br/html_backend.py")
+    parser.add_argument("--chart", default=SCALING_CHART_PATH, help="where to write the scaling chart")
+    args = parser.parse_args()
+
+    br_links = [url for url in load_br_links()[: args.limit] if is_cached(url, get_json=True) and has_page(url)]
+    seconds = scaling_run(br_links, args.max_workers, args.source, args.backend)
+    build_scaling_chart(seconds, len(br_links), args.chart)
+    print(f"chart written to {args.chart}")
@@ -0,0 +1,155 @@
+import json
+import time
+from typing import Dict, List
+
+from br.classify import classify
+from br.names import get_name_table
+from br.parser2 import AllData, load_br_links, parse_br2
+from br.util import is_cached
+from models.battle_report_2 import Battle2, TeamReport
+
+PARITY_REPORT_PATH = "output/parity_report.json"
+# isk totals are read off the page rounded to a couple of decimals of a billion
+ISK_TOLERANCE = 0.01
+
+
+def jaccard(a: set, b: set) -> float:
+    if len(a) == 0 and len(b) == 0:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+def team_pilots(team: TeamReport) -> set:
+    return set(team.pilots)
+
+
+def match_teams(html_teams: List[TeamReport], json_teams: List[TeamReport]) -> List[tuple]:
+    """
+    the json path letters its sides in its own order, so pair each html team with the json team sharing the most
+    pilots
+    """
+    pairs = []
+    remaining = list(json_teams)
+    for html_team in sorted(html_teams, key=lambda t: -len(t.pilots)):
+        if len(remaining) == 0:
+            pairs.append((html_team, None))
+            continue
+        best = max(remaining, key=lambda t: jaccard(team_pilots(html_team), team_pilots(t)))
+        remaining.remove(best)
+        pairs.append((html_team, best))
+    return pairs
+
+
+def compare_battle(html_battle: Battle2, json_battle: Battle2) -> dict:
+    html_time = html_battle.time_data
+    json_time = json_battle.time_data
+    result = {
+        "br_link": html_battle.br_link,
+        "time_matches": html_time.started == json_time.started
+        and html_time.ended == json_time.ended
+        and html_time.duration == json_time.duration,
+        "team_count": [len(html_battle.teams), len(json_battle.teams)],
+        "teams": [],
+    }
+
+    for html_team, json_team in match_teams(html_battle.teams, json_battle.teams):
+        if json_team is None:
+            result["teams"].append({"side": html_team.br_team_letter, "missing": True})
+            continue
+        result["teams"].append(
+            {
+                "side": html_team.br_team_letter,
+                "pilot_overlap": jaccard(team_pilots(html_team), team_pilots(json_team)),
+                "isk_lost": [html_team.totals.isk_lost, json_team.totals.isk_lost],
+                "ships_lost": [html_team.totals.ships_lost, json_team.totals.ships_lost],
+                "total_pilots": [int(html_team.totals.total_pilots), int(json_team.totals.total_pilots)],
+                "team": [html_team.team.value, json_team.team.value],
+            }
+        )
+
+    return result
+
+
+def summarize(battles: List[dict], html_data: AllData, json_data: AllData) -> dict:
+    teams = [t for b in battles for t in b["teams"] if not t.get("missing")]
+    exact_split = [
+        b
+        for b in battles
+        if b["team_count"][0] == b["team_count"][1] and all(t.get("pilot_overlap") == 1 for t in b["teams"])
+    ]
+
+    def share(items, check) -> float:
+        return sum(1 for i in items if check(i)) / max(len(items), 1)
+
+    return {
+        "battles": len(battles),
+        "time_matches": share(battles, lambda b: b["time_matches"]),
+        "team_count_matches": share(battles, lambda b: b["team_count"][0] == b["team_count"][1]),
+        "exact_team_split": len(exact_split) / max(len(battles), 1),
+        "mean_pilot_overlap": sum(t["pilot_overlap"] for t in teams) / max(len(teams), 1),
+        "isk_lost_matches": share(teams, lambda t: abs(t["isk_lost"][0] - t["isk_lost"][1]) <= ISK_TOLERANCE),
+        "ships_lost_matches": share(teams, lambda t: t["ships_lost"][0] == t["ships_lost"][1]),
+        "total_pilots_matches": share(teams, lambda t: t["total_pilots"][0] == t["total_pilots"][1]),
+        "team_label_matches": share(teams, lambda t: t["team"][0] == t["team"][1]),
+        "entities": {
+            kind: {
+                "html": len(getattr(html_data, kind)),
+                "json": len(getattr(json_data, kind)),
+                "overlap": jaccard(set(getattr(html_data, kind)), set(getattr(json_data, kind))),
+            }
+            for kind in ["pilots", "corps", "alliances", "ships", "systems", "structures"]
+        },
+    }
+
+
+def run_parity(br_links: List[str], report_path: str = PARITY_REPORT_PATH) -> Dict:
+    """
+    parses every br with both a cached json and a cached page through both paths and compares the results
+    """
+    links = [url for url in br_links if is_cached(url, get_json=True) and is_cached(url)]
+    print(f"{len(links)} of {len(br_links)} links have both a cached json and page")
+
+    html_data = AllData()
+    started = time.monotonic()
+    for url in links:
+        parse_br2(url, html_data)
+    classify(html_data)
+    html_seconds = time.monotonic() - started
+
+    # names the json path can't get from the killmails come from what the html path just parsed
+    names = get_name_table()
+    names.learn(html_data)
+    names.save()
+
+    json_data = AllData()
+    started = time.monotonic()
+    for url in links:
+        parse_br2(url, json_data, source="json")
+    classify(json_data)
+    json_seconds = time.monotonic() - started
+    names.save()
+
+    html_battles = {b.br_link: b for b in html_data.battles.values()}
+    json_battles = {b.br_link: b for b in json_data.battles.values()}
+    battles = [compare_battle(html_battles[url], json_battles[url]) for url in html_battles if url in json_battles]
+
+    summary = summarize(battles, html_data, json_data)
+    summary["html_seconds"] = html_seconds
+    summary["json_seconds"] = json_seconds
+
+    with open(report_path, "w") as f:
+        json.dump({"summary": summary, "battles": battles}, f, indent=4)
+
+    return summary
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Compare the json parse path against the html one over cache/")
+    parser.add_argument("--limit", type=int, default=None, help="only the first N links")
+    parser.add_argument("--report", default=PARITY_REPORT_PATH, help="where to write the per battle report")
+    args = parser.parse_args()
+
+    summary = run_parity(load_br_links()[: args.limit], args.report)
+    print(json.dumps(summary, indent=4))
@@ -0,0 +1,78 @@
+import dataclasses
+import hashlib
+import json
+from typing import Dict, Optional
+
+from br.cache_store import get_cache_store
+from br.records import ParticipantRecord
+from br.util import cached_key, is_cached
+from models.battle_report_2 import BattleReportResults
+
+# bump when what read_page pulls off a page changes without one of PARSED_SOURCES changing
+PARSED_VERSION = 1
+# the selectors and the code that reads pages with them. Editing any of these throws every parsed page away
+PARSED_SOURCES = ["br/mapping.py", "br/html_backend.py", "br/records.py"]
+
+RECORD_FIELDS = [f.name for f in dataclasses.fields(ParticipantRecord)]
+
+_PARSER_HASH: Optional[str] = None
+
+
+def parser_hash() -> str:
+    global _PARSER_HASH
+    if _PARSER_HASH is None:
+        digest = hashlib.sha256(f"{PARSED_VERSION}".encode("utf-8"))
+        for path in PARSED_SOURCES:
+            digest.update(path.encode("utf-8"))
+            with open(path, "rb") as f:
+                digest.update(f.read())
+        _PARSER_HASH = digest.hexdigest()
+    return _PARSER_HASH
+
+
+def encode_page(parsed: dict) -> bytes:
+    """
+    {"duration", "teams": {side: {"header", "totals", "participants"}}} as compact json, records as plain lists in
+    ParticipantRecord field order
+    """
+    teams = {
+        side: {
+            "header": team["header"],
+            "totals": [team["totals"].isk_lost, team["totals"].ships_lost, team["totals"].total_pilots],
+            "participants": [[getattr(r, name) for name in RECORD_FIELDS] for r in team["participants"]],
+        }
+        for side, team in parsed["teams"].items()
+    }
+    return json.dumps({"duration": parsed["duration"], "teams": teams}, separators=(",", ":")).encode("utf-8")
+
+
+def decode_page(payload: bytes) -> dict:
+    parsed = json.loads(payload)
+    teams = {}
+    for side, team in parsed["teams"].items():
+        isk_lost, ships_lost, total_pilots = team["totals"]
+        teams[side] = {
+            "header": team["header"],
+            "totals": BattleReportResults(isk_lost=isk_lost, ships_lost=ships_lost, total_pilots=total_pilots),
+            "participants": [ParticipantRecord(*row) for row in team["participants"]],
+        }
+    return {"duration": parsed["duration"], "teams": teams}
+
+
+def load_parsed(key: str) -> Optional[Dict]:
+    """
+    what read_page got off the cached page for key, None if this parser hasn't read it yet
+    """
+    payload = get_cache_store().get_parsed(key, parser_hash())
+    return None if payload is None else decode_page(payload)
+
+
+def save_parsed(key: str, parsed: dict):
+    get_cache_store().put_parsed(key, parser_hash(), encode_page(parsed))
+
+
+def has_page(url: str) -> bool:
+    """
+    whether read_page can do without rendering url - its page is cached or this parser has already read it
+    """
+    return is_cached(url) or get_cache_store().has_parsed(cached_key(url), parser_hash())
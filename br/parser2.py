@@ -1,29 +1,27 @@
 from datetime import datetime, timedelta
 import requests
-from bs4 import BeautifulSoup
 from dateutil import tz
-from collections import Counter
-from typing import List, Dict, Union
+from typing import Iterable, List, Dict
 
+from br.instrument import count, span
 from br.mapping import *
 from br.util import (
-    convert_isk,
+    cached_key,
     convert_to_zkill,
     get_cache,
     get_regex_groups,
     is_structure,
     save_cache,
-    skip_if_cached,
-    get_id_from_link,
+    is_cached,
     is_saved_br,
     get_statics,
+    rebase,
     get_structure_type,
 )
 from data.sde import SYSTEM_WEATHER
 from data.teams import WhoseWho
 from models.eve import (
     Weather,
-    StructureType,
     SystemOwner,
     System,
     EveAlliance,
@@ -32,13 +30,21 @@ from models.eve import (
     EveStructure,
     EveSystem,
     EveCorp,
-    EveEntity,
     LARGE_STRUCTURES,
-    StructureType,
+    share_fields_set,
 )
 from dataclasses import dataclass, field
 from models.battle_report_2 import *
-from requests_html import HTMLSession
+from br.render import get_render_pool
+from br.html_backend import get_backend
+from br.killmail_parser import CAPSULES, killmail_battle_time, killmail_teams, normalize_killmails
+from br.names import get_name_table
+from br.parsed_cache import load_parsed, save_parsed
+from br.records import KillmailEntry, ParticipantRecord
+from br.raw_json import RawJson
+from br.registry import EntityRegistry, link_id
+from models.battle_set import BattleIndex, BattleSet
+from models.string_table import StringTable
 
 
 def load_br_links():
@@ -48,30 +54,50 @@ def load_br_links():
     return [br.replace("\n", "").strip() for br in brs if not br.startswith("#")]
 
 
-def get_json(url, use_br: bool):
-    if skip_if_cached(url):
-        return get_cache(url, get_json=True)
-
+def get_json_url(url, use_br: bool) -> str:
+    """
+    converts a br link into the evetools api endpoint that returns the killmail json for it
+    """
     if use_br:
-        url = (
+        return (
             url.replace("https://br.evetools.org/br", "https://br.evetools.org/api/v1/composition/get") + "?short=true"
         )
-    else:
-        url = url.replace("https://br.evetools.org/", "https://br.evetools.org/api/v1/")
+    return url.replace("https://br.evetools.org/", "https://br.evetools.org/api/v1/")
 
-    page = requests.get(url)
+
+def get_json(url, use_br: bool):
+    if is_cached(url, get_json=True):
+        try:
+            return get_cache(url, get_json=True)
+        except FileNotFoundError:
+            # failed its checksum and was dropped, fetched again below
+            pass
+
+    url = get_json_url(url, use_br)
+
+    with span("fetch_json", items=1):
+        page = requests.get(rebase(url))
+        count("bytes_downloaded", len(page.content))
     save_cache(url, page.json(), as_json=True)
     return page.json()
 
 
-def get_page(url):
-    if skip_if_cached(url):
-        return get_cache(url)
-    session = HTMLSession()
-    r = session.get(url)
-    r.html.render(sleep=8)
-    save_cache(url, r.html.raw_html)
-    return BeautifulSoup(r.html.raw_html, features="html.parser")
+def get_page(url, backend: str = None):
+    """
+    parses the br page with one of html_backend.BACKENDS, None for the fastest installed
+    """
+    html = None
+    if is_cached(url):
+        try:
+            html = get_cache(url)
+        except FileNotFoundError:
+            pass
+    if html is None:
+        # the shared render pool saves the page to the cache once the team containers are in the DOM
+        with span("render", items=1):
+            html = get_render_pool().render(url)
+    with span("soup_parse", items=1):
+        return get_backend(backend).parse(html)
 
 
 WHOSE_WHO = WhoseWho()
@@ -87,18 +113,23 @@ class AllData:
     battles: Dict[str, Battle2] = field(default_factory=dict)
     structures: Dict[str, StructureHistory] = field(default_factory=dict)
     structure_owners: Dict[str, List[dict]] = field(default_factory=dict)
+    # km id -> the battle it counts towards, and {br id: {br id it shares kms with: kms}} for the ones counted elsewhere
+    killmails: Dict[int, KillmailEntry] = field(default_factory=dict)
+    overlaps: Dict[str, Dict[str, int]] = field(default_factory=dict)
+    # br id -> dense position, the bits of every entity's seen_in/podded_in BattleSet
+    battle_index: BattleIndex = field(default_factory=BattleIndex)
     start_date: datetime = datetime(2999, 12, 31, tzinfo=tz.UTC)
     end_date = datetime(1900, 1, 1, tzinfo=tz.UTC)
 
     def __post_init__(self):
-        self.__mapping = {
-            "alliance": self.alliances,
-            "corp": self.corps,
-            "pilot": self.pilots,
-            "ship": self.ships,
-            "system": self.systems,
-            "battle": self.battles,
-        }
+        # the war's string table (entity names and the teams' coded participant lists) and an id keyed registry per
+        # entity type, the name dicts above are their name indexes
+        self.strings = StringTable()
+        self.alliance_registry = EntityRegistry(EveAlliance, self.alliances, self.strings, self.battle_index)
+        self.corp_registry = EntityRegistry(EveCorp, self.corps, self.strings, self.battle_index)
+        self.pilot_registry = EntityRegistry(EvePilot, self.pilots, self.strings, self.battle_index)
+        self.ship_registry = EntityRegistry(EveShip, self.ships, self.strings, self.battle_index)
+        self.system_registry = EntityRegistry(EveSystem, self.systems, self.strings, self.battle_index)
 
     def convert(self):
         return {
@@ -111,70 +142,15 @@ class AllData:
             "structures": {k: v.model_dump() for k, v in self.structures.items()},
         }
 
-    def add(self, type: str, name: str, image_link: str, id_num: str = None, **kwargs):
-        if "battle" in type.lower():
-            raise ValueError(
-                "Don't add battles this way. Create battle and setdefault(battleidentifier) to self.battles"
-            )
-        type = self._convert_type(type)
-        if self.has(name, type):
-            print(f"{name} already found in all_data.{type}")
-            return
-
-        dispatch = {"alliance": EveAlliance, "corp": EveCorp, "pilot": EvePilot, "ship": EveShip, "system": EveSystem}
-        entity = dispatch.get(type)
-
-        type_source = self.__mapping.get(type)
-
-        type_source[name] = entity(
-            name=name,
-            image_link=image_link,
-            id_num=id_num if id_num is not None else get_id_from_link(image_link),
-            **kwargs,
-        )
-
-        return type_source[name]
-
-    def has(self, identifier, type: str = None) -> Union[bool, str]:
-
-        if type is None:
-            for key, value in self.__mapping.items():
-                if identifier in value.keys():
-                    return key
-
-            return False
-
-        type_source = self.__mapping.get(self._convert_type(type))
-        return type_source.get(identifier)
-
-    def find(self, identifier: str, type: str = None) -> Union[EveEntity, Battle2]:
-
-        if type is None:
-            for value in self.__mapping.values():
-                found_value = value.get(identifier)
-                if found_value is not None:
-                    return found_value
-
-            return None
-
-        type_source = self.__mapping.get(self._convert_type(type))
-        return type_source.get(identifier)
-
-    def _convert_type(self, type: str) -> str:
-        if type[-1] == "s":
-            type = type[:-1]
-
-        if type.lower() not in self.__mapping.keys():
-            raise ValueError(f"type of {type} not valid. Should be one of {list(self.__mapping.keys())}")
-        return type.lower()
-
-    def get_station_owners(self):
+    def get_station_owners(self, whose_who: WhoseWho = WHOSE_WHO):
         output = {}
+        # rebuilt from scratch every call, a snapshot loaded from disk already has the last run's owners
+        self.structure_owners.clear()
         for structure in self.structures.values():
             system_override = structure.team
-            if structure.system in WHOSE_WHO.HawksSystems:
+            if structure.system in whose_who.HawksSystems:
                 system_override = Team.HAWKS
-            if structure.system in WHOSE_WHO.CoalitionSystems:
+            if structure.system in whose_who.CoalitionSystems:
                 system_override = Team.COALITION
             output.setdefault(structure.system, []).append(
                 {
@@ -200,39 +176,131 @@ class AllData:
         return output
 
 
-def parse_br2(url, database: AllData):
-    if database is None:
-        database = AllData()
+@dataclass
+class BrPartial:
+    """
+    everything parse_br2 reads for one br before it touches AllData, as plain values. Built by read_br, possibly in
+    another process, and applied to AllData by merge_br
+
+    raw_teams: {side: {"header", "totals", "participants": [ParticipantRecord, ...]}}
+    """
+
+    url: str
+    use_br: bool
+    raw_data: dict
+    time_data: BattleTime
+    raw_teams: Dict[str, dict]
+
+
+def parse_br2(url, database: AllData, raw_data: dict = None, source: str = "html", backend: str = None):
+    """
+    source="html" reads teams, participants and timing from the rendered br page, source="json" builds them from the
+    killmails in the evetools json alone so no browser is needed (see br/killmail_parser.py)
+
+    backend picks the html parser for the page (see br/html_backend.py), None for the fastest installed
+    """
+    return merge_br(read_br(url, raw_data, source, backend), database)
+
+
+def read_br(url, raw_data: dict = None, source: str = "html", backend: str = None) -> BrPartial:
+    with span("read_br", items=1):
+        return _read_br(url, raw_data, source, backend)
+
+
+def _read_br(url, raw_data: dict = None, source: str = "html", backend: str = None) -> BrPartial:
+    if source not in ("html", "json"):
+        raise ValueError(f"source of {source} not valid. Should be one of ['html', 'json']")
     # saved br has different mapping than related quick generation br
     use_br = is_saved_br(url)
 
-    # pages and jsons cached after pulled once
-    raw_data = get_json(url, use_br)
-    rendered_page = get_page(url)
+    # pages and jsons cached after pulled once, raw_data is passed in when the fetch engine already pulled it
+    if raw_data is None:
+        raw_data = get_json(url, use_br)
+
+    if source == "json":
+        return BrPartial(
+            url=url,
+            use_br=use_br,
+            raw_data=raw_data,
+            time_data=killmail_battle_time(raw_data, use_br),
+            raw_teams=killmail_teams(raw_data, use_br),
+        )
+
+    page = read_page(url, use_br, backend)
+    names = get_name_table()
+    for team in page["teams"].values():
+        names.learn_records(team["participants"])
+    return BrPartial(
+        url=url,
+        use_br=use_br,
+        raw_data=raw_data,
+        time_data=parse_battle_time_text(page["duration"], raw_data, use_br),
+        raw_teams=page["teams"],
+    )
+
+
+def read_page(url, use_br: bool, backend: str = None) -> dict:
+    """
+    {"duration": the duration text, "teams": {side: {"header", "totals", "participants": [ParticipantRecord]}}}
+    off the br page. A cached page only ever gets parsed once per version of the parser, after that this comes out
+    of the parsed tier of the cache (see br/parsed_cache.py)
+    """
+    key = cached_key(url)
+    parsed = load_parsed(key)
+    if parsed is not None:
+        return parsed
+
+    html_backend = get_backend(backend)
+    rendered_page = get_page(url, backend)
+    parsed = {
+        "duration": html_backend.duration_text(rendered_page, use_br),
+        "teams": {
+            side: {**raw, "participants": [html_backend.read_participant(p) for p in raw["participants"]]}
+            for side, raw in html_backend.raw_teams(rendered_page).items()
+        },
+    }
+    save_parsed(key, parsed)
+    return parsed
+
+
+def merge_br(partial: BrPartial, database: AllData) -> AllData:
+    """
+    adds one read br to database. Merging partials in battle_reports.txt order gives the same AllData as parsing
+    the links one after another
+    """
+    with span("merge_br", items=sum(len(team["participants"]) for team in partial.raw_teams.values())):
+        return _merge_br(partial, database)
+
 
-    system, br_id = get_system_and_br_id(raw_data, use_br, database)
-    date_and_duration = parse_battle_time_values(rendered_page, raw_data, use_br)
+def _merge_br(partial: BrPartial, database: AllData) -> AllData:
+    if database is None:
+        database = AllData()
+
+    system, br_id = get_system_and_br_id(partial.raw_data, partial.use_br, database)
+    date_and_duration = partial.time_data
+    database.battle_index.add(br_id, date_and_duration.started)
 
     if date_and_duration.started < database.start_date:
         database.start_date = date_and_duration.started
     if date_and_duration.ended > database.end_date:
         database.end_date = date_and_duration.ended
 
-    battle_totals = get_battle_totals(raw_data, use_br)
-
-    raw_teams = get_raw_teams(rendered_page)
+    duplicates = index_killmails(partial.raw_data, partial.use_br, br_id, database)
+    battle_totals = get_battle_totals(partial.raw_data, partial.use_br)
+    battle_totals.killmails -= len(duplicates)
+    battle_totals.isk_lost -= int(sum(entry.value for entry in duplicates.values()))
 
-    teams = parse_teams(raw_teams, database, system, br_id, date_and_duration.started)
+    teams = parse_teams(partial.raw_teams, database, system, br_id, date_and_duration.started, duplicates)
     for t in teams:
         battle_totals.ships_lost += t.totals.ships_lost
     battle = Battle2(
         battle_identifier=br_id,
-        br_link=url,
+        br_link=partial.url,
         time_data=date_and_duration,
         system=system,
         teams=teams,
         br_totals=battle_totals,
-        raw_json=raw_data,
+        raw=RawJson(partial.url, partial.use_br),
     )
 
     database.battles[br_id] = battle
@@ -240,151 +308,237 @@ def parse_br2(url, database: AllData):
 
 
 def parse_teams(
-    raw_teams: dict, all_data: AllData, system: EveSystem, br_id: str, battle_date: datetime
+    raw_teams: dict,
+    all_data: AllData,
+    system: EveSystem,
+    br_id: str,
+    battle_date: datetime,
+    duplicates: Dict[int, KillmailEntry] = None,
 ) -> List[TeamReport]:
     """
     parses the teams for individual pilots, ships, kills, structures. Returns a list of TeamReport objects
     as well as updates all_data with new pilots, ships, alliances, corps
+
+    raw_teams is {side: {"header", "totals", "participants": [ParticipantRecord, ...]}}
+    duplicates are the kms another battle already counts (see index_killmails), left out of every loss total
     """
 
+    sides = {
+        side: [resolve_record(record, all_data, br_id) for record in raw["participants"]]
+        for side, raw in raw_teams.items()
+    }
+    taken = match_duplicates(sides, duplicates or {})
+
     output = []
     for side, raw in raw_teams.items():
-        team = TeamReport(br_team_letter=side, totals=get_team_totals(raw["team"], raw["header"]))
+        output.append(
+            build_team_report(
+                side, raw["totals"], sides[side], all_data, system, br_id, battle_date, taken.get(side, {})
+            )
+        )
+
+    return output
 
-        all_suspected_teams = []
-        known_teams = []
-        structure_team = None
-        for participant in raw["participants"]:
 
-            ship, km_link = get_ship_and_km_link(participant, all_data, br_id)
-            pilot, pod_link = get_pilot_and_pod_zkill_link(participant, all_data, br_id)
-            alliance, corp, loss_value, multiple_killed = get_ally_corp_value_killed(participant, all_data, br_id)
+def match_duplicates(
+    sides: Dict[str, List[tuple]], duplicates: Dict[int, KillmailEntry]
+) -> Dict[str, Dict[int, List[KillmailEntry]]]:
+    """
+    finds the row each duplicate km belongs to by its victim ids, as {side: {row: [KillmailEntry, ...]}}. A row's
+    links only point at one of its kms, "xN" rows hold N of them and some pod kms have no link on their row at all,
+    so going by the victim is the only way every duplicate lands somewhere
+    """
+    taken = {}
+    for entry in duplicates.values():
+        best = None
+        for side, participants in sides.items():
+            for row, (ship, _, pilot, pod_link, alliance, corp, loss_value, multiple_killed) in enumerate(
+                participants
+            ):
+                same_pilot = pilot is not None and pilot.id_num == str(entry.victim_char)
+                if entry.victim_ship in CAPSULES:
+                    score = (same_pilot, pod_link is not None) if same_pilot else None
+                elif loss_value > 0 and corp.id_num == str(entry.victim_corp):
+                    room = len(taken.get(side, {}).get(row, [])) < multiple_killed
+                    score = (ship.id_num == str(entry.victim_ship), same_pilot, room)
+                else:
+                    score = None
+                if score is not None and (best is None or score > best[0]):
+                    best = (score, side, row)
+        if best is not None:
+            taken.setdefault(best[1], {}).setdefault(best[2], []).append(entry)
 
-            if loss_value > 0:
+    return taken
+
+
+def build_team_report(
+    side: str,
+    totals: BattleReportResults,
+    participants: Iterable[tuple],
+    all_data: AllData,
+    system: EveSystem,
+    br_id: str,
+    battle_date: datetime,
+    duplicates: Dict[int, List[KillmailEntry]] = None,
+) -> TeamReport:
+    """
+    participants are (ship, km_link, pilot, pod_link, alliance, corp, loss_value, multiple_killed) tuples of already
+    resolved entities
+
+    duplicates are {row: [KillmailEntry, ...]} from match_duplicates, kms another battle already counts. Their value
+    comes off the row's ship, corp and alliance and off the team totals, the row only stops counting as a loss once
+    all of its kms are duplicates
+    """
+    if duplicates is None:
+        duplicates = {}
+    team = share_fields_set(TeamReport(br_team_letter=side, totals=totals, strings=all_data.strings))
+
+    for row, (ship, km_link, pilot, pod_link, alliance, corp, loss_value, multiple_killed) in enumerate(participants):
+        taken = duplicates.get(row, [])
+        for entry in taken:
+            team.totals.isk_lost -= entry.value / 1000000000
+            team.totals.ships_lost -= 1
+
+        if loss_value > 0:
+            # pods never count towards the row's loss, so only ship kms come off it
+            taken_ships = [entry for entry in taken if entry.victim_ship not in CAPSULES]
+            kept_value = loss_value - sum(entry.value for entry in taken_ships) / 1000000000
+            kept_loss = len(taken_ships) < multiple_killed
+
+            ship.total_value_destroyed += kept_value
+            corp.total_lost_isk += kept_value
+            if alliance is not None:
+                alliance.total_lost_isk += kept_value
+            if kept_loss:
                 ship.destroyed += 1
-                ship.total_value_destroyed += loss_value
                 team.ships_destroyed.append(ship.name)
-                corp.total_lost_isk += loss_value
                 corp.total_lost_ships += 1
                 if alliance is not None:
-                    alliance.total_lost_isk += loss_value
                     alliance.total_lost_ships += 1
 
-            faction, suspected = hawks_or_not(alliance, corp, battle_date)
-            if suspected:
-                all_suspected_teams.append(faction)
+        # only who flew here is kept, which side that makes them is worked out later by br/classify.py
+        affiliation = (alliance.name if alliance is not None else None, corp.name)
+        team.affiliations[affiliation] = team.affiliations.get(affiliation, 0) + 1
+
+        team.ships.append(ship.name)
+        team.km_links.append(km_link)
+        if pilot is not None:
+            pilot.alliance = alliance.name if alliance is not None else None
+            pilot.corp = corp.name
+            team.pilots.append(pilot.name)
+        if pod_link is not None:
+            team.pilots_podded.append(pilot.name)
+            team.km_links.append(pod_link)
+
+        if alliance is not None:
+            team.alliances.append(alliance.name)
+        team.corps.append(corp.name)
+
+        increment_entity_values(pilot, ship, corp, alliance, br_id)
+
+        if is_structure(ship.name):
+            team.structure_owner = affiliation
+
+            is_gunner = pilot is not None and pilot.name != ship.name
+
+            structure_history_id = None
+            if not is_gunner:
+                structure_history_id = note_structure_event(
+                    ship,
+                    pilot,
+                    alliance,
+                    corp,
+                    system,
+                    battle_date,
+                    loss_value,
+                    multiple_killed,
+                    all_data,
+                    br_id,
+                )
+                team.structure_history_ids.append(structure_history_id)
+            structure_type = get_structure_type(ship.name)
+            structure_entry = EveStructure(
+                name=pilot.name if is_gunner else ship.name,
+                id_num=pilot.id_num if is_gunner else ship.id_num,
+                image_link=pilot.image_link if is_gunner else ship.image_link,
+                type=structure_type,
+                structure_history_id=structure_history_id,
+                destroyed_here=loss_value > 0,
+                km_link=km_link if loss_value > 0 else None,
+                loss_value=loss_value,
+                is_gunner_entry=is_gunner,
+                gunner_name=pilot.name if is_gunner else None,
+                gunner_corp=pilot.corp if is_gunner else None,
+                gunner_alliance=pilot.alliance if is_gunner else None,
+                multiple_killed=multiple_killed,
+                seen_in=BattleSet(all_data.battle_index),
+            )
+            share_fields_set(structure_entry)
+
+            team._structures.append(structure_entry)
+            structure_entry.seen_in.add(br_id)
+            team.structure_destroyed = loss_value > 0
+
+            corp.structures.setdefault(system.name, {}).setdefault(structure_type.value, {"s": 0, "d": 0, "g": 0})
+            if is_gunner:
+                corp.structures[system.name][structure_type.value]["g"] += 1
             else:
-                known_teams.append(faction)
-
-            team.ships.append(ship.name)
-            team.km_links.append(km_link)
-            if pilot is not None:
-                pilot.alliance = alliance.name if alliance is not None else None
-                pilot.corp = corp.name
-                team.pilots.append(pilot.name)
-            if pod_link is not None:
-                team.pilots_podded.append(pilot.name)
-                team.km_links.append(pod_link)
+                corp.structures[system.name][structure_type.value]["s"] += 1
+            if loss_value > 0:
+                corp.structures[system.name][structure_type.value]["d"] += 1
 
             if alliance is not None:
-                team.alliances.append(alliance.name)
-            team.corps.append(corp.name)
-
-            increment_entity_values(pilot, ship, corp, alliance, br_id)
-
-            if is_structure(ship.name):
-                structure_team = WHOSE_WHO.known_team(alliance.name if alliance is not None else corp.name)
-
-                is_gunner = pilot is not None and pilot.name != ship.name
-
-                structure_history_id = None
-                if not is_gunner:
-                    structure_history_id = note_structure_event(
-                        ship,
-                        structure_team,
-                        pilot,
-                        alliance,
-                        corp,
-                        system,
-                        battle_date,
-                        loss_value,
-                        multiple_killed,
-                        all_data,
-                        br_id,
-                    )
-                    team.structure_history_ids.append(structure_history_id)
-                structure_type = get_structure_type(ship.name)
-                structure_entry = EveStructure(
-                    name=pilot.name if is_gunner else ship.name,
-                    id_num=pilot.id_num if is_gunner else ship.id_num,
-                    image_link=pilot.image_link if is_gunner else ship.image_link,
-                    type=structure_type,
-                    structure_history_id=structure_history_id,
-                    destroyed_here=loss_value > 0,
-                    loss_value=loss_value,
-                    is_gunner_entry=is_gunner,
-                    gunner_name=pilot.name if is_gunner else None,
-                    gunner_corp=pilot.corp if is_gunner else None,
-                    gunner_alliance=pilot.alliance if is_gunner else None,
-                    multiple_killed=multiple_killed,
+                alliance.structures.setdefault(system.name, {}).setdefault(
+                    structure_type.value, {"s": 0, "d": 0, "g": 0}
                 )
-
-                team._structures.append(structure_entry)
-                structure_entry.seen_in.add(br_id)
-                team.structure_destroyed = loss_value > 0
-
-                corp.structures.setdefault(system.name, {}).setdefault(structure_type.value, {"s": 0, "d": 0, "g": 0})
                 if is_gunner:
-                    corp.structures[system.name][structure_type.value]["g"] += 1
+                    alliance.structures[system.name][structure_type.value]["g"] += 1
                 else:
-                    corp.structures[system.name][structure_type.value]["s"] += 1
+                    alliance.structures[system.name][structure_type.value]["s"] += 1
                 if loss_value > 0:
-                    corp.structures[system.name][structure_type.value]["d"] += 1
+                    alliance.structures[system.name][structure_type.value]["d"] += 1
 
-                if alliance is not None:
-                    alliance.structures.setdefault(system.name, {}).setdefault(
-                        structure_type.value, {"s": 0, "d": 0, "g": 0}
-                    )
-                    if is_gunner:
-                        alliance.structures[system.name][structure_type.value]["g"] += 1
-                    else:
-                        alliance.structures[system.name][structure_type.value]["s"] += 1
-                    if loss_value > 0:
-                        alliance.structures[system.name][structure_type.value]["d"] += 1
-
-        if structure_team is not None and structure_team is not Team.UNKNOWN:
-            team.team = structure_team
-        elif len(known_teams) > 0:
-            if len(set(known_teams)) == 1:
-                team.team = known_teams[0]
-            else:
-                team_counts = dict(Counter(known_teams))
-                team.team = max(team_counts, key=team_counts.get)
-        else:
+    return team
 
-            team_counts = dict(Counter(all_suspected_teams))
-            if len(team_counts) == 0:
-                print("No team")
-            else:
-                team.team = max(team_counts, key=team_counts.get)
 
-        output.append(team)
+def index_killmails(raw_data: dict, use_br: bool, br_id: str, all_data: AllData) -> Dict[int, KillmailEntry]:
+    """
+    Adds the br's kms to all_data.killmails. Related brs in one system often overlap, so a km can be in more than
+    one br. It counts towards the first battle to include it and the rest get it back from here, by km id, to take
+    out of their totals. Also counted in all_data.overlaps
+    """
+    duplicates = {}
+    for km in normalize_killmails(raw_data, use_br):
+        entry = all_data.killmails.get(km["id"])
+        if entry is None:
+            victim = km["victim"]
+            all_data.killmails[km["id"]] = KillmailEntry(
+                br_id=br_id,
+                victim_char=victim.get("char", 0),
+                victim_corp=victim.get("corp", 0),
+                victim_ally=victim.get("ally", 0),
+                victim_ship=victim.get("ship", 0),
+                value=km["value"] or 0,
+            )
+        elif entry.br_id != br_id:
+            duplicates[km["id"]] = entry
+            overlap = all_data.overlaps.setdefault(br_id, {})
+            overlap[entry.br_id] = overlap.get(entry.br_id, 0) + 1
+
+    return duplicates
 
-    return output
 
+def parse_battle_time_values(page, raw_data: dict, use_br: bool, backend=None) -> BattleTime:
+    if backend is None:
+        backend = get_backend()
+    return parse_battle_time_text(backend.duration_text(page, use_br), raw_data, use_br)
 
-def parse_battle_time_values(page: BeautifulSoup, raw_data: dict, use_br: bool) -> BattleTime:
+
+def parse_battle_time_text(full_string: str, raw_data: dict, use_br: bool) -> BattleTime:
     if use_br:
         date = datetime.fromtimestamp(raw_data["timings"][0]["start"], tz=tz.UTC)
-        duration = page.find("div", attrs={"class": SAVED_BR_DURATION}).findChildren("div")
-        if len(duration) == 0:
-            full_string = page.find("div", attrs={"class": SAVED_BR_DURATION}).text
-        else:
-            full_string = " ".join([c.text for c in duration])
     else:
         date = datetime.strptime(raw_data["datetime"], "%Y%m%d%H%M").replace(tzinfo=tz.UTC)
-        ended = page.find("div", attrs={"class": RELATED_BR_DURATION})
-        full_string = ended.findNext("div").text
 
     if "Single killmail" in full_string:
         timing_data = get_regex_groups(full_string, SINGLE_KM_DURATION_AND_TIME_REGEX)
@@ -407,35 +561,6 @@ def parse_battle_time_values(page: BeautifulSoup, raw_data: dict, use_br: bool)
     )
 
 
-def get_raw_teams(page: BeautifulSoup):
-    teams = {}
-    result_fields = page.find_all("div", attrs={"class": TEAM_TOTALS})
-    side_column = page.find_all("div", attrs={"class": TEAM_SIDE})
-    offset = int(len(side_column) / 2)
-    for idx, team in enumerate(result_fields):
-        team_header = get_regex_groups(side_column[idx].findChildren("h4")[0].text, TEAM_SIDE_AND_NUMBERS_REGEX)
-        teams[team_header["side"]] = {
-            "header": team_header,
-            "team": team,
-            "participants": side_column[idx + offset].findChildren("div", attrs={"class": INDIVIDUAL_PARTICIPANT}),
-        }
-
-    return teams
-
-
-def get_team_totals(team, team_header):
-    results = BattleReportResults(isk_lost=0, ships_lost=0, total_pilots=team_header.get("count", 0))
-    for div in team.findChildren("div"):
-        spans = div.findChildren("span")
-        key = spans[0].text
-        value = spans[1].text
-        if key == "ISK Lost:":
-            results.isk_lost = convert_isk(value)
-        elif key == "Ships Lost:":
-            results.ships_lost = int(value.replace("ships", "").strip())
-    return results
-
-
 def get_battle_totals(raw_data: dict, use_br: bool) -> BattleReportTotals:
     pilots = raw_data["totalPilots"]
     lost = raw_data["totalLost"]
@@ -480,7 +605,6 @@ def get_battle_totals(raw_data: dict, use_br: bool) -> BattleReportTotals:
 
 def note_structure_event(
     ship: EveShip,
-    team: Team,
     pilot: EvePilot,
     alliance: EveAlliance,
     corp: EveCorp,
@@ -495,21 +619,21 @@ def note_structure_event(
 
     history_id = structure_history_id(system, alliance, corp, ship)
 
-    structure = all_data.structures.setdefault(
-        history_id,
-        StructureHistory(
+    structure = all_data.structures.get(history_id)
+    if structure is None:
+        structure = all_data.structures[history_id] = StructureHistory(
             id_number=history_id,
             type=structure_type,
             is_large=structure_type in LARGE_STRUCTURES,
             system=system.name,
-            team=team,
             alliance=alliance.name if alliance is not None else None,
             corp=corp.name,
             value=loss_value,
             multiple_in_system=int(multiple_lost),
             zkill_link=None if pilot is None else pilot.name,
-        ),
-    )
+            br_ids=BattleSet(all_data.battle_index),
+        )
+        share_fields_set(structure)
 
     structure.br_ids.add(br_id)
 
@@ -528,156 +652,92 @@ def get_system_and_br_id(raw_data: dict, use_br: bool, all_data: AllData) -> Tup
     raw_system = raw_data["relateds"][0]["system"] if use_br else raw_data["system"]
     system_id = str(raw_data["relateds"][0]["systemID"] if use_br else raw_data["systemID"])
     br_id = raw_data.get("id", raw_data.get("_id"))
-    if all_data.has(raw_system["name"], "system"):
-        system = all_data.find(raw_system["name"], "system")
-    else:
-        system = all_data.add(
-            "system",
-            name=raw_system["name"],
-            image_link="",
-            id_num=system_id,
-            region=raw_system["region"],
-            j_class_number=raw_system.get("whClassID", 0),
-            weather=Weather(SYSTEM_WEATHER.get(system_id, "Vanilla")),
-            statics=get_statics(raw_system["name"]),
-        )
+    system, _ = all_data.system_registry.get_or_create(
+        int(system_id),
+        raw_system["name"],
+        image_link="",
+        region=raw_system["region"],
+        j_class_number=raw_system.get("whClassID", 0),
+        weather=Weather(SYSTEM_WEATHER.get(system_id, "Vanilla")),
+        statics=get_statics(raw_system["name"]),
+    )
 
     system.seen_in.add(br_id)
 
     return system, br_id
 
 
-def get_ship_and_km_link(participant: BeautifulSoup, all_data: AllData, br_id: str) -> Tuple[EveShip, str]:
+def resolve_ship(ship_name: str, ship_image: str, all_data: AllData, br_id: str) -> EveShip:
     """
-    parses the participant for the ship and the zkill link. Adds the ship toi all_data if it is new
+    finds or adds the ship and counts this sighting of it
     """
-    ship_image = participant.find("div", attrs={"class": PARTICIPANT_SHIP_ICON}).findChildren("img")[0]["src"]
-    ship_name = participant.find("div", attrs={"class": PARTICIPANT_SHIP_NAME}).next_element
-    if not isinstance(ship_name, str):
-        ship_name = ship_name.next_element
-
-    killmail_link = participant.find("div", attrs={"class": PARTICIPANT_SHIP_ICON}).parent.attrs.get("href")
-    zkill_link = None
-    if killmail_link is not None and "/kill/" in killmail_link:
-        zkill_link = convert_to_zkill(killmail_link)
-
-    ship = (
-        all_data.find(ship_name, "ship")
-        if all_data.has(ship_name, "ship")
-        else all_data.add("ship", ship_name, ship_image)
-    )
+    ship, _ = all_data.ship_registry.get_or_create(link_id(ship_image)[1], ship_name, image_link=ship_image)
 
     if ship.image_link != ship_image and ship_image != "/icons/eve-question.png":
         ship.image_link = ship_image
 
-        if ship.id_num == 0:
-            ship.id_num = get_id_from_link(ship_image)
-
     ship.used += 1
     ship.seen_in.add(br_id)
-    return ship, zkill_link
-
-
-def get_pilot_and_pod_zkill_link(participant: BeautifulSoup, all_data: AllData, br_id: str) -> Tuple[EvePilot, str]:
-    character = participant.findChildren("a", href=True, attrs={"class": PARTICIPANT_NAME})[0]
-    character_link = character.attrs["href"]
-    zkill_link = convert_to_zkill(character_link)
-    character_name = character.next_element
+    return ship
 
-    while not isinstance(character_name, str):
-        character_name = character_name.next_element
 
-    if "\xa0" in character_name:
-        return None, None
-    if all_data.has(character_name, "pilot"):
-        pilot = all_data.find(character_name, "pilot")
-    else:
-        pilot = all_data.add("pilot", character_name, character_link, corp="", alliance="", zkill_link=zkill_link)
+def resolve_pilot(character_name: str, character_link: str, pod_link: str, all_data: AllData, br_id: str) -> EvePilot:
+    model_id, id_num = link_id(character_link)
+    pilot, created = all_data.pilot_registry.get_or_create(
+        id_num, character_name, model_id, image_link=character_link, corp="", alliance=""
+    )
+    if created:
+        pilot.zkill_link = convert_to_zkill(character_link)
+        pilot.podded_in = BattleSet(all_data.battle_index)
 
-    if character_name.next_element is not None and character_name.next_element.text == "[pod]":
-        pod = character_name.next_element.attrs["href"]
+    if pod_link is not None:
         pilot.podded_in.add(br_id)
-    else:
-        pod = None
 
     pilot.seen_in.add(br_id)
-    return pilot, pod
-
+    return pilot
 
-def get_ally_corp_value_killed(
-    participant: BeautifulSoup, all_data: AllData, br_id: str
-) -> Tuple[EveAlliance, EveCorp, str, str, Team]:
-
-    groups = participant.findChildren("div", attrs={"class": PARTICIPANT_GROUP})
-    value = participant.findChildren("span", attrs={"class": ISK_VALUE})
-    loss_value = convert_isk(value[0].text) if len(value) > 0 else 0
-    multiples = participant.findChildren("span", attrs={"class": MULTIPLE_LOST})
-    multiple_killed = multiples[0].text if (multiples is not None and len(multiples) > 0) and loss_value > 0 else 1
-
-    if multiple_killed != 1:
-        multiple_killed = multiple_killed.replace("lost", "").replace("x", "").strip()
-
-    for v in groups:
-        possible_imgs = v.findChildren("img")
-        if len(possible_imgs) == 0:
-            ally_link = None
-            ally_name = None
-        else:
-            img = possible_imgs[0]
-            if "corp" in img.attrs["alt"]:
-                corp_link = img.attrs["src"].strip()
-                corp_name = v.attrs["title"].replace("corporation:", "").strip()
-
-            if "ally" in img.attrs["alt"]:
-                ally_link = img.attrs["src"].strip()
-                ally_name = v.attrs["title"].strip()
 
+def resolve_affiliation(
+    ally_name: str, ally_link: str, corp_name: str, corp_link: str, all_data: AllData, br_id: str
+) -> Tuple[EveAlliance, EveCorp]:
     if ally_name is not None:
-        if all_data.has(ally_name, "alliance"):
-            alliance = all_data.find(ally_name, "alliance")
-        else:
-            alliance = all_data.add(
-                "alliance",
-                name=ally_name,
-                image_link=ally_link,
-            )
+        alliance, created = all_data.alliance_registry.get_or_create(
+            link_id(ally_link)[1], ally_name, image_link=ally_link
+        )
+        if created:
             alliance.corps.add(corp_name)
 
         alliance.seen_in.add(br_id)
     else:
         alliance = None
 
-    if all_data.has(corp_name, "corp"):
-        corp = all_data.find(corp_name, "corp")
-    else:
-        corp = all_data.add("corp", name=corp_name, image_link=corp_link, alliance=ally_name)
+    corp, _ = all_data.corp_registry.get_or_create(
+        link_id(corp_link)[1], corp_name, image_link=corp_link, alliance=ally_name
+    )
 
     # TODO: Add Holding Corp determination here
 
     corp.seen_in.add(br_id)
 
-    return alliance, corp, loss_value, multiple_killed
+    return alliance, corp
 
 
-def hawks_or_not(alliance: EveAlliance, corp: EveCorp, date: datetime) -> Tuple[Team, bool]:
-
-    if (alliance is not None and alliance.name in WHOSE_WHO.Switchers) or corp.name in WHOSE_WHO.Switchers:
-        return WHOSE_WHO.which_team_for_switchers(corp.name if alliance is None else alliance.name, date), False
-    suspected = False
-    if alliance is None:
-        team = WHOSE_WHO.known_team(corp.name)
-    else:
-        team = WHOSE_WHO.known_team(alliance.name)
-
-    if team == Team.UNKNOWN:
-        if alliance is None:
-            team = WHOSE_WHO.known_team(corp.name)
-        else:
-            team = WHOSE_WHO.known_team(alliance.name)
-
-        suspected = True
-
-    return team, suspected
+def resolve_record(record: ParticipantRecord, all_data: AllData, br_id: str) -> tuple:
+    """
+    turns a ParticipantRecord into the (ship, km_link, pilot, pod_link, alliance, corp, loss_value, multiple_killed)
+    build_team_report expects, with the same all_data updates as the soup path
+    """
+    ship = resolve_ship(record.ship_name, record.ship_image, all_data, br_id)
+    pilot = None
+    pod_link = None
+    if record.pilot_name is not None:
+        pod_link = record.pod_link
+        pilot = resolve_pilot(record.pilot_name, record.pilot_link, pod_link, all_data, br_id)
+    alliance, corp = resolve_affiliation(
+        record.ally_name, record.ally_image, record.corp_name, record.corp_image, all_data, br_id
+    )
+    multiple_killed = record.multiple_killed if record.loss_value > 0 else 1
+    return ship, record.km_link, pilot, pod_link, alliance, corp, record.loss_value, multiple_killed
 
 
 def increment_entity_values(pilot: EvePilot, ship: EveShip, corp: EveCorp, alliance: Optional[EveAlliance], br_link):
@@ -689,8 +749,8 @@ def increment_entity_values(pilot: EvePilot, ship: EveShip, corp: EveCorp, allia
         corp.members.setdefault(pilot.name, 0)
         corp.members[pilot.name] += 1
 
-        corp.pilots_per_battle.setdefault(br_link, 0)
-        corp.pilots_per_battle[br_link] += 1
+        position = corp.seen_in.index.position(br_link)
+        corp.pilots_per_battle[position] = corp.pilots_per_battle.get(position, 0) + 1
 
     if corp is not None and ship is not None:
         corp.ships.setdefault(ship.name, 0)
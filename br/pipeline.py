@@ -0,0 +1,259 @@
+import asyncio
+import queue
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List
+
+from br.fetch import FetchEngine
+from br.parser2 import AllData, load_br_links, merge_br, read_br
+
+# how many brs each queue holds before the stage feeding it has to wait
+QUEUE_DEPTH = 16
+
+_DONE = object()
+
+
+class _Stopped(Exception):
+    pass
+
+
+class MeteredQueue(queue.Queue):
+    """
+    queue.Queue that keeps how long its producers waited on it being full, its consumers on it being empty, and how
+    deep it was after every put
+    """
+
+    def __init__(self, name: str, maxsize: int = QUEUE_DEPTH):
+        super().__init__(maxsize)
+        self.name = name
+        self.put_wait = 0.0
+        self.get_wait = 0.0
+        self.puts = 0
+        self.depth_total = 0
+        self.max_depth = 0
+
+    def put(self, item, block=True, timeout=None):
+        started = time.perf_counter()
+        try:
+            super().put(item, block, timeout)
+        finally:
+            self.put_wait += time.perf_counter() - started
+        depth = self.qsize()
+        self.puts += 1
+        self.depth_total += depth
+        self.max_depth = max(self.max_depth, depth)
+
+    def get(self, block=True, timeout=None):
+        started = time.perf_counter()
+        try:
+            return super().get(block, timeout)
+        finally:
+            self.get_wait += time.perf_counter() - started
+
+    @property
+    def mean_depth(self) -> float:
+        return self.depth_total / self.puts if self.puts > 0 else 0.0
+
+
+@dataclass
+class StageStats:
+    items: int = 0
+    busy: float = 0.0
+    lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def add(self, seconds: float):
+        with self.lock:
+            self.items += 1
+            self.busy += seconds
+
+
+@dataclass
+class PipelineStats:
+    stages: Dict[str, StageStats] = field(default_factory=dict)
+    queues: List[MeteredQueue] = field(default_factory=list)
+    started: float = None
+    ended: float = None
+
+    @property
+    def elapsed(self) -> float:
+        if self.started is None:
+            return 0.0
+        return (self.ended if self.ended is not None else time.perf_counter()) - self.started
+
+    @property
+    def bottleneck(self) -> str:
+        return max(self.stages, key=lambda name: self.stages[name].busy)
+
+    def report(self) -> str:
+        lines = [f"pipeline: {self.elapsed:.2f}s, bottleneck {self.bottleneck}"]
+        for name, stage in self.stages.items():
+            share = stage.busy / self.elapsed if self.elapsed > 0 else 0.0
+            lines.append(f"  {name:>5}: {stage.items} brs, busy {stage.busy:.2f}s ({share:.0%} of the run)")
+        for q in self.queues:
+            lines.append(
+                f"  {q.name:>5} queue: mean depth {q.mean_depth:.1f}, max {q.max_depth}/{q.maxsize}, producers waited "
+                f"{q.put_wait:.2f}s, consumers waited {q.get_wait:.2f}s"
+            )
+        return "\n".join(lines)
+
+
+class Pipeline:
+    """
+    fetch -> parse -> merge, each stage on its own thread(s) joined by bounded queues.
+
+    The fetch engine pulls the jsons in battle_reports.txt order. parse_workers threads read each br (its page comes
+    out of the parsed tier, the cache or the render pool) and the calling thread merges them into AllData, putting
+    them back in order first so the result is the same as parsing one link after another. A full queue holds the
+    stage before it back, so no more than about 2 * depth brs are in memory at once however long the list is.
+
+    Fetch busy time includes waiting on the network, parse busy time includes waiting on a page to render.
+    source and backend are as parse_br2
+    """
+
+    def __init__(
+        self,
+        engine: FetchEngine = None,
+        parse_workers: int = 1,
+        depth: int = QUEUE_DEPTH,
+        source: str = "html",
+        backend: str = None,
+    ):
+        self.engine = engine if engine is not None else FetchEngine()
+        self.parse_workers = parse_workers
+        self.depth = depth
+        self.source = source
+        self.backend = backend
+        self.fetched = MeteredQueue("fetch", depth)
+        self.parsed = MeteredQueue("parse", depth)
+        self.stats = PipelineStats(
+            stages={name: StageStats() for name in ["fetch", "parse", "merge"]}, queues=[self.fetched, self.parsed]
+        )
+        self._stop = threading.Event()
+        self._failure = None
+
+    def _put(self, q: MeteredQueue, item):
+        # timed so a stage blocked on a full queue notices the pipeline being stopped
+        while True:
+            if self._stop.is_set():
+                raise _Stopped()
+            try:
+                return q.put(item, timeout=0.2)
+            except queue.Full:
+                pass
+
+    def _get(self, q: MeteredQueue):
+        while True:
+            if self._stop.is_set():
+                raise _Stopped()
+            try:
+                return q.get(timeout=0.2)
+            except queue.Empty:
+                pass
+
+    def _fetch_stage(self, links: List[str]):
+        stage = self.stats.stages["fetch"]
+        last = time.perf_counter()
+
+        async def hand_over(url, payload):
+            nonlocal last
+            stage.add(time.perf_counter() - last)
+            # waited on off the event loop so a full queue doesn't stall the fetches in flight
+            await asyncio.to_thread(self._put, self.fetched, (stage.items - 1, url, payload))
+            last = time.perf_counter()
+
+        try:
+            asyncio.run(self.engine.fetch_all(links, hand_over, ordered=True, window=self.depth))
+        except _Stopped:
+            return
+        except Exception as e:
+            # raised by run() once the brs already handed over are merged
+            self._failure = e
+
+        try:
+            for _ in range(self.parse_workers):
+                self._put(self.fetched, _DONE)
+        except _Stopped:
+            pass
+
+    def _parse_stage(self):
+        stage = self.stats.stages["parse"]
+        try:
+            while True:
+                item = self._get(self.fetched)
+                if item is _DONE:
+                    break
+                seq, url, raw_data = item
+                started = time.perf_counter()
+                try:
+                    partial = read_br(url, raw_data, self.source, self.backend)
+                except Exception as e:
+                    partial = e
+                stage.add(time.perf_counter() - started)
+                self._put(self.parsed, (seq, url, partial))
+            self._put(self.parsed, _DONE)
+        except _Stopped:
+            pass
+
+    def run(self, br_links: List[str], database: AllData = None) -> AllData:
+        """
+        parses br_links into database (a new AllData if None). Links whose json couldn't be fetched are left out,
+        see engine.stats
+        """
+        links = list(dict.fromkeys(br_links))
+        self.stats.started = time.perf_counter()
+        threads = [threading.Thread(target=self._fetch_stage, args=(links,), name="br-fetch", daemon=True)]
+        threads += [
+            threading.Thread(target=self._parse_stage, name=f"br-parse-{idx}", daemon=True)
+            for idx in range(self.parse_workers)
+        ]
+        for thread in threads:
+            thread.start()
+
+        stage = self.stats.stages["merge"]
+        # parse workers can finish out of order, brs wait here until every one before them is merged
+        waiting = {}
+        next_seq = 0
+        finished = 0
+        try:
+            while finished < self.parse_workers:
+                item = self._get(self.parsed)
+                if item is _DONE:
+                    finished += 1
+                    continue
+                waiting[item[0]] = item
+                while next_seq in waiting:
+                    _, url, partial = waiting.pop(next_seq)
+                    if isinstance(partial, Exception):
+                        raise partial
+                    started = time.perf_counter()
+                    database = merge_br(partial, database)
+                    stage.add(time.perf_counter() - started)
+                    print(f"Parsed {url} ({next_seq + 1} of {len(links)})")
+                    next_seq += 1
+        finally:
+            self._stop.set()
+            for thread in threads:
+                thread.join()
+            self.stats.ended = time.perf_counter()
+
+        if self._failure is not None:
+            raise self._failure
+        return database if database is not None else AllData()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run battle_reports.txt through the pipeline and report each stage")
+    parser.add_argument("--limit", type=int, default=None, help="only the first N links")
+    parser.add_argument("--parse-workers", type=int, default=1)
+    parser.add_argument("--depth", type=int, default=QUEUE_DEPTH)
+    parser.add_argument("--source", default="html", choices=["html", "json"])
+    args = parser.parse_args()
+
+    pipeline = Pipeline(parse_workers=args.parse_workers, depth=args.depth, source=args.source)
+    all_data = pipeline.run(load_br_links()[: args.limit])
+    print(f"{len(all_data.battles)} battles")
+    print(pipeline.engine.stats.report())
+    print(pipeline.stats.report())
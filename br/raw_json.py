@@ -0,0 +1,79 @@
+import threading
+from collections import OrderedDict
+from typing import Callable, Optional
+
+from br.instrument import count
+
+# how many battles' evetools payloads stay loaded at once
+RAW_JSON_RESIDENT = 16
+
+
+class RawJsonCache:
+    """
+    LRU of loaded payloads by br link, at most size of them resident however many battles are asked for
+    """
+
+    def __init__(self, size: int = RAW_JSON_RESIDENT):
+        self.size = size
+        self.hits = 0
+        self.loads = 0
+        self._payloads: "OrderedDict[str, dict]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._payloads)
+
+    def get(self, url: str, load: Callable[[], dict]) -> dict:
+        with self._lock:
+            payload = self._payloads.get(url)
+            if payload is not None:
+                self._payloads.move_to_end(url)
+                self.hits += 1
+                return payload
+
+        payload = load()
+        count("raw_json_loads")
+        with self._lock:
+            self.loads += 1
+            self._payloads[url] = payload
+            self._payloads.move_to_end(url)
+            while len(self._payloads) > self.size:
+                self._payloads.popitem(last=False)
+        return payload
+
+    def clear(self):
+        with self._lock:
+            self._payloads.clear()
+
+
+_CACHE = RawJsonCache()
+
+
+def get_raw_json_cache() -> RawJsonCache:
+    return _CACHE
+
+
+class RawJson:
+    """
+    Stands in for a battle's evetools json, which is only needed again by analyses that go back to the kms. Holds
+    the br link and reads the payload out of the cache store (pulled again if it has gone) when load() is called,
+    through the shared RawJsonCache. Pickles as just the link
+    """
+
+    __slots__ = ("url", "use_br")
+
+    def __init__(self, url: str, use_br: bool):
+        self.url = url
+        self.use_br = use_br
+
+    def __repr__(self) -> str:
+        return f"RawJson({self.url!r})"
+
+    def load(self) -> Optional[dict]:
+        return get_raw_json_cache().get(self.url, self._read)
+
+    def _read(self) -> dict:
+        # parser2 builds these, imported here rather than at the top
+        from br.parser2 import get_json
+
+        return get_json(self.url, self.use_br)
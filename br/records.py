@@ -0,0 +1,48 @@
+from dataclasses import dataclass
+from typing import Optional
+
+
+@dataclass
+class ParticipantRecord:
+    """
+    One participant row of a battle report, as plain values rather than soup nodes or entities.
+
+    ship_name/ship_image: ship (or structure, or weapon when the ship is unknown) and its icon url
+    km_link: zkillboard link to the killmail if the ship was lost
+    pilot_name/pilot_link: None for structures and npcs
+    pod_link: evetools link to the pod killmail if the pilot was podded
+    corp_name/corp_image, ally_name/ally_image: affiliation, ally is None for corps without an alliance
+    loss_value: isk lost in billions, 0 if nothing was lost
+    multiple_killed: how many of this ship were lost, 1 unless the br shows a multiple
+    """
+
+    ship_name: str
+    ship_image: str
+    km_link: Optional[str]
+    pilot_name: Optional[str]
+    pilot_link: Optional[str]
+    pod_link: Optional[str]
+    corp_name: str
+    corp_image: str
+    ally_name: Optional[str]
+    ally_image: Optional[str]
+    loss_value: float = 0
+    multiple_killed: int = 1
+
+
+@dataclass
+class KillmailEntry:
+    """
+    One killmail in AllData.killmails, the war wide km id index.
+
+    br_id: the battle the km counts towards, the first in battle_reports.txt order to include it
+    victim_char/victim_corp/victim_ally/victim_ship: esi ids, 0 when there is none
+    value: isk lost
+    """
+
+    br_id: str
+    victim_char: int
+    victim_corp: int
+    victim_ally: int
+    victim_ship: int
+    value: float = 0
@@ -0,0 +1,101 @@
+from typing import Dict, Generic, Optional, Tuple, Type, TypeVar
+
+from models.battle_set import BattleIndex, BattleSet
+from models.eve import EveEntity, share_fields_set
+from models.string_table import StringTable
+from br.util import get_id_from_link
+
+E = TypeVar("E", bound=EveEntity)
+
+# image link -> its id, the same few thousand links come round for every participant
+_LINK_IDS: Dict[str, Tuple[str, int]] = {}
+
+
+def link_id(image_link: str) -> Tuple[str, int]:
+    """
+    (id as the models keep it, id as a registry key) out of an image or character link. The key is 0 for the question
+    mark icon and anything else without an id, structures included - their character link is the owner corp and the
+    structure type, which many differently named structures share
+    """
+    found = _LINK_IDS.get(image_link)
+    if found is None:
+        id_num = get_id_from_link(image_link)
+        key = 0 if "character/structure-" in image_link else int(id_num)
+        found = _LINK_IDS[image_link] = (id_num, key)
+    return found
+
+
+class EntityRegistry(Generic[E]):
+    """
+    One kind of entity keyed by its EVE id, with the name dict AllData has always had (and every output reads) as a
+    secondary index.
+
+    get_or_create looks the id up first and only falls back to the name when there isn't one (the question mark
+    icon), so a pilot and a ship sharing a name never meet, and an entity seen under a new name is still the same
+    entity. The new name is kept in aliases rather than by_name so it isn't output twice. Two different ids under the
+    same name get "name (id)" for the second one in by_name.
+
+    names is the StringTable shared by every registry in an AllData, each name string is kept once however many
+    entities, teams and structures point at it. battles is its BattleIndex, new entities' seen_in are over it
+    """
+
+    def __init__(self, entity: Type[E], by_name: Dict[str, E], names: StringTable, battles: BattleIndex):
+        self.entity = entity
+        self.by_name = by_name
+        self.names = names
+        self.battles = battles
+        self.by_id: Dict[int, E] = {}
+        self.aliases: Dict[str, E] = {}
+        # the id each by_name key was registered under, 0 while it is only known by name
+        self._ids: Dict[str, int] = {}
+
+    def intern(self, name: str) -> str:
+        return self.names.intern(name)
+
+    def get(self, id_num: int) -> Optional[E]:
+        return self.by_id.get(id_num)
+
+    def find(self, name: str) -> Optional[E]:
+        found = self.by_name.get(name)
+        return found if found is not None else self.aliases.get(name)
+
+    def get_or_create(self, id_num: int, name: str, model_id: str = None, **fields) -> Tuple[E, bool]:
+        """
+        (entity, whether it was just created). fields are only used to create it, along with model_id, the id the
+        model keeps (id_num as a string if None)
+        """
+        if id_num:
+            entity = self.by_id.get(id_num)
+            if entity is not None:
+                if entity.name != name and name not in self.aliases:
+                    self.aliases[self.intern(name)] = entity
+                return entity, False
+
+        key = name
+        entity = self.by_name.get(name)
+        if entity is not None:
+            known = self._ids[name]
+            if not id_num:
+                return entity, False
+            if not known:
+                # first seen behind the question mark icon, it has an id now
+                self._ids[name] = id_num
+                self.by_id[id_num] = entity
+                entity.id_num = str(id_num)
+                return entity, False
+            key = f"{name} ({id_num})"
+
+        name = self.intern(name)
+        entity = share_fields_set(
+            self.entity(
+                name=name,
+                id_num=model_id if model_id is not None else str(id_num),
+                seen_in=BattleSet(self.battles),
+                **fields,
+            )
+        )
+        self.by_name[self.intern(key)] = entity
+        self._ids[key] = id_num
+        if id_num:
+            self.by_id[id_num] = entity
+        return entity, True
@@ -0,0 +1,173 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import Future
+from typing import Dict, Iterable, List
+
+from pyppeteer import launch
+
+from br.instrument import count
+from br.mapping import INDIVIDUAL_PARTICIPANT, TEAM_SIDE, TEAM_TOTALS
+from br.util import cached_key, is_cached, rebase, save_cache
+
+# the page is done once both team columns and their participants are in the DOM and the participant count has
+# stopped changing between two polls
+PAGE_READY_JS = f"""
+() => {{
+    const sides = document.querySelectorAll("div.{TEAM_SIDE}").length;
+    const totals = document.querySelectorAll("div.{TEAM_TOTALS}").length;
+    const participants = document.querySelectorAll("div.{INDIVIDUAL_PARTICIPANT}").length;
+    if (sides < 2 || totals < 1 || participants < 1) {{
+        return false;
+    }}
+    const stable = window.__brParticipants === participants;
+    window.__brParticipants = participants;
+    return stable;
+}}
+"""
+
+
+class RenderPool:
+    """
+    Keeps one headless chromium alive with `tabs` reusable pages and renders br pages on them.
+
+    The browser runs on its own event loop in a background thread, so the sync parser can call render(url) or
+    submit(url) and get a concurrent.futures.Future back. A render finishes as soon as the team and participant
+    containers from br/mapping.py are in the DOM, or after `timeout` seconds whatever state the page is in.
+
+    poll_interval: seconds between DOM checks, the participant count has to hold still for one interval
+    """
+
+    def __init__(self, tabs: int = 4, timeout: float = 30.0, poll_interval: float = 0.25, save: bool = True):
+        self.tabs = tabs
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self.save = save
+
+        self.rendered = 0
+        self.render_seconds: List[float] = []
+
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="br-render", daemon=True)
+        self._thread.start()
+        self._browser = None
+        self._pages = None
+        self._pending: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self._closed = False
+
+        self._run(self._start()).result()
+
+    def _run(self, coroutine) -> Future:
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop)
+
+    async def _start(self):
+        # signal handlers can only be installed from the main thread
+        self._browser = await launch(
+            headless=True, args=["--no-sandbox"], handleSIGINT=False, handleSIGTERM=False, handleSIGHUP=False
+        )
+        self._pages = asyncio.Queue()
+        for _ in range(self.tabs):
+            await self._pages.put(await self._browser.newPage())
+
+    async def _render(self, url: str) -> str:
+        page = await self._pages.get()
+        started = time.monotonic()
+        try:
+            await page.goto(rebase(url), waitUntil="domcontentloaded", timeout=int(self.timeout * 1000))
+            try:
+                await page.waitForFunction(
+                    PAGE_READY_JS, polling=int(self.poll_interval * 1000), timeout=int(self.timeout * 1000)
+                )
+            except asyncio.TimeoutError:
+                print(f"{url} did not finish rendering in {self.timeout}s, using what was there")
+            html = await page.content()
+        except Exception:
+            # a crashed tab gets replaced so the pool keeps its size
+            await page.close()
+            page = await self._browser.newPage()
+            raise
+        finally:
+            await self._pages.put(page)
+
+        self.render_seconds.append(time.monotonic() - started)
+        self.rendered += 1
+        count("pages_rendered")
+        if self.save:
+            save_cache(url, html.encode("utf-8"))
+        return html
+
+    def submit(self, url: str) -> Future:
+        """
+        starts rendering url and returns a future for the html. A url that is already rendering shares its future
+        """
+        if self._closed:
+            raise RuntimeError("RenderPool is closed")
+
+        key = cached_key(url)
+        with self._lock:
+            future = self._pending.get(key)
+            if future is None:
+                future = self._run(self._render(url))
+                self._pending[key] = future
+                future.add_done_callback(lambda _: self._forget(key))
+        return future
+
+    def _forget(self, key: str):
+        with self._lock:
+            self._pending.pop(key, None)
+
+    def render(self, url: str) -> str:
+        return self.submit(url).result()
+
+    def prerender(self, urls: Iterable[str]) -> List[Future]:
+        """
+        queues every url without a cached page, they render `tabs` at a time in the background
+        """
+        return [self.submit(url) for url in urls if not is_cached(url)]
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        with self._lock:
+            pending = list(self._pending.values())
+        for future in pending:
+            future.cancel()
+
+        async def shutdown():
+            if self._browser is not None:
+                await self._browser.close()
+
+        try:
+            self._run(shutdown()).result(timeout=self.timeout)
+        finally:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._loop.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+
+RENDER_POOL: RenderPool = None
+
+
+def get_render_pool(tabs: int = 4) -> RenderPool:
+    """
+    the shared pool, started on first use
+    """
+    global RENDER_POOL
+    if RENDER_POOL is None:
+        RENDER_POOL = RenderPool(tabs=tabs)
+    return RENDER_POOL
+
+
+def close_render_pool():
+    global RENDER_POOL
+    if RENDER_POOL is not None:
+        RENDER_POOL.close()
+        RENDER_POOL = None
@@ -0,0 +1,285 @@
+import json
+import random
+import re
+import threading
+import time
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+
+import requests
+
+from br.cache_store import CacheStore, get_cache_store
+from br.util import EVETOOLS_BASE_URL, cached_key
+
+ERROR_STATUS = [500, 502, 503]
+# the rendered pages still carry the app's scripts, which would rebuild the page and go looking for br.evetools.org
+SCRIPT_TAG = re.compile(rb"<script\b[^>]*>.*?</script>", re.IGNORECASE | re.DOTALL)
+
+
+@dataclass
+class ReplayStats:
+    requests: int = 0
+    served: int = 0
+    missing: int = 0
+    rate_limited: int = 0
+    errors: int = 0
+    recorded: int = 0
+    by_status: Dict[int, int] = field(default_factory=dict)
+
+    def report(self) -> str:
+        return (
+            f"{self.requests} requests: {self.served} served, {self.missing} missing, {self.rate_limited} rate "
+            f"limited, {self.errors} injected errors, {self.recorded} recorded"
+        )
+
+
+class ReplayServer:
+    """
+    Stands in for br.evetools.org, serving the api/v1/composition/get and api/v1/related jsons and the br and related
+    pages out of a cache store. Point the fetch engine and render pool at it with set_base_url(server.url) or the
+    EVETOOLS_BASE_URL environment variable.
+
+    latency/jitter: seconds every response is held for, latency +/- up to jitter
+    requests_per_second/burst: past this the server answers 429 with a Retry-After, None for no limit
+    error_rate: share of requests answered with a 500, 502 or 503
+    seed: for the same jitter, 429s and errors run to run
+    record: anything not in the store is pulled from br.evetools.org (pages through the render pool), saved to the
+        store and served, so a replay can be topped up with new brs
+    """
+
+    def __init__(
+        self,
+        store: CacheStore = None,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        requests_per_second: float = None,
+        burst: float = None,
+        error_rate: float = 0.0,
+        seed: int = None,
+        record: bool = False,
+        strip_scripts: bool = True,
+    ):
+        self.store = store if store is not None else get_cache_store()
+        self.latency = latency
+        self.jitter = jitter
+        self.requests_per_second = requests_per_second
+        self.burst = burst if burst is not None else max(1.0, requests_per_second or 1.0)
+        self.error_rate = error_rate
+        self.record = record
+        self.strip_scripts = strip_scripts
+        self.stats = ReplayStats()
+
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._render_pool = None
+
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "ReplayServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, name="br-replay", daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+        if self._render_pool is not None:
+            self._render_pool.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *_):
+        self.stop()
+
+    def _take_token(self) -> Optional[float]:
+        """
+        None if the request is allowed, otherwise seconds until it would be
+        """
+        if self.requests_per_second is None:
+            return None
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.requests_per_second)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return None
+            return (1 - self._tokens) / self.requests_per_second
+
+    def _delay(self) -> float:
+        with self._lock:
+            return max(0.0, self.latency + self._random.uniform(-self.jitter, self.jitter))
+
+    def _inject_error(self) -> Optional[int]:
+        with self._lock:
+            if self._random.random() < self.error_rate:
+                return self._random.choice(ERROR_STATUS)
+        return None
+
+    def lookup(self, path: str) -> Optional[bytes]:
+        """
+        the stored payload for a request path, recorded first if it is missing and record is on
+        """
+        url = f"{EVETOOLS_BASE_URL}{path}"
+        key = cached_key(url)
+        kind = "json" if path.startswith("/api/v1/") else "html"
+
+        payload = self.store.get(key, kind)
+        if payload is None and self.record:
+            payload = self._record(url, key, kind)
+        if payload is not None and kind == "html" and self.strip_scripts:
+            payload = SCRIPT_TAG.sub(b"", payload)
+        return payload
+
+    def _record(self, url: str, key: str, kind: str) -> Optional[bytes]:
+        if kind == "json":
+            response = requests.get(url, timeout=30)
+            if response.status_code != 200:
+                return None
+            payload = json.dumps(response.json()).encode("utf-8")
+        else:
+            # the page only has its teams once the app has run, so it is rendered rather than downloaded
+            from br.render import RenderPool
+
+            with self._lock:
+                if self._render_pool is None:
+                    self._render_pool = RenderPool(tabs=1, save=False)
+            payload = self._render_pool.render(url).encode("utf-8")
+
+        self.store.put(key, kind, payload)
+        with self._lock:
+            self.stats.recorded += 1
+        return payload
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                with server._lock:
+                    server.stats.requests += 1
+                time.sleep(server._delay())
+
+                retry_after = server._take_token()
+                if retry_after is not None:
+                    with server._lock:
+                        server.stats.rate_limited += 1
+                    return self._send(429, b"", {"Retry-After": f"{retry_after:.3f}"})
+
+                status = server._inject_error()
+                if status is not None:
+                    with server._lock:
+                        server.stats.errors += 1
+                    return self._send(status, b"")
+
+                payload = server.lookup(self.path)
+                if payload is None:
+                    with server._lock:
+                        server.stats.missing += 1
+                    return self._send(404, b"")
+
+                with server._lock:
+                    server.stats.served += 1
+                content_type = "application/json" if self.path.startswith("/api/v1/") else "text/html; charset=utf-8"
+                self._send(200, payload, {"Content-Type": content_type})
+
+            def _send(self, status: int, body: bytes, headers: Dict[str, str] = None):
+                with server._lock:
+                    server.stats.by_status[status] = server.stats.by_status.get(status, 0) + 1
+                self.send_response(status)
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+if __name__ == "__main__":
+    import argparse
+    import tempfile
+
+    from br.cache_store import CACHE_STORE_PATH, use_cache_store
+    from br.fetch import FetchEngine
+    from br.parsed_cache import has_page
+    from br.parser2 import load_br_links
+    from br.util import is_cached, set_base_url
+
+    parser = argparse.ArgumentParser(description="Replay br.evetools.org out of the cache store")
+    parser.add_argument("command", choices=["serve", "bench"], help="bench runs a fetch (or --pipeline) against it")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--store", default=CACHE_STORE_PATH, help="cache store to serve from")
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--jitter", type=float, default=0.1)
+    parser.add_argument("--server-rps", type=float, default=None, help="answer 429 past this many requests a second")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--record", action="store_true", help="pull and save whatever isn't in the store")
+    parser.add_argument("--limit", type=int, default=None, help="bench: only the first N links")
+    parser.add_argument("--rps", type=float, default=20.0, help="bench: the fetch engine's request budget")
+    parser.add_argument("--in-flight", type=int, default=8, help="bench: the fetch engine's concurrency")
+    parser.add_argument("--pipeline", action="store_true", help="bench: the whole parse into an empty cache")
+    parser.add_argument("--source", default="json", choices=["html", "json"], help="bench --pipeline: as main.py")
+    args = parser.parse_args()
+
+    replay = ReplayServer(
+        CacheStore(args.store),
+        port=args.port if args.command == "serve" else 0,
+        latency=args.latency,
+        jitter=args.jitter,
+        requests_per_second=args.server_rps,
+        error_rate=args.error_rate,
+        seed=args.seed,
+        record=args.record,
+    )
+
+    if args.command == "serve":
+        print(f"replaying {args.store} on {replay.url}, set {EVETOOLS_BASE_URL} to it with EVETOOLS_BASE_URL")
+        try:
+            replay.serve_forever()
+        except KeyboardInterrupt:
+            print(replay.stats.report())
+    else:
+        br_links = [url for url in load_br_links() if is_cached(url, get_json=True)][: args.limit]
+        with replay:
+            engine = FetchEngine(requests_per_second=args.rps, max_in_flight=args.in_flight, base_url=replay.url)
+            if args.pipeline:
+                from br.pipeline import Pipeline
+
+                if args.source == "html":
+                    br_links = [url for url in br_links if has_page(url)]
+                # everything goes through the server into a throw away store
+                set_base_url(replay.url)
+                with tempfile.TemporaryDirectory() as scratch:
+                    use_cache_store(CacheStore(f"{scratch}/cache.sqlite", migrate=False))
+                    pipeline = Pipeline(engine, source=args.source)
+                    pipeline.run(br_links)
+                    use_cache_store(None)
+                print(pipeline.stats.report())
+            else:
+                engine.use_cache = False
+                engine.prefetch(br_links)
+            print(engine.stats.report())
+        print(f"server: {replay.stats.report()}, statuses {replay.stats.by_status}")
@@ -0,0 +1,97 @@
+import hashlib
+import os
+import pickle
+from typing import List, Optional
+
+from br.parser2 import AllData
+
+SNAPSHOT_PATH = "output/all_data.pickle"
+# bump when the snapshot layout itself changes
+SNAPSHOT_VERSION = 3
+
+# everything that decides what a parsed br looks like. A change to any of these throws the snapshot away. whosewho.json
+# isn't one, teams are set from it after loading by br/classify.py
+SNAPSHOT_SOURCES = [
+    "br/parser2.py",
+    "br/mapping.py",
+    "br/util.py",
+    "br/html_backend.py",
+    "br/killmail_parser.py",
+    "br/names.py",
+    "br/records.py",
+    "br/parsed_cache.py",
+    "br/raw_json.py",
+    "br/registry.py",
+    "models/eve.py",
+    "models/battle_report_2.py",
+    "models/battle_set.py",
+    "models/string_table.py",
+    "data/sde.py",
+]
+
+
+def code_fingerprint(source: str = "html") -> str:
+    digest = hashlib.sha256(f"{SNAPSHOT_VERSION}:{source}".encode("utf-8"))
+    for path in SNAPSHOT_SOURCES:
+        digest.update(path.encode("utf-8"))
+        with open(path, "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def save_snapshot(database: AllData, br_links: List[str] = None, source: str = "html", path: str = SNAPSHOT_PATH):
+    """
+    br_links are the links database was parsed from, in the order they were parsed, including the ones that didn't
+    make a battle. Defaults to the links of its battles
+    """
+    if br_links is None:
+        br_links = [battle.br_link for battle in database.battles.values()]
+    snapshot = {
+        "version": SNAPSHOT_VERSION,
+        "fingerprint": code_fingerprint(source),
+        "br_links": list(br_links),
+        "all_data": database,
+    }
+    with open(f"{path}.tmp", "wb") as f:
+        pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(f"{path}.tmp", path)
+
+
+def load_snapshot(source: str = "html", path: str = SNAPSHOT_PATH) -> Optional[dict]:
+    """
+    the saved snapshot, or None if there isn't one or it was made by different parser code
+    """
+    if not os.path.isfile(path):
+        return None
+
+    try:
+        with open(path, "rb") as f:
+            snapshot = pickle.load(f)
+    except Exception as e:
+        # an unpicklable snapshot is usually one from before a model change
+        print(f"Could not load snapshot {path}, re-parsing: {e}")
+        return None
+
+    if snapshot.get("version") != SNAPSHOT_VERSION or snapshot.get("fingerprint") != code_fingerprint(source):
+        print("Parser code changed since the snapshot was saved, re-parsing")
+        return None
+    return snapshot
+
+
+def links_to_parse(snapshot: Optional[dict], br_links: List[str]) -> Optional[List[str]]:
+    """
+    the links still to parse on top of the snapshot, or None when everything has to be parsed again.
+
+    Entities keep what they looked like the first time they were seen, so the snapshot can only be added to when
+    every link it holds is still at the front of br_links in the same order. Anything else (a link removed or
+    inserted earlier in battle_reports.txt) re-parses so the result matches a full run
+    """
+    if snapshot is None:
+        return None
+
+    parsed = snapshot["br_links"]
+    br_links = list(dict.fromkeys(br_links))
+    if br_links[: len(parsed)] != parsed:
+        print("battle_reports.txt changed before its last new link, re-parsing")
+        return None
+    return br_links[len(parsed) :]
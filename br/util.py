@@ -1,13 +1,17 @@
 import json
 import os
 import re
-from pathlib import Path
-
-from bs4 import BeautifulSoup
+from typing import Optional
 
+from br.cache_store import get_cache_store
 from models.eve import StructureType
 from data.sde import JSPACE_STATICS
 
+EVETOOLS_BASE_URL = "https://br.evetools.org"
+# set to e.g. http://127.0.0.1:8765 to send every json fetch and page render to a stand-in server (see br/replay.py).
+# An environment variable so worker processes pick it up as well
+BASE_URL_ENV = "EVETOOLS_BASE_URL"
+
 
 def get_regex_groups(string, regex):
     r = re.compile(regex)
@@ -26,34 +30,61 @@ def cached_key(url):
 
 def save_cache(url, data, as_json: bool = False):
     key = cached_key(url)
-    Path(f"cache/{key}").mkdir(exist_ok=True)
     if as_json:
-        with open(f"cache/{key}/esi_data.json", "w") as f:
-
-            json.dump(data, f, indent=4)
+        get_cache_store().put(key, "json", json.dumps(data).encode("utf-8"))
     else:
-        with open(f"cache/{key}/br.html", "w", encoding="utf-8") as f:
-            f.write(data.decode("utf-8"))
+        get_cache_store().put(key, "html", data)
 
     return key
 
 
 def get_cache(url, get_json: bool = False):
     key = cached_key(url)
-    path = f"cache/{key}"
+    payload = get_cache_store().get(key, "json" if get_json else "html")
+    if payload is None:
+        raise FileNotFoundError(f"{key} has no cached {'json' if get_json else 'page'}")
 
     if get_json:
-        with open(f"{path}/esi_data.json", "r") as f:
-            return json.load(f)
-    else:
-        with open(f"{path}/br.html", "r") as f:
-            return BeautifulSoup(f, features="html.parser")
+        return json.loads(payload)
+    return payload.decode("utf-8")
 
 
 def skip_if_cached(url):
     key = cached_key(url)
-    path = f"cache/{key}"
-    return os.path.isdir(path) and len(os.listdir(path)) == 2
+    store = get_cache_store()
+    return store.has(key, "json") and store.has(key, "html")
+
+
+def is_cached(url, get_json: bool = False):
+    """
+    checks for just one half of a cache entry (the esi json or the rendered page), so a link whose json was
+    prefetched but whose page has not been rendered yet is not downloaded again
+    """
+    return get_cache_store().has(cached_key(url), "json" if get_json else "html")
+
+
+def get_base_url() -> str:
+    return os.environ.get(BASE_URL_ENV, EVETOOLS_BASE_URL).rstrip("/")
+
+
+def set_base_url(base_url: Optional[str]):
+    """
+    None goes back to br.evetools.org
+    """
+    if base_url is None:
+        os.environ.pop(BASE_URL_ENV, None)
+    else:
+        os.environ[BASE_URL_ENV] = base_url
+
+
+def rebase(url: str, base_url: str = None) -> str:
+    """
+    url on base_url (get_base_url() if None) instead of br.evetools.org. Cache keys are always taken from the
+    original url, so the same cache serves either host
+    """
+    if base_url is None:
+        base_url = get_base_url()
+    return url.replace(EVETOOLS_BASE_URL, base_url.rstrip("/"), 1)
 
 
 def get_cache_path(url):
@@ -105,6 +136,12 @@ def get_id_from_link(url) -> str:
     return "0"
 
 
+def get_killmail_id(url: str):
+    if url is None:
+        return None
+    return int(url.split("/")[-2])
+
+
 def is_saved_br(url):
     return "related" not in url
 
@@ -1,10 +1,12 @@
-import json
+from bisect import bisect_right
 from dataclasses import dataclass, field
 from datetime import datetime
 from enum import Enum
 from typing import Dict, List
 from dateutil import tz
 
+from data import load_json
+
 
 class Team(Enum):
     HAWKS = "Hawks"
@@ -40,6 +42,12 @@ class SideSwitch:
 
 @dataclass
 class WhoseWho:
+    """
+    The name lists from data/whosewho.json, compiled into lookups when loaded: name -> team for known_team and
+    suspected_team, sets for the all_* groups, and per switcher start sorted SideSwitch intervals with (name, date)
+    lookups memoized. Call reload() after editing whosewho.json to rebuild them
+    """
+
     NotInvolved: List[str] = field(default_factory=list)
     StarterCorps: List[str] = field(default_factory=list)
     JustStationTrash: List[str] = field(default_factory=list)
@@ -62,8 +70,10 @@ class WhoseWho:
     SystemsOfNote: Dict[str, str] = field(default_factory=dict)
 
     def __post_init__(self):
-        with open("data\whosewho.json", "r") as f:
-            data = json.load(f)
+        self.reload()
+
+    def reload(self):
+        data = load_json("whosewho.json")
 
         # corps to ignore
         self.NotInvolved = data["Not Involved"]
@@ -92,75 +102,100 @@ class WhoseWho:
         self.ThirdParty = data["Third Party"]
 
         self.SideSwitches = {
-            "Noob Corp Inc": [
-                SideSwitch(name="Noob Corp Inc", side=Team.HAWKS, end=datetime(2024, 4, 1, tzinfo=tz.UTC)),
-                SideSwitch(
-                    name="Noob Corp Inc",
-                    start=datetime(2024, 4, 1, tzinfo=tz.UTC),
-                    side=Team.COALITION,
-                ),
-            ],
-            "Seriously Suspicious": [
-                SideSwitch(name="Seriously Suspicious", side=Team.COALITION, end=datetime(2024, 4, 17, tzinfo=tz.UTC)),
-                SideSwitch(name="Seriously Suspicious", side=Team.HAWKS, start=datetime(2024, 4, 17, tzinfo=tz.UTC)),
-            ],
-            "Vapor Lock.": [
-                SideSwitch(name="Vapor Lock.", side=Team.COALITION, end=datetime(2024, 3, 27, tzinfo=tz.UTC)),
-                SideSwitch(name="Vapor Lock.", side=Team.NEUTRAL, start=datetime(2024, 3, 27, tzinfo=tz.UTC)),
-            ],
+            name: sorted(
+                [
+                    SideSwitch(
+                        name=name,
+                        side=Team(switch["side"]),
+                        start=_switch_date(switch.get("start"), datetime(1900, 1, 1, tzinfo=tz.UTC)),
+                        end=_switch_date(switch.get("end"), datetime(2999, 12, 31, tzinfo=tz.UTC)),
+                    )
+                    for switch in switches
+                ],
+                key=lambda switch: switch.start,
+            )
+            for name, switches in data["Side Switches"].items()
+            if not name.startswith("_")
         }
 
+        self._compile()
+
+    def _compile(self):
+        # first list wins, the same order known_team and suspected_team used to check them in
+        self._known = {}
+        for team, names in [
+            (Team.HAWKS, self.HawksKnown),
+            (Team.COALITION, self.CoalitionKnown),
+            (Team.NOT_INVOLVED, self.NotInvolved),
+            (Team.THIRD_PARTY, self.ThirdParty),
+        ]:
+            for name in names:
+                self._known.setdefault(name, team)
+
+        self._suspected = {}
+        for team, names in [(Team.HAWKS, self.HawksSuspected), (Team.COALITION, self.CoalitionSuspected)]:
+            for name in names:
+                self._suspected.setdefault(name, team)
+
+        self._all_hawks = frozenset([*self.HawksKnown, *self.HawksNull, *self.HawksSuspected])
+        self._all_coalition = frozenset([*self.CoalitionKnown, *self.CoalitionNull, *self.CoalitionSuspected])
+        self._all_not_involved = frozenset([*self.NotInvolved, *self.StarterCorps])
+        self._all_involved = self._all_hawks | self._all_coalition
+        self._all_known = self._all_involved | frozenset([*self.NotInvolved, *self.ThirdParty, *self.JustStationTrash])
+        self._switchers = frozenset(self.Switchers)
+
+        self._switch_starts = {name: [s.start for s in switches] for name, switches in self.SideSwitches.items()}
+        self._switch_cache = {}
+
     @property
-    def all_hawks(self) -> list:
-        return [*self.HawksKnown, *self.HawksNull, *self.HawksSuspected]
+    def all_hawks(self) -> frozenset:
+        return self._all_hawks
 
     @property
-    def all_coalition(self) -> list:
-        return [*self.CoalitionKnown, *self.CoalitionNull, *self.CoalitionSuspected]
+    def all_coalition(self) -> frozenset:
+        return self._all_coalition
 
     @property
-    def all_not_involved(self) -> list:
-        return [*self.NotInvolved, *self.StarterCorps]
+    def all_not_involved(self) -> frozenset:
+        return self._all_not_involved
 
     @property
-    def all_involved(self) -> list:
-        return [*self.all_hawks, *self.all_coalition]
+    def all_involved(self) -> frozenset:
+        return self._all_involved
 
     @property
-    def all_known(self) -> list:
-        return [*self.all_involved, *self.NotInvolved, *self.ThirdParty, *self.JustStationTrash]
+    def all_known(self) -> frozenset:
+        return self._all_known
+
+    def is_switcher(self, name) -> bool:
+        return name in self._switchers
 
     def which_team_for_switchers(self, name, date: datetime):
-        switch_dates = self.SideSwitches.get(name)
+        key = (name, date)
+        if key not in self._switch_cache:
+            self._switch_cache[key] = self._switch_side(name, date)
+        return self._switch_cache[key]
+
+    def _switch_side(self, name, date: datetime):
+        starts = self._switch_starts.get(name)
+        if starts is None:
+            return None
 
-        if switch_dates is not None:
-            for switch in switch_dates:
-                if date >= switch.start and date < switch.end:
-                    return switch.side
+        # the last switch starting at or before date is the only one that can hold it
+        idx = bisect_right(starts, date) - 1
+        if idx >= 0 and date < self.SideSwitches[name][idx].end:
+            return self.SideSwitches[name][idx].side
 
         return None
 
     def known_team(self, name):
-        if name in self.HawksKnown:
-            return Team.HAWKS
-
-        if name in self.CoalitionKnown:
-            return Team.COALITION
-
-        if name in self.NotInvolved:
-            return Team.NOT_INVOLVED
-
-        if name in self.ThirdParty:
-            return Team.THIRD_PARTY
-
-        return Team.UNKNOWN
+        return self._known.get(name, Team.UNKNOWN)
 
     def suspected_team(self, name):
+        return self._suspected.get(name, self.known_team(name))
 
-        if name in self.HawksSuspected:
-            return Team.HAWKS
-
-        if name in self.CoalitionSuspected:
-            return Team.COALITION
 
-        return self.known_team(name)
+def _switch_date(value: str, default: datetime) -> datetime:
+    if value is None:
+        return default
+    return datetime.strptime(value, "%Y-%m-%d").replace(tzinfo=tz.UTC)
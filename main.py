@@ -1,7 +1,16 @@
 import json
-from time import sleep
-from br.parser2 import parse_br2, load_br_links
-from br.util import skip_if_cached
+from br.aggregate import aggregate_additional_data
+from br.cache_gc import CACHE_BUDGET_MB, collect
+from br.classify import classify
+from br.fetch import FetchEngine
+from br.instrument import get_instruments, span, written
+from br.names import get_name_table
+from br.parallel import parse_parallel
+from br.parser2 import AllData, load_br_links
+from br.pipeline import Pipeline
+from br.render import close_render_pool, get_render_pool
+from br.snapshot import links_to_parse, load_snapshot, save_snapshot
+from br.parsed_cache import has_page
 from plot_builder.output import build_scatter
 from plot_builder.to_json import generate_output_totals
 import os
@@ -9,46 +18,104 @@ import os
 os.environ["PYPPETEER_CHROMIUM_REVISION"] = "1263111"
 
 
-def parse_battles2(br_links):
+def parse_battles2(
+    br_links,
+    requests_per_second: float = 2.0,
+    render_tabs: int = 4,
+    source: str = "html",
+    workers: int = 1,
+    database: AllData = None,
+    parse_threads: int = 1,
+):
+    """
+    source="json" builds every battle from the killmail json alone and never starts the browser
+
+    workers > 1 fills the cache first and then reads the brs in that many processes (see br/parallel.py). Otherwise
+    the fetch, parse and merge overlap in a pipeline (see br/pipeline.py) with parse_threads reading pages
+
+    database is added to if given, such as one loaded from the snapshot
+
+    returns the database and the links it went through, every one of them whether or not it ended up as a battle
+    """
     PROCESS_LIST = br_links  # new
 
-    first = True
-    battle_data = None
-    for idx, br in enumerate(PROCESS_LIST):
-        if first:
-            battle_data = parse_br2(br, battle_data)
-            first = False
+    # json for every link is pulled concurrently and handed over in battle_reports.txt order as it arrives
+    engine = FetchEngine(requests_per_second=requests_per_second)
+
+    # pages not in the cache yet start rendering in the background, get_page picks up the finished ones
+    uncached_pages = [br for br in PROCESS_LIST if not has_page(br)] if source == "html" else []
+    if len(uncached_pages) > 0:
+        get_render_pool(tabs=render_tabs).prerender(uncached_pages)
+
+    battle_data = database
+    try:
+        if workers > 1:
+            # the workers only read from cache/, so every page has to be there first. parse_parallel fetches the
+            # jsons that aren't
+            if len(uncached_pages) > 0:
+                for rendered in get_render_pool(tabs=render_tabs).prerender(uncached_pages):
+                    rendered.result()
+            battle_data = parse_parallel(
+                PROCESS_LIST, workers=workers, database=battle_data, source=source, engine=engine
+            )
         else:
-            if not skip_if_cached(br):
-                sleep(3)
-            print(f"Retrieving and parsing {br}...")
-            parse_br2(br, battle_data)
-            print(f"...Done (Completed {idx} of {len(PROCESS_LIST)-1}) \n")
+            pipeline = Pipeline(engine, parse_workers=parse_threads, source=source)
+            battle_data = pipeline.run(PROCESS_LIST, battle_data)
+            print(pipeline.stats.report())
+    finally:
+        close_render_pool()
+        # html parses teach it names, json parses look up the rest with esi
+        get_name_table().save()
 
-    return battle_data
+    print(engine.stats.report())
+    return battle_data, list(dict.fromkeys(PROCESS_LIST))
 
 
 if __name__ == "__main__":
-    existing_battles = None  # future for picking battle data
-
     br_links = load_br_links()
 
-    if existing_battles is None or len(existing_battles.battles) > len(br_links):
-        battles = parse_battles2(br_links)
-        print("Saving data...\n")
+    # only the links added since the last run are parsed, on top of the saved AllData
+    with span("load_snapshot"):
+        snapshot = load_snapshot()
+    new_links = links_to_parse(snapshot, br_links)
+    existing_battles = snapshot["all_data"] if new_links is not None else None
+
+    if existing_battles is None or len(new_links) > 0:
+        if existing_battles is not None:
+            print(f"Adding {len(new_links)} new BR links to the {len(existing_battles.battles)} already parsed")
+        to_parse = br_links if existing_battles is None else new_links
+        with span("parse_battles2", items=len(to_parse)):
+            battles, parsed_links = parse_battles2(to_parse, database=existing_battles)
+        if existing_battles is not None:
+            parsed_links = snapshot["br_links"] + parsed_links
+        with span("save_snapshot"):
+            # the links, not the battles, links_to_parse checks against. A link that didn't make a battle (failed
+            # fetch, br gone upstream) would otherwise leave a gap and every later run would re-parse everything
+            save_snapshot(battles, br_links=parsed_links)
+        if CACHE_BUDGET_MB is not None:
+            # trims back what this run added, never anything a battle in battle_reports.txt still needs
+            with span("cache_gc"):
+                collect(br_links)
+    else:
+        print("No new BR links found, loading cache")
+        battles = existing_battles
 
+    # teams are worked out from whosewho.json fresh every run, so edits to it show up without a re-parse
+    with span("classify", items=len(battles.battles)):
+        classify(battles)
+    with span("aggregate_additional_data", items=len(battles.battles)):
+        aggregate_additional_data(battles)
+
+    print("Saving data...\n")
+    with span("get_station_owners", items=len(battles.structures)):
         with open("output/structure_owners.json", "w") as f:
             json.dump(battles.get_station_owners(), f, indent=4)
+        written("output/structure_owners.json")
 
+    with span("generate_output_totals"):
         generate_output_totals(battles)
-
-        # with open(pickled_data_file, "wb") as f:
-        #     pickle.dump(battles, f)
-        # with open("output/war_to_date.json", "w") as f:
-        #     json.dump(battles.convert(), f, indent=4)
-    else:
-        print("No new BR links found, loading cache")
-        battles = existing_battles
+    # with open("output/war_to_date.json", "w") as f:
+    #     json.dump(battles.convert(), f, indent=4)
 
     # print("Generating calculations...\n")
     # alliances, systems, holding_corps, probable_friends, ships, probably_just_trash = calculate_lists(battles)
@@ -67,4 +134,9 @@ if __name__ == "__main__":
 
     print("creating timeline plot")
 
-    fig = build_scatter(battles)
+    with span("build_scatter"):
+        fig = build_scatter(battles)
+
+    # output/run_report.json, plus output/profiles/ for any span named in br/instrument.py PROFILE_SPANS
+    get_instruments().save()
+    print(get_instruments().summary())
@@ -4,7 +4,7 @@ from datetime import datetime, timedelta
 from math import floor
 from typing import Any, Dict, List, Optional, Tuple, Set
 
-from pydantic import BaseModel, field_serializer, model_serializer
+from pydantic import BaseModel, ConfigDict, Field, PrivateAttr, field_serializer, model_serializer
 
 from models.eve import (
     EveAlliance,
@@ -12,19 +12,32 @@ from models.eve import (
     EveSystem,
     StructureType,
 )
+from br.raw_json import RawJson
 from data.teams import Team, WhoseWho
+from models.battle_set import BattleSet
+from models.string_table import CodedStrings, StringTable
 
 WHOSE_WHO = WhoseWho()
 
 
 class Battle2(BaseModel):
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
     battle_identifier: str
     br_link: str
     time_data: BattleTime
     system: EveSystem
     teams: List[TeamReport]
     br_totals: BattleReportTotals
-    raw_json: Optional[dict]
+    # a handle rather than the payload, see raw_json
+    raw: Optional[RawJson] = Field(default=None, exclude=True)
+
+    @property
+    def raw_json(self) -> Optional[dict]:
+        """
+        the evetools json, read back from the cache when asked for and kept in a bounded LRU (br/raw_json.py)
+        """
+        return self.raw.load() if self.raw is not None else None
 
     @model_serializer
     def ser_model(self):
@@ -86,20 +99,41 @@ class BattleTime(BaseModel):
         return f"{hours} {mins}m".strip()
 
 
+def _coded(data: dict) -> CodedStrings:
+    return CodedStrings(data["strings"])
+
+
 class TeamReport(BaseModel):
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
     br_team_letter: str
     team: Team = Team.UNKNOWN
-    alliances: List[str] = []
-    corps: List[str] = []
-    pilots: List[str] = []
-    ships: List[str] = []
-    ships_destroyed: List[str] = []
-    km_links: List[str] = []
-    pilots_podded: List[str] = []
-    _structures: List[EveStructure] = []
-    structure_history_ids: List[str] = []  # list of id's for Structure History entries
-    totals: BattleReportResults = BattleReportResults(isk_lost=0, ships_lost=0, total_pilots=0)
+    # the war's string table (AllData.strings), the participant lists below are coded against it
+    strings: StringTable = Field(default_factory=StringTable, exclude=True, repr=False)
+    alliances: CodedStrings = Field(default_factory=_coded)
+    corps: CodedStrings = Field(default_factory=_coded)
+    pilots: CodedStrings = Field(default_factory=_coded)
+    ships: CodedStrings = Field(default_factory=_coded)
+    ships_destroyed: CodedStrings = Field(default_factory=_coded)
+    # one per row, None for those that weren't lost. Near enough every link is different, coding them would only
+    # add a table entry for each
+    km_links: List[Optional[str]] = Field(default_factory=list)
+    pilots_podded: CodedStrings = Field(default_factory=_coded)
+    _structures: List[EveStructure] = PrivateAttr(default_factory=list)
+    structure_history_ids: List[str] = Field(default_factory=list)  # list of id's for Structure History entries
+    totals: BattleReportResults = Field(
+        default_factory=lambda: BattleReportResults(isk_lost=0, ships_lost=0, total_pilots=0)
+    )
     structure_destroyed: bool = False
+    # (alliance or None, corp): participants, in the order first seen. team is set from these by br/classify.py
+    affiliations: Dict[Tuple[Optional[str], str], int] = Field(default_factory=dict)
+    structure_owner: Optional[Tuple[Optional[str], str]] = None  # (alliance, corp) of the last structure on this side
+    # "<structure type>-<n>": km ids this side lost after its nth structure died, see br/aggregate.py
+    probable_trash: Dict[str, List[int]] = Field(default_factory=dict)
+    # structure fighters flown with no structure on the br: (alliance, corp) they came from and the timers that
+    # structure could be on, see br/aggregate.py
+    fighters_owner: Optional[Tuple[Optional[str], str]] = None
+    unknown_timers: List[StructureTimer] = Field(default_factory=list)
 
     @property
     def structures(self):
@@ -109,12 +143,12 @@ class TeamReport(BaseModel):
     def ser_model(self):
         return {
             "team:": self.team.value,
-            "alliances": list(set(self.alliances)),
-            "corps": list(set(self.corps)),
-            "pilots": list(set(self.pilots)),
-            "pilots_podded": list(set(self.pilots_podded)),
-            "ships": self.ships,
-            "ships_destroyed": self.ships_destroyed,
+            "alliances": self.alliances.distinct(),
+            "corps": self.corps.distinct(),
+            "pilots": self.pilots.distinct(),
+            "pilots_podded": self.pilots_podded.distinct(),
+            "ships": list(self.ships),
+            "ships_destroyed": list(self.ships_destroyed),
             "structures": self.structures,
             "was_structure_destroyed": self.structure_destroyed,
             "totals": self.totals,
@@ -140,15 +174,17 @@ class BattleReportTotals(BaseModel):
 
 
 class StructureHistory(BaseModel):
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
     id_number: str
     name: Optional[str] = None
     type: StructureType
     is_large: bool
     system: str
-    team: Team
+    team: Team = Team.UNKNOWN
     alliance: Optional[str] = None
     corp: str
-    dates: List[datetime] = []
+    dates: List[datetime] = Field(default_factory=list)
     value: float = 0
     zkill_link: Optional[str] = None
     multiple_in_system: int = 0
@@ -156,7 +192,7 @@ class StructureHistory(BaseModel):
     armor_attacked_on: Optional[datetime] = None  # medium station destroyed on
     hull_attacked_on: Optional[datetime] = None  # large_station destroyed on
     estimated_timers: Optional[List[StructureTimer]] = None
-    br_ids: Set[str] = set()
+    br_ids: BattleSet = Field(default_factory=BattleSet)
 
     @property
     def destroyed_on(self) -> datetime:
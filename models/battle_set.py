@@ -0,0 +1,124 @@
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional
+
+
+class BattleIndex:
+    """
+    Gives every battle a dense position, in the order they are merged, so which battles something was in can be kept
+    as one int with a bit per battle (see BattleSet). started is kept per position for BattleSet.latest()
+    """
+
+    def __init__(self):
+        self.ids: List[str] = []
+        self.positions: Dict[str, int] = {}
+        self.started: List[Optional[datetime]] = []
+        # latest start among positions 0..n, rebuilt when a date changes
+        self._reach: Optional[List[Optional[datetime]]] = None
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def position(self, br_id: str) -> int:
+        found = self.positions.get(br_id)
+        if found is None:
+            found = self.positions[br_id] = len(self.ids)
+            self.ids.append(br_id)
+            self.started.append(None)
+            self._reach = None
+        return found
+
+    def add(self, br_id: str, started: datetime = None) -> int:
+        position = self.position(br_id)
+        if started is not None and self.started[position] != started:
+            self.started[position] = started
+            self._reach = None
+        return position
+
+    def reach(self) -> List[Optional[datetime]]:
+        if self._reach is None:
+            reach, latest = [], None
+            for started in self.started:
+                if started is not None and (latest is None or started > latest):
+                    latest = started
+                reach.append(latest)
+            self._reach = reach
+        return self._reach
+
+
+class BattleSet:
+    """
+    The battles an entity was seen (or podded) in, as a bitmap over a BattleIndex. Adds and lookups are a shift and
+    an or, len is a popcount, and &, | and - against another BattleSet on the same index are single int operations.
+    Iterates br ids in merge order
+    """
+
+    __slots__ = ("index", "mask")
+
+    def __init__(self, index: BattleIndex = None, mask: int = 0):
+        self.index = index if index is not None else BattleIndex()
+        self.mask = mask
+
+    def add(self, br_id: str):
+        self.mask |= 1 << self.index.position(br_id)
+
+    def update(self, other: "BattleSet"):
+        self.mask |= self._other(other).mask
+
+    def __contains__(self, br_id: str) -> bool:
+        position = self.index.positions.get(br_id)
+        return position is not None and (self.mask >> position) & 1 == 1
+
+    def __len__(self) -> int:
+        return self.mask.bit_count()
+
+    def __bool__(self) -> bool:
+        return self.mask != 0
+
+    def __iter__(self) -> Iterator[str]:
+        mask = self.mask
+        ids = self.index.ids
+        while mask:
+            low = mask & -mask
+            yield ids[low.bit_length() - 1]
+            mask ^= low
+
+    def _other(self, other: "BattleSet") -> "BattleSet":
+        if other.index is not self.index:
+            raise ValueError("BattleSets over different BattleIndexes can't be combined")
+        return other
+
+    def __and__(self, other: "BattleSet") -> "BattleSet":
+        return BattleSet(self.index, self.mask & self._other(other).mask)
+
+    def __or__(self, other: "BattleSet") -> "BattleSet":
+        return BattleSet(self.index, self.mask | self._other(other).mask)
+
+    def __sub__(self, other: "BattleSet") -> "BattleSet":
+        return BattleSet(self.index, self.mask & ~self._other(other).mask)
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, BattleSet) and other.index is self.index and other.mask == self.mask
+
+    def __repr__(self) -> str:
+        return repr(set(self))
+
+    def latest(self) -> Optional[str]:
+        """
+        br id of the battle that started last. Positions are merge order, which is nearly date order, so this walks
+        down from the highest bit and stops as soon as nothing at or below a position started later than the best so
+        far - usually after one or two bits
+        """
+        reach = self.index.reach()
+        started = self.index.started
+        best, best_started = None, None
+        mask = self.mask
+        while mask:
+            position = mask.bit_length() - 1
+            if best_started is not None and (reach[position] is None or reach[position] <= best_started):
+                break
+            if best is None or (
+                started[position] is not None and (best_started is None or started[position] > best_started)
+            ):
+                best, best_started = position, started[position]
+            mask ^= 1 << position
+        return self.index.ids[best] if best is not None else None
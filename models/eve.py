@@ -3,8 +3,24 @@ from __future__ import annotations
 from enum import Enum
 from typing import Dict, List, Optional, Tuple, Union, Set
 from data.teams import Team
+from models.battle_set import BattleSet
 from datetime import datetime
-from pydantic import BaseModel, field_serializer, field_validator, ValidationError
+from pydantic import BaseModel, ConfigDict, Field, field_serializer, field_validator, ValidationError
+
+# model class -> the fields set its instances share, see share_fields_set
+_FIELDS_SETS: Dict[type, set] = {}
+
+
+def share_fields_set(model: BaseModel) -> BaseModel:
+    """
+    pydantic keeps a set of the field names given to each instance, 700 bytes once it holds more than four - more
+    than most entities' values. Nothing here reads it (no exclude_unset or model_copy), so the models the parse
+    builds share one per class. Assigning a field adds its name to the shared set, which only ever holds field names
+    """
+    shared = _FIELDS_SETS.setdefault(type(model), set())
+    shared.update(model.__pydantic_fields_set__)
+    object.__setattr__(model, "__pydantic_fields_set__", shared)
+    return model
 
 
 class System(BaseModel):
@@ -45,10 +61,12 @@ class System(BaseModel):
 
 
 class EveEntity(BaseModel):
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
     name: Optional[str]
     image_link: Optional[str] = None
     id_num: str
-    seen_in: Set[str] = set()
+    seen_in: BattleSet = Field(default_factory=BattleSet)
 
     @property
     def appearances(self) -> int:
@@ -62,7 +80,7 @@ class EveEntity(BaseModel):
         return str(v)
 
     @field_serializer("seen_in")
-    def serialize_set(self, seen_in: Set, _info):
+    def serialize_set(self, seen_in: BattleSet, _info):
         return list(seen_in)
 
 
@@ -74,15 +92,16 @@ class EveAlliance(EveEntity):
         name [str]: name of this Alliance
         image_link [str]: url to the image for this alliance
         id_num [str]: id for this entity
-        seen_in [List[str]]: a list of BR_identifiers this entity has been seen in
+        seen_in [BattleSet]: the BR_identifiers this entity has been seen in
 
     corp [List[str]]: a list of corp names
     """
 
-    corps: Set[str] = set()
+    corps: Set[str] = Field(default_factory=set)
     holding_for: Optional[str] = None
-    members: Dict[str, int] = {}
-    structures: Dict[str, Dict[str, dict]] = {}  # system name, station type, {(s)een, (d)estroyed, (g)unner}
+    members: Dict[str, int] = Field(default_factory=dict)
+    # system name, station type, {(s)een, (d)estroyed, (g)unner}
+    structures: Dict[str, Dict[str, dict]] = Field(default_factory=dict)
     is_only_corp: bool = False
     total_lost_isk: float = 0.0
     total_lost_ships: int = 0
@@ -100,21 +119,27 @@ class EveCorp(EveEntity):
         name [str]: name of this Alliance
         image_link [str]: url to the image for this alliance
         id_num [str]: id for this entity
-        seen_in [List[str]]: a list of BR_identifiers this entity has been seen in
+        seen_in [BattleSet]: the BR_identifiers this entity has been seen in
 
     alliance[Optional[str]]: name of the alliance
     has_no_alliance[bool]: if alliance is none, this is true
     """
 
     alliance: Optional[str] = None
-    members: Dict[str, int] = {}
-    pilots_per_battle: Dict[str, int] = {}  # br_link, total_pilots
-    ships: Dict[str, int] = {}  # ship name, appearances
-    structures: Dict[str, Dict[str, dict]] = {}  # system name, station type, {(s)een, (d)estroyed, (g)unner}
+    members: Dict[str, int] = Field(default_factory=dict)
+    # position of the battle in seen_in.index, total_pilots. Dumped by br id
+    pilots_per_battle: Dict[int, int] = Field(default_factory=dict)
+    ships: Dict[str, int] = Field(default_factory=dict)  # ship name, appearances
+    # system name, station type, {(s)een, (d)estroyed, (g)unner}
+    structures: Dict[str, Dict[str, dict]] = Field(default_factory=dict)
     holding_for: Optional[str] = None
     total_lost_isk: float = 0.0
     total_lost_ships: int = 0
 
+    @field_serializer("pilots_per_battle")
+    def serialize_per_battle(self, v: Dict[int, int], _info):
+        return {self.seen_in.index.ids[position]: pilots for position, pilots in v.items()}
+
     @property
     def has_no_alliance(self) -> bool:
         return self.alliance is None
@@ -128,22 +153,22 @@ class EvePilot(EveEntity):
         name [str]: name of this Alliance
         image_link [str]: url to the image for this alliance
         id_num [str]: id for this entity
-        seen_in [List[str]]: a list of BR_identifiers this entity has been seen in
+        seen_in [BattleSet]: the BR_identifiers this entity has been seen in
 
     corp [str]: the pilots corporation
     alliance [Optional[str]]: alliance for the pilot. Can be None
-    podded_in [set[str]] - br_ids that this pilot was podded in
+    podded_in [BattleSet] - br_ids that this pilot was podded in
     zkill_link[optional[str]] zkillboard link
     """
 
     corp: str
-    alliance: str
-    ships: Dict[str, int] = {}
-    podded_in: Set[str] = set()
+    alliance: Optional[str]
+    ships: Dict[str, int] = Field(default_factory=dict)
+    podded_in: BattleSet = Field(default_factory=BattleSet)
     zkill_link: Optional[str] = None
 
     @field_serializer("podded_in")
-    def serialize_set(self, v: Set, _info):
+    def serialize_set(self, v: BattleSet, _info):
         return list(v)
 
     @property
@@ -159,7 +184,7 @@ class EveShip(EveEntity):
         name [str]: name of this Alliance
         image_link [str]: url to the image for this alliance
         id_num [str]: id for this entity
-        seen_in [List[str]]: a list of BR_identifiers this entity has been seen in
+        seen_in [BattleSet]: the BR_identifiers this entity has been seen in
 
 
 
@@ -181,18 +206,20 @@ class EveStructure(EveEntity):
         name [str]: name of this Alliance
         image_link [str]: url to the image for this alliance
         id_num [str]: id for this entity
-        seen_in [List[str]]: a list of BR_identifiers this entity has been seen in
+        seen_in [BattleSet]: the BR_identifiers this entity has been seen in
 
     is_gunner_entry [bool]: this list on the BR was from a Gunner, not the station itself
     gunner_name [str]: the name of the gunner
     gunner_corp [str]: the corp of the gunner
     gunner_alliance [str]: the alliance of the gunner, may be none
     multiple_killed [str]: if the br said x#
+    km_link [str]: the killmail it died on, if destroyed_here
     """
 
     type: StructureType
     structure_history_id: Optional[str]
     destroyed_here: bool = False
+    km_link: Optional[str] = None
     value: float = 0.0
     is_gunner_entry: bool = False
     gunner_name: Optional[str] = None
@@ -215,7 +242,7 @@ class EveSystem(EveEntity):
         name [str]: name of this Alliance
         image_link [str]: url to the image for this alliance
         id_num [str]: id for this entity
-        seen_in [List[str]]: a list of BR_identifiers this entity has been seen in
+        seen_in [BattleSet]: the BR_identifiers this entity has been seen in
     region: region if known
     constellation: constellation if known
     weather - wormhole weather
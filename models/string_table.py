@@ -0,0 +1,103 @@
+import threading
+from array import array
+from collections import Counter
+from typing import Dict, Iterable, Iterator, List, Optional
+
+
+class StringTable:
+    """
+    Every distinct string (names, km links) of a war once, with a dense int code for each. None gets a code like any
+    other value so the km links of rows that weren't lost can be coded too
+    """
+
+    def __init__(self):
+        self.codes: Dict[Optional[str], int] = {}
+        self.strings: List[Optional[str]] = []
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.strings)
+
+    def __getitem__(self, code: int) -> Optional[str]:
+        return self.strings[code]
+
+    def code(self, value: Optional[str]) -> int:
+        found = self.codes.get(value)
+        if found is None:
+            with self._lock:
+                found = self.codes.get(value)
+                if found is None:
+                    found = self.codes[value] = len(self.strings)
+                    self.strings.append(value)
+        return found
+
+    def intern(self, value: str) -> str:
+        """
+        the one copy of value the table keeps
+        """
+        return self.strings[self.code(value)]
+
+    def __getstate__(self):
+        return {"strings": self.strings}
+
+    def __setstate__(self, state):
+        self.strings = state["strings"]
+        self.codes = {value: code for code, value in enumerate(self.strings)}
+        self._lock = threading.Lock()
+
+
+class CodedStrings:
+    """
+    A list of strings kept as an array of StringTable codes, 4 bytes an entry. Reads like the list it replaces
+    (iteration, len, indexing give the strings); codes, counts() and distinct() are for consumers that only need
+    to count or dedupe. distinct() is worked out once and kept until the next append
+    """
+
+    __slots__ = ("table", "codes", "_distinct")
+
+    def __init__(self, table: StringTable = None, values: Iterable[Optional[str]] = ()):
+        self.table = table if table is not None else StringTable()
+        self.codes = array("i", [self.table.code(value) for value in values])
+        self._distinct = None
+
+    def append(self, value: Optional[str]):
+        self.codes.append(self.table.code(value))
+        self._distinct = None
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def __getitem__(self, idx: int) -> Optional[str]:
+        return self.table.strings[self.codes[idx]]
+
+    def __iter__(self) -> Iterator[Optional[str]]:
+        strings = self.table.strings
+        return (strings[code] for code in self.codes)
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, CodedStrings):
+            return list(self) == list(other)
+        return isinstance(other, list) and list(self) == other
+
+    def __repr__(self) -> str:
+        return repr(list(self))
+
+    def distinct(self) -> List[Optional[str]]:
+        """
+        each string once, in the order first seen
+        """
+        if self._distinct is None:
+            strings = self.table.strings
+            self._distinct = [strings[code] for code in dict.fromkeys(self.codes)]
+        return self._distinct
+
+    def counts(self) -> Dict[Optional[str], int]:
+        strings = self.table.strings
+        return {strings[code]: total for code, total in Counter(self.codes).items()}
+
+    def __getstate__(self):
+        return self.table, self.codes
+
+    def __setstate__(self, state):
+        self.table, self.codes = state
+        self._distinct = None
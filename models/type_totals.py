@@ -232,15 +232,14 @@ class ShipTotals(EntityTraceTotal):
             team=use_team,
         )
 
-        for ship in [v for v in team.ships]:
+        # counted on the codes, so each distinct ship is only checked once
+        for ship, total in team.ships.counts().items():
             if self._is_valid(ship):
-                entity_totals.totals.setdefault(ship, 0)
-                entity_totals.totals[ship] += 1
+                entity_totals.totals[ship] = entity_totals.totals.get(ship, 0) + total
 
-        for ship in [v for v in team.ships_destroyed]:
+        for ship, total in team.ships_destroyed.counts().items():
             if self._is_valid(ship):
-                entity_totals.totals_destroyed.setdefault(ship, 0)
-                entity_totals.totals_destroyed[ship] += 1
+                entity_totals.totals_destroyed[ship] = entity_totals.totals_destroyed.get(ship, 0) + total
 
         if use_team in self.y_values:
             self.y_values[use_team] += entity_totals
@@ -4,6 +4,7 @@ from plot_builder.timeline import build_timeline_page
 from plot_builder.daily_totals import build_totals_page
 from plot_builder.type_totals import build_ships_totals
 import re
+from br.instrument import span, written
 from br.parser2 import AllData
 import webbrowser
 import os
@@ -11,21 +12,26 @@ import os
 
 def build_scatter(all_data: AllData):  ## attempt to add onclick go to battle report
     print("creating timeline plot")
-    fig = build_timeline_page(all_data)
-    file_path = "docs/timeline.html"
-    build_onclick_link_html(fig, "customdata[0]", file_path)
+    with span("timeline", items=len(all_data.battles)):
+        fig = build_timeline_page(all_data)
+        file_path = "docs/timeline.html"
+        build_onclick_link_html(fig, "customdata[0]", file_path)
     webbrowser.open("file://" + os.path.realpath(file_path))
 
     print("creating totals data")
-    fig2 = build_totals_page(all_data)
-    file_path2 = "docs/totals.html"
+    with span("totals", items=len(all_data.battles)):
+        fig2 = build_totals_page(all_data)
+        file_path2 = "docs/totals.html"
+        fig2.write_html(file_path2)
+        written(file_path2)
     fig2.show()
-    fig2.write_html(file_path2)
 
-    fig3 = build_ships_totals(all_data)
-    file_path3 = "docs/type_totals.html"
+    with span("type_totals", items=len(all_data.battles)):
+        fig3 = build_ships_totals(all_data)
+        file_path3 = "docs/type_totals.html"
+        fig3.write_html(file_path3)
+        written(file_path3)
     fig3.show()
-    fig3.write_html(file_path3)
 
 
 def build_onclick_link_html(fig, link_value: str = "customdata[0]", file_name: str = "with_hyperlinks.html"):
@@ -71,3 +77,4 @@ def build_onclick_link_html(fig, link_value: str = "customdata[0]", file_name: s
 
     with open(file_name, "w", encoding="utf-8") as f:
         f.write(html_str)
+    written(file_name)
@@ -2,38 +2,57 @@ import json
 from models.battle_report_2 import Battle2
 from typing import List
 from models.eve import EveAlliance, EveCorp, EvePilot, EveShip
+from br.instrument import span, written
 from br.parser2 import AllData
 from data.teams import WhoseWho
 import json
 from datetime import datetime
-from dateutil import tz
 
 WHOSE_WHO = WhoseWho()
 
 
 def generate_output_totals(all_data: AllData):
 
-    t_shirt(all_data.systems)
+    with span("t_shirt", items=len(all_data.systems)):
+        t_shirt(all_data.systems)
 
     print("saving all_battle_reports.json")
-    battles_to_json(all_data.battles)
+    with span("battles_to_json", items=len(all_data.battles)):
+        battles_to_json(all_data.battles)
 
     print("\nbuilding alliance_appearances.json")
-    alliance_appearances(all_data)
+    with span("alliance_appearances", items=len(all_data.alliances)):
+        alliance_appearances(all_data)
 
     print("\nbuilding corp_appearances.json")
-    corp_appearances(all_data)
+    with span("corp_appearances", items=len(all_data.corps)):
+        corp_appearances(all_data)
 
     print("saving systems.json")
-    systems(all_data)
+    with span("systems", items=len(all_data.systems)):
+        systems(all_data)
 
     print("filtering alliances to just the big names in major_players.json")
-    big_names(all_data)
+    with span("big_names"):
+        big_names(all_data)
+
+    print("saving probable_trash.json")
+    with span("probable_trash"):
+        probable_trash(all_data)
+
+    print("saving unknown_timers.json")
+    with span("unknown_timers"):
+        unknown_timers(all_data)
+
+    print("saving overlapping_battles.json")
+    with span("overlapping_battles"):
+        overlapping_battles(all_data)
 
 
 def t_shirt(systems):
     with open("docs/jsons/all_systems_tshirt.txt", "w") as f:
         f.write(" ".join(systems.keys()))
+    written("docs/jsons/all_systems_tshirt.txt")
 
 
 def battles_to_json(all_battles: List[Battle2]):
@@ -47,6 +66,82 @@ def battles_to_json(all_battles: List[Battle2]):
 
     with open("docs/jsons/all_battle_reports.json", "w") as f:
         json.dump(output, f, indent=4)
+    written("docs/jsons/all_battle_reports.json")
+
+
+def probable_trash(all_data: AllData):
+    """
+    the kms br/aggregate.py thinks dropped out of a dying structure, per battle and side
+    """
+    trash = {}
+    for battle in all_data.battles.values():
+        teams = {team.br_team_letter: team.probable_trash for team in battle.teams if len(team.probable_trash) > 0}
+        if len(teams) > 0:
+            trash[battle.battle_identifier] = {"br_link": battle.br_link, "teams": teams}
+
+    output = {
+        "description": "Kms lost after a structure died, per battle, side and structure",
+        "last_compiled": datetime.today().strftime("%Y-%m-%d"),
+        "battles": trash,
+    }
+
+    with open("docs/jsons/probable_trash.json", "w") as f:
+        json.dump(output, f, indent=4)
+    written("docs/jsons/probable_trash.json")
+
+
+def unknown_timers(all_data: AllData):
+    """
+    timers estimated for structures that launched fighters without being on the br, see br/aggregate.py
+    """
+    timers = {}
+    for battle in all_data.battles.values():
+        for team in battle.teams:
+            if len(team.unknown_timers) == 0:
+                continue
+            alliance, corp = team.fighters_owner
+            timers[battle.battle_identifier] = {
+                "br_link": battle.br_link,
+                "system": battle.system.name,
+                "side": team.br_team_letter,
+                "alliance": alliance,
+                "corp": corp,
+                "timers": [timer.model_dump() for timer in team.unknown_timers],
+            }
+
+    output = {
+        "description": "Possible timers of structures whose fighters were on a br the structure itself wasn't",
+        "last_compiled": datetime.today().strftime("%Y-%m-%d"),
+        "battles": timers,
+    }
+
+    with open("docs/jsons/unknown_timers.json", "w") as f:
+        json.dump(output, f, indent=4)
+    written("docs/jsons/unknown_timers.json")
+
+
+def overlapping_battles(all_data: AllData):
+    """
+    battles sharing kms with an earlier one. Those kms count towards the earlier battle only
+    """
+    overlaps = {
+        br_id: {
+            "br_link": all_data.battles[br_id].br_link,
+            "counted_in": {all_data.battles[owner].br_link: kms for owner, kms in owners.items()},
+        }
+        for br_id, owners in all_data.overlaps.items()
+    }
+
+    output = {
+        "description": "Battles sharing killmails with an earlier battle, and how many they share",
+        "last_compiled": datetime.today().strftime("%Y-%m-%d"),
+        "killmails": len(all_data.killmails),
+        "battles": overlaps,
+    }
+
+    with open("docs/jsons/overlapping_battles.json", "w") as f:
+        json.dump(output, f, indent=4)
+    written("docs/jsons/overlapping_battles.json")
 
 
 def big_names(all_data):
@@ -125,16 +220,15 @@ def big_names(all_data):
 
 
 def find_last_battle(all_data, v):
+    br_identifier = v["battles"].latest()
     v["battles"] = list(v["battles"])
-    last_seen = datetime(year=1900, month=1, day=1, tzinfo=tz.UTC)
-    for battle in v["battles"]:
-        battle_date = all_data.battles[battle].time_data.started
-        if battle_date > last_seen:
-            last_seen = battle_date
-            br_link = all_data.battles[battle].br_link
-            br_identifier = battle
+    battle = all_data.battles[br_identifier]
 
-    v["last_seen"] = {"br_identifier": br_identifier, "br_link": br_link, "date": last_seen.strftime("%Y-%m-%d")}
+    v["last_seen"] = {
+        "br_identifier": br_identifier,
+        "br_link": battle.br_link,
+        "date": battle.time_data.started.strftime("%Y-%m-%d"),
+    }
 
 
 def add_to_this_major_player(team_affiliates, team_data, name, appearances):
@@ -154,7 +248,8 @@ def add_to_this_major_player(team_affiliates, team_data, name, appearances):
                     data["affiliated"].append(name)
                 data["isk_lost"] += appearances.total_lost_isk
                 data["ships_lost"] += appearances.total_lost_ships
-                data["battles"].update(appearances.seen_in)
+                # a new BattleSet, updating the first one in place would change that entity's seen_in
+                data["battles"] = data["battles"] | appearances.seen_in
 
             return True
 
@@ -208,6 +303,7 @@ def systems(all_data):
 
     with open("docs/jsons/system_appearances.json", "w") as f:
         json.dump(output, f, indent=4)
+    written("docs/jsons/system_appearances.json")
 
 
 def save_data(hawks, coalition, other, desc, file_name):
@@ -221,3 +317,4 @@ def save_data(hawks, coalition, other, desc, file_name):
 
     with open(file_name, "w") as f:
         json.dump(output, f, indent=4)
+    written(file_name)